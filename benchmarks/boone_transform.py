@@ -0,0 +1,39 @@
+'''
+PassportEye benchmarks: Boone transform.
+
+Compares BooneTransform with FastBooneTransform on the scaled-down images of the MRZ test data
+(at the widths used by the pipeline), checking that the results are identical.
+
+    $ python benchmarks/boone_transform.py [-n 20] [-dd DATA_DIR]
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import argparse, glob, os, time, pkg_resources
+import numpy as np
+from passporteye.mrz.image import Loader, Scaler, BooneTransform, FastBooneTransform
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the Boone transform implementations.')
+    parser.add_argument('-dd', '--data-dir', default=pkg_resources.resource_filename('passporteye.mrz', 'testdata'))
+    parser.add_argument('-n', '--repeat', default=20, type=int, help='Number of transforms per image and implementation')
+    args = parser.parse_args()
+
+    imgs = [Loader(fn)() for fn in sorted(glob.glob(os.path.join(args.data_dir, '*')))]
+    for max_width in [250, 1000]:
+        scaled = [Scaler(max_width)(img)[0] for img in imgs]
+        times, results = [], []
+        for transform in [BooneTransform(), FastBooneTransform()]:
+            tic = time.time()
+            for i in range(args.repeat):
+                result = [transform(img) for img in scaled]
+            times.append((time.time() - tic) / (args.repeat * len(scaled)))
+            results.append(result)
+        identical = all(np.array_equal(a, b) for a, b in zip(*results))
+        print("max_width=%-5d BooneTransform %6.2fms  FastBooneTransform %6.2fms  speedup %4.2fx  %s" % (
+              max_width, times[0]*1000, times[1]*1000, times[0]/times[1], 'identical' if identical else 'DIFFERENT'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''
+PassportEye benchmarks: MRZ box location.
+
+Compares MRZBoxLocator (contour tracing) with ComponentBoxLocator (connected component labeling) on the binarized
+images of the MRZ test data, as well as on the same images with speckle noise added (thousands of small components).
+Then compares the box merging of MRZBoxLocator with the original incremental (pairwise) merging on synthetic sets
+of text-line boxes, such as those found in scans of several documents with a large max_boxes.
+
+    $ python benchmarks/box_locator.py [-n 20] [--noise 0.02] [-dd DATA_DIR]
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import argparse, glob, os, time, pkg_resources
+import numpy as np
+from passporteye.mrz.image import Loader, Scaler, FastBooneTransform, MRZBoxLocator, ComponentBoxLocator
+from passporteye.util.geometry import RotatedBox
+
+
+class IncrementalMergeBoxLocator(MRZBoxLocator):
+    """MRZBoxLocator with the original box merging: merge the first mergeable pair, refit, start over."""
+
+    def _merge_boxes(self, box_list):
+        while self._merge_any_two_boxes(box_list):
+            pass
+        return box_list
+
+
+def text_line_boxes(n_documents, rng):
+    """Boxes of 1-3 parallel text lines (with contour-like points) at random places of a 2000x2000 image."""
+    boxes = []
+    for k in range(n_documents):
+        center, angle = rng.uniform(0, 2000, 2), rng.uniform(1.4, 1.7)
+        width, height = rng.uniform(100, 300), rng.uniform(8, 14)
+        for line in range(rng.randint(1, 4)):
+            box = RotatedBox(center + 2*line*height*np.array([np.sin(angle), -np.cos(angle)]), width*rng.uniform(0.9, 1.1), height, angle)
+            corners = box.as_poly()
+            t = np.linspace(0, 1, 20)[:, None]
+            boxes.append(RotatedBox.from_points(np.vstack([p + t*(q - p) for p, q in zip(corners, np.roll(corners, -1, 0))])))
+    return boxes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the MRZ box locators.')
+    parser.add_argument('-dd', '--data-dir', default=pkg_resources.resource_filename('passporteye.mrz', 'testdata'))
+    parser.add_argument('-n', '--repeat', default=20, type=int, help='Number of runs per image and locator')
+    parser.add_argument('--noise', default=0.02, type=float, help='Fraction of pixels flipped in the noisy images')
+    args = parser.parse_args()
+
+    boone = FastBooneTransform()
+    binary = []
+    for fn in sorted(glob.glob(os.path.join(args.data_dir, '*'))):
+        img = Scaler()(Loader(fn)())[0]
+        binary.append(boone(img))
+    rng = np.random.RandomState(0)
+    noisy = [b ^ (rng.random_sample(b.shape) < args.noise) for b in binary]
+
+    for name, imgs in [('clean', binary), ('noisy', noisy)]:
+        times, counts = [], []
+        for locator in [MRZBoxLocator(), ComponentBoxLocator()]:
+            tic = time.time()
+            for i in range(args.repeat):
+                boxes = [locator(img) for img in imgs]
+            times.append((time.time() - tic) / (args.repeat * len(imgs)))
+            counts.append(sum(len(b) for b in boxes))
+        print("%s  MRZBoxLocator %6.2fms (%d boxes)  ComponentBoxLocator %6.2fms (%d boxes)  speedup %4.2fx" % (
+              name, times[0]*1000, counts[0], times[1]*1000, counts[1], times[0]/times[1]))
+
+    for n_documents in [10, 50, 150]:
+        boxes = text_line_boxes(n_documents, rng)
+        times, counts = [], []
+        for locator in [IncrementalMergeBoxLocator(), MRZBoxLocator()]:
+            tic = time.time()
+            for i in range(args.repeat):
+                merged = locator._merge_boxes(list(boxes))
+            times.append((time.time() - tic) / args.repeat)
+            counts.append(len(merged))
+        print("merging %3d boxes  incremental %8.2fms (%d boxes)  clustered %8.2fms (%d boxes)  speedup %5.2fx" % (
+              len(boxes), times[0]*1000, counts[0], times[1]*1000, counts[1], times[0]/times[1]))
+
+
+if __name__ == '__main__':
+    main()
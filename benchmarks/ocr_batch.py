@@ -0,0 +1,56 @@
+'''
+PassportEye benchmarks: batched OCR.
+
+Runs the MRZ pipeline on a directory of images with and without batch_ocr,
+reporting the number of OCR engine invocations, the walltime and the total score.
+Requires the tesseract tool.
+
+    $ python benchmarks/ocr_batch.py [-dd DATA_DIR]
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import argparse, glob, os, time, pkg_resources
+from passporteye.mrz.image import read_mrz
+from passporteye.util import ocr
+
+
+class CountingBackend(object):
+    """Wraps an OCR backend, counting the engine invocations."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.calls = 0
+
+    def __call__(self, img, mrz_mode=True):
+        self.calls += 1
+        return self.backend(img, mrz_mode)
+
+    def tsv(self, img, mrz_mode=True):
+        self.calls += 1
+        return self.backend.tsv(img, mrz_mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sequential and batched OCR in the MRZ pipeline.')
+    parser.add_argument('-dd', '--data-dir', default=pkg_resources.resource_filename('passporteye.mrz', 'testdata'),
+                        help='Read files from this directory instead of the package test files')
+    args = parser.parse_args()
+    files = sorted(glob.glob(os.path.join(args.data_dir, '*.*')))
+
+    backend = CountingBackend(ocr.get_backend())
+    ocr.set_backend(backend)
+    for batch_ocr in [False, True]:
+        backend.calls = 0
+        total_score = 0
+        tic = time.time()
+        for fn in files:
+            mrz = read_mrz(fn, batch_ocr=batch_ocr)
+            total_score += mrz.valid_score if mrz is not None else 0
+        walltime = time.time() - tic
+        print("batch_ocr=%-5s  OCR invocations: %4d  walltime: %0.2fs  total score: %d" %
+              (batch_ocr, backend.calls, walltime, total_score))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+'''
+PassportEye benchmarks: OCR transport.
+
+Compares the temp-file based "tesseract" invocation (TesseractCmdBackend) with the
+stdin/stdout one (TesseractPipeBackend) on a set of images. Requires the tesseract tool.
+
+    $ python benchmarks/ocr_transport.py [-n 10] [images...]
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import argparse, glob, os, time
+from skimage import io
+from passporteye.util.ocr import TesseractCmdBackend, TesseractPipeBackend
+
+
+def main():
+    default_images = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'tests', 'data', 'tesseract-test*')))
+    parser = argparse.ArgumentParser(description='Compare the OCR transports on a set of images.')
+    parser.add_argument('images', nargs='*', default=default_images)
+    parser.add_argument('-n', '--repeat', default=10, type=int, help='Number of OCR calls per image and backend')
+    args = parser.parse_args()
+
+    imgs = [io.imread(fn, as_gray=True) for fn in args.images]
+    for name, backend in [('tempfile', TesseractCmdBackend()), ('pipe', TesseractPipeBackend())]:
+        for img in imgs:
+            backend(img)  # Warm up the OS caches
+        tic = time.time()
+        for i in range(args.repeat):
+            for img in imgs:
+                backend(img)
+        walltime = time.time() - tic
+        print("%-10s %0.4fs per call" % (name, walltime / (args.repeat * len(imgs))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+'''
+PassportEye benchmarks: JPEG extraction from PDFs.
+
+Compares the object-graph walk of extract_first_jpeg_in_pdf (fast=True) with PDFMiner's layout analysis (fast=False).
+
+    $ python benchmarks/pdf_extraction.py [-n 20] [pdfs...]
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import argparse, glob, os, time
+from passporteye.util.pdf import extract_first_jpeg_in_pdf
+
+
+def main():
+    default_pdfs = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '..', 'tests', 'data', '*.pdf')))
+    parser = argparse.ArgumentParser(description='Compare the PDF image extraction methods on a set of PDFs.')
+    parser.add_argument('pdfs', nargs='*', default=default_pdfs)
+    parser.add_argument('-n', '--repeat', default=20, type=int, help='Number of extractions per file and method')
+    args = parser.parse_args()
+
+    for fn in args.pdfs:
+        results = []
+        for fast in [False, True]:
+            tic = time.time()
+            for i in range(args.repeat):
+                with open(fn, 'rb') as f:
+                    img = extract_first_jpeg_in_pdf(f, fast=fast)
+            results.append(((time.time() - tic) / args.repeat, img))
+        (slow_time, slow_img), (fast_time, fast_img) = results
+        print("%-25s pdfminer %8.2fms  fast %8.2fms  speedup %6.1fx  %s" % (
+              os.path.basename(fn), slow_time*1000, fast_time*1000, slow_time/fast_time,
+              'same result' if slow_img == fast_img else 'DIFFERENT RESULT'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+'''
+PassportEye benchmarks: concurrent pipeline execution.
+
+Compares read_mrz with and without a PipelineExecutor on the MRZ test data. With the executor, the candidate boxes
+of an image are processed concurrently. The OCR-B template backend is used, with an additional latency per call
+simulating the start of a Tesseract process (which does not hold the GIL).
+
+    $ python benchmarks/pipeline_executor.py [-j 4] [--latency 0.05] [-dd DATA_DIR]
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import argparse, contextlib, glob, io, os, time, pkg_resources
+from passporteye.util import ocr
+from passporteye.util.pipeline import PipelineExecutor
+from passporteye.mrz.image import read_mrz
+from passporteye.mrz.ocrb import OCRBBackend, OCRBRecognizer
+
+
+class LatencyBackend(OCRBBackend):
+    def __init__(self, latency):
+        super(LatencyBackend, self).__init__(OCRBRecognizer(min_margin=-float('inf')), fallback=lambda img, mrz_mode: '', min_score=-1)
+        self.latency = latency
+
+    def __call__(self, img, mrz_mode=True, timeout=None):
+        time.sleep(self.latency)
+        return super(LatencyBackend, self).__call__(img, mrz_mode, timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare read_mrz with and without a PipelineExecutor.')
+    parser.add_argument('-dd', '--data-dir', default=pkg_resources.resource_filename('passporteye.mrz', 'testdata'))
+    parser.add_argument('-j', '--jobs', default=4, type=int, help='Number of executor threads')
+    parser.add_argument('--latency', default=0.05, type=float, help='Additional latency of an OCR call in seconds')
+    args = parser.parse_args()
+
+    ocr.set_backend(LatencyBackend(args.latency))
+    files = sorted(glob.glob(os.path.join(args.data_dir, '*')))
+    with PipelineExecutor(max_workers=args.jobs) as executor:
+        for name, kwargs in [('sequential', {}), ('executor(%d)' % args.jobs, {'executor': executor})]:
+            tic = time.time()
+            with contextlib.redirect_stdout(io.StringIO()):  # The parsers are chatty
+                mrzs = [read_mrz(f, **kwargs) for f in files]
+            n_valid = sum(1 for mrz in mrzs if mrz is not None and mrz.valid)
+            print("%-12s %6.1fms per document, %d valid MRZs" % (name, (time.time() - tic) / len(files) * 1000, n_valid))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+PassportEye benchmarks: invalidation and memoized recomputation in pipelines.
+
+Measures invalidating the values of a layered pipeline via the reverse-dependency index, compared to scanning all
+the components on each step (as was done before the index), then the recomputation of MRZPipeline on the MRZ test
+data (with the OCR-B template backend, so that Tesseract is not needed) after replacing the Boone transform with
+an equivalent one (as in a tuning session), with and without memoization.
+
+    $ python benchmarks/pipeline_invalidation.py [-l 20] [-w 50] [-dd DATA_DIR]
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import argparse, contextlib, glob, io, os, time, pkg_resources
+from passporteye.util import ocr
+from passporteye.util.pipeline import Pipeline
+from passporteye.mrz.image import MRZPipeline, BooneTransform
+from passporteye.mrz.ocrb import OCRBBackend, OCRBRecognizer
+
+
+def scan_invalidate(pipeline, key):
+    """Invalidation by scanning the components on each step (the reference)."""
+    if key not in pipeline.data:
+        return
+    del pipeline.data[key]
+    for cname in pipeline.components:
+        if key in pipeline.depends[cname]:
+            for downstream_key in pipeline.provides[cname]:
+                scan_invalidate(pipeline, downstream_key)
+
+
+def layered_pipeline(layers, width):
+    """A pipeline of `layers` layers of `width` components, each depending on two components of the previous layer."""
+    p = Pipeline()
+    p.add_component('root', lambda: 0, ['0_0'], [])
+    for i in range(1, layers):
+        for j in range(width):
+            deps = ['0_0'] if i == 1 else ['%d_%d' % (i - 1, j), '%d_%d' % (i - 1, (j + 1) % width)]
+            p.add_component('c%d_%d' % (i, j), lambda *args: 0, ['%d_%d' % (i, j)], deps)
+    return p
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure pipeline invalidation and memoized recomputation.')
+    parser.add_argument('-dd', '--data-dir', default=pkg_resources.resource_filename('passporteye.mrz', 'testdata'))
+    parser.add_argument('-l', '--layers', default=20, type=int, help='Number of layers of the synthetic pipeline')
+    parser.add_argument('-w', '--width', default=50, type=int, help='Number of components per layer')
+    args = parser.parse_args()
+
+    # Invalidation of all the values
+    p = layered_pipeline(args.layers, args.width)
+    keys = ['%d_%d' % (args.layers - 1, j) for j in range(args.width)]
+    for name, invalidate in [('scan', scan_invalidate), ('index', Pipeline.invalidate)]:
+        for k in keys:
+            p[k]
+        tic = time.time()
+        invalidate(p, '0_0')
+        print("Invalidation of %d values (%s): %.1fms" % (len(p.components), name, (time.time() - tic) * 1000))
+
+    # Recomputation after replacing a component with an equivalent one
+    ocr.set_backend(OCRBBackend(OCRBRecognizer(min_margin=-float('inf')), fallback=lambda img, mrz_mode: '', min_score=-1))
+    files = sorted(glob.glob(os.path.join(args.data_dir, '*')))
+    for memoize in [False, True]:
+        elapsed, calls = 0.0, 0
+        with contextlib.redirect_stdout(io.StringIO()):  # The parsers are chatty
+            for f in files:
+                p = MRZPipeline(f, instrument=True, fast_boone=True)
+                if memoize:
+                    p.memoize()
+                p.result
+                calls -= sum(st['calls'] for st in p.stats.values())
+                tic = time.time()
+                p.replace_component('boone', BooneTransform())
+                p.result
+                elapsed += time.time() - tic
+                calls += sum(st['calls'] for st in p.stats.values())
+        print("Recomputation after replacing the transform (memoize=%s): %.1fms, %.1f component calls per document"
+              % (memoize, elapsed / len(files) * 1000, calls / float(len(files))))
+
+
+if __name__ == '__main__':
+    main()
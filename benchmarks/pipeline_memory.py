@@ -0,0 +1,49 @@
+'''
+PassportEye benchmarks: memory held by the pipelines.
+
+Runs MRZPipeline on the MRZ test data (with the OCR-B template backend, so that Tesseract is not needed),
+holding on to all the pipelines (as a server processing many documents at once would), in the usual and the lean mode,
+and reports the memory they retain along with the peak memory of a single recognition (traced by `tracemalloc`).
+
+    $ python benchmarks/pipeline_memory.py [-dd DATA_DIR]
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import argparse, contextlib, gc, glob, io, os, time, tracemalloc, pkg_resources
+from passporteye.util import ocr
+from passporteye.mrz.image import MRZPipeline
+from passporteye.mrz.ocrb import OCRBBackend, OCRBRecognizer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the memory used by MRZPipeline with and without the lean mode.')
+    parser.add_argument('-dd', '--data-dir', default=pkg_resources.resource_filename('passporteye.mrz', 'testdata'))
+    args = parser.parse_args()
+
+    ocr.set_backend(OCRBBackend(OCRBRecognizer(min_margin=-float('inf')), fallback=lambda img, mrz_mode: '', min_score=-1))
+    files = sorted(glob.glob(os.path.join(args.data_dir, '*')))
+    for lean in [False, True]:
+        gc.collect()
+        tracemalloc.start()
+        pipelines, peak, n_valid = [], 0, 0
+        tic = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):  # The parsers are chatty
+            for f in files:
+                start = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                p = MRZPipeline(f, lean=lean)
+                mrz = p.result
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - start)
+                n_valid += mrz is not None and mrz.valid
+                pipelines.append(p)
+        elapsed = time.time() - tic
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("%-6s retained by %d pipelines %.1fMB, peak per document %.1fMB, %.1fms per document, %d valid MRZs"
+              % ('lean' if lean else 'usual', len(files), retained / 1e6, peak / 1e6, elapsed / len(files) * 1000, n_valid))
+        del pipelines
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+PassportEye benchmarks: compiled pipeline plans.
+
+Measures the per-document overhead of building an MRZPipeline and resolving its dependencies on each call,
+compared to running a precompiled plan (MRZPlan), first with no-op components (the pure overhead),
+then on the MRZ test data (with the OCR-B template backend, so that Tesseract is not needed).
+
+    $ python benchmarks/pipeline_plan.py [-n 2000] [-dd DATA_DIR]
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import argparse, contextlib, glob, io, os, time, pkg_resources
+from passporteye.util import ocr
+from passporteye.util.pipeline import Pipeline
+from passporteye.mrz.image import MRZPipeline, MRZPlan, read_mrz
+from passporteye.mrz.ocrb import OCRBBackend, OCRBRecognizer
+
+
+class NoOp(object):
+    """A component with the same inputs and outputs as a given one, doing nothing."""
+
+    def __init__(self, component):
+        self.__provides__ = component.__provides__
+        self.__depends__ = component.__depends__
+
+    def __call__(self, *args):
+        return None if len(self.__provides__) == 1 else [None]*len(self.__provides__)
+
+
+def noop_pipeline(filename):
+    p = MRZPipeline(filename)
+    for name in list(p.components):
+        p.replace_component(name, NoOp(p.components[name]))
+    return p
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare MRZPipeline with MRZPlan.')
+    parser.add_argument('-dd', '--data-dir', default=pkg_resources.resource_filename('passporteye.mrz', 'testdata'))
+    parser.add_argument('-n', '--repeat', default=2000, type=int, help='Number of runs for measuring the overhead')
+    args = parser.parse_args()
+
+    # Pure overhead: the same graph of no-op components
+    tic = time.time()
+    for i in range(args.repeat):
+        noop_pipeline(None)['mrz_final']
+    t_pipeline = (time.time() - tic) / args.repeat
+    plan = noop_pipeline(None).compile(['mrz_final'], inputs=['img'])
+    tic = time.time()
+    for i in range(args.repeat):
+        plan.run(img=None)['mrz_final']
+    t_plan = (time.time() - tic) / args.repeat
+    print("Overhead per document: MRZPipeline %.1fus, compiled plan %.1fus" % (t_pipeline*1e6, t_plan*1e6))
+
+    # Test data
+    ocr.set_backend(OCRBBackend(OCRBRecognizer(min_margin=-float('inf')), fallback=lambda img, mrz_mode: '', min_score=-1))
+    files = sorted(glob.glob(os.path.join(args.data_dir, '*')))
+    plan = MRZPlan()
+    for name, fn in [('read_mrz', read_mrz), ('MRZPlan', plan)]:
+        tic = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):  # The parsers are chatty
+            n_valid = sum(1 for f in files if (lambda mrz: mrz is not None and mrz.valid)(fn(f)))
+        print("%-8s %.1fms per document, %d valid MRZs" % (name, (time.time() - tic) / len(files) * 1000, n_valid))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+'''
+PassportEye benchmarks: ROI extraction.
+
+Measures RotatedBox.extract_from_image for an MRZ box (with a small rotation, found on an image scaled to width 250)
+on images of increasing size, next to the cost of rotating the whole image (which is how the ROI used to be extracted).
+The extraction time is proportional to the size of the ROI rather than that of the image.
+
+    $ python benchmarks/roi_extraction.py [-n 20]
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import argparse, time
+import numpy as np
+from skimage import transform
+from passporteye.util.geometry import RotatedBox
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the ROI extraction time.')
+    parser.add_argument('-n', '--repeat', default=20, type=int, help='Number of extractions per image size')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    for rows, cols in [(750, 1000), (1500, 2000), (3000, 4000)]:
+        img = rng.random_sample((rows, cols))
+        scale = cols / 250.0  # The box is found on an image of width 250 (see Scaler)
+        box = RotatedBox([rows / scale * 0.8, 125], 220, 20, np.pi/2 - 0.05)
+        tic = time.time()
+        for i in range(args.repeat):
+            roi = box.extract_from_image(img, scale)
+        t_extract = (time.time() - tic) / args.repeat
+        tic = time.time()
+        transform.rotate(img, angle=0.05*180/np.pi, center=[box.cy*scale, box.cx*scale], resize=True)
+        t_rotate = time.time() - tic
+        print("%4dx%-4d  extract_from_image %7.2fms (ROI %dx%d)  full image rotation %8.2fms" % (
+              rows, cols, t_extract*1000, roi.shape[0], roi.shape[1], t_rotate*1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,56 +6,229 @@ Author: Konstantin Tretyakov
 License: MIT
 """
 
-from skimage import transform, io, morphology, filters, measure
+from skimage import transform, io, morphology, filters, measure, color, util
+from PIL import Image
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
-import tempfile, os
-from ..util.pdf import extract_first_jpeg_in_pdf
+from scipy import ndimage
+import copy, threading, multiprocessing, time
+from ..util.pdf import extract_first_jpeg_in_pdf, iter_pdf_images
 from ..util.pipeline import Pipeline
 from ..util.geometry import RotatedBox
-from ..util.ocr import ocr
+from ..util.ocr import ocr, ocr_batch, ocr_detailed, ocr_call_count, charge_ocr_calls, OCRResult, OCRTimeoutError
+from ..util.deadline import Deadline
 from .text import MRZ
 
 
 class Loader(object):
-    """Loads `filename` to `img`."""
+    """Loads `filename` to `img`.
+
+    Besides a filename, the image may be given as its encoded contents (bytes, bytearray or memoryview),
+    a readable binary stream or an already decoded NumPy array. Encoded images (including the JPEGs extracted from PDFs)
+    are decoded in memory. On Python 2, where `bytes` is `str`, a `bytes` value is a filename: pass the contents
+    as a bytearray, memoryview or stream instead."""
 
     __depends__ = []
     __provides__ = ['img']
 
-    def __init__(self, filename, as_gray=True, pdf_aware=True):
+    def __init__(self, filename, as_gray=True, pdf_aware=True, lazy=False):
+        """
+        :param filename: the image file name, contents, stream or array (see above). A stream is read at construction.
+        :param lazy: when True, `img` is a `LazyImage`, which is only decoded when its pixels are accessed.
+                     The `Scaler` then computes `img_small` from a reduced-resolution decode of the file (see `LazyImage.draft`).
+        """
+        if hasattr(filename, 'read'):
+            filename = _as_contents(filename.read())
+        elif isinstance(filename, memoryview):
+            filename = _as_contents(filename.tobytes())
         self.filename = filename
         self.as_gray = as_gray
         self.pdf_aware = pdf_aware
+        self.lazy = lazy
 
     def _imread(self, filename):
-        """Proxy to skimage.io.imread with some fixes."""
-        img = io.imread(filename, as_gray=self.as_gray)
+        """Proxy to skimage.io.imread with some fixes. Accepts a filename or the contents of the file."""
+        img = io.imread(_open(filename), as_gray=self.as_gray)
         if img is not None and len(img.shape) != 2:
             # The PIL plugin somewhy fails to load some images
-            img = io.imread(filename, as_gray=self.as_gray, plugin='matplotlib')
+            img = io.imread(_open(filename), as_gray=self.as_gray, plugin='matplotlib')
         return img
 
+    def _is_pdf(self):
+        return self.pdf_aware and _is_pdf(self.filename)
+
+    def _pdf_jpeg(self):
+        with BytesIO(self.filename) if _is_contents(self.filename) else open(self.filename, 'rb') as f:
+            img_data = extract_first_jpeg_in_pdf(f)
+        return _as_contents(img_data) if img_data is not None else None
+
     def __call__(self):
-        if self.pdf_aware and self.filename.lower().endswith('.pdf'):
-            with open(self.filename, 'rb') as f:
-                img_data = extract_first_jpeg_in_pdf(f)
+        if isinstance(self.filename, np.ndarray):
+            return self._load()
+        if self.lazy:
+            if self._is_pdf():
+                img_data = self._pdf_jpeg()
+                if img_data is None:
+                    return None
+                return LazyImage(lambda: self._load(img_data), lambda: _open(img_data), self.as_gray)
+            return LazyImage(self._load, lambda: _open(self.filename), self.as_gray)
+        return self._load()
+
+    def _load(self, img_data=None):
+        if isinstance(self.filename, np.ndarray):
+            img = self.filename
+            if self.as_gray and img.ndim > 2:
+                # Same conversion as in skimage.io.imread
+                img = color.rgb2gray(color.rgba2rgb(img) if img.shape[2] == 4 else img)
+            return img
+        elif self._is_pdf():
+            if img_data is None:
+                img_data = self._pdf_jpeg()
             if img_data is None:
                 return None
             else:
-                fd, fname = tempfile.mkstemp(prefix='pythoneye_', suffix='.jpg')
                 try:
-                    with open(fname, 'wb') as f:
-                        f.write(img_data)
-                    return self._imread(fname)
+                    return self._imread(img_data)
                 except:
                     return None
-                finally:
-                    os.close(fd)
-                    os.remove(fname)
         else:
             return self._imread(self.filename)
 
 
+def iter_images(filename, pdf_aware=True, max_pages=None):
+    """Iterates lazily over the images in a file: the images embedded in the pages of a PDF (see `iter_pdf_images`),
+    the frames of a multi-page image (such as a TIFF) or just the image itself. Only one image is decoded at a time.
+
+    :param filename: a file name, its contents, a binary stream or a NumPy array (see `Loader`).
+    :param max_pages: only the images of the first max_pages pages (frames) are yielded (None means all of them).
+    :return: an iterator over images in a form accepted by `Loader` (encoded data or arrays).
+    """
+    src = Loader(filename, pdf_aware=pdf_aware).filename
+    if isinstance(src, np.ndarray):
+        yield src
+    elif pdf_aware and _is_pdf(src):
+        with BytesIO(src) if _is_contents(src) else open(src, 'rb') as f:
+            for img in iter_pdf_images(f, max_pages):
+                yield img if isinstance(img, np.ndarray) else _as_contents(img)
+    else:
+        try:
+            im = Image.open(_open(src))
+        except IOError:
+            im = None
+        if im is None or getattr(im, 'n_frames', 1) <= 1:
+            if im is not None:
+                im.close()
+            yield src
+            return
+        with im:
+            for i in range(im.n_frames if max_pages is None else min(im.n_frames, max_pages)):
+                im.seek(i)
+                yield np.asarray(im.convert('L' if im.mode in ('1', 'L', 'I', 'I;16', 'F') else 'RGB'))
+
+
+def _open(filename):
+    """Returns what may be passed to skimage.io.imread or PIL's Image.open for a filename or the contents of a file."""
+    return BytesIO(filename) if _is_contents(filename) else filename
+
+
+def _is_contents(src):
+    """Tells the contents of a file from a filename by type (on Python 2, `bytes` values are `str` filenames).
+
+    >>> _is_contents(b'%PDF-1.4' if bytes is not str else bytearray(b'%PDF-1.4')), _is_contents('a.pdf')
+    (True, False)
+    """
+    return isinstance(src, bytearray) or (bytes is not str and isinstance(src, bytes))
+
+
+def _as_contents(data):
+    """Marks encoded image data (e.g. read from a stream) as contents for `_is_contents`."""
+    return data if _is_contents(data) else bytearray(data)
+
+
+def _is_pdf(src):
+    """Whether a filename or the contents of a file (see `_is_contents`) is a PDF."""
+    if _is_contents(src):
+        return src.startswith(b'%PDF')
+    return src.lower().endswith('.pdf')
+
+
+class LazyImage(object):
+    """
+    A stand-in for an image, which is decoded on first access to its pixels (e.g. via np.asarray(img) or img.mean()).
+    Its shape is known from the file header without decoding, and a reduced-resolution version may be obtained
+    (see `draft`) without ever decoding the full image.
+    """
+
+    def __init__(self, load, source, as_gray=True):
+        """
+        :param load: a function, which decodes the full image.
+        :param source: a function, returning the filename or a binary stream of the encoded image (for PIL).
+        """
+        self._load = load
+        self._source = source
+        self.as_gray = as_gray
+        self._img = None
+        self._shape = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._img is not None
+
+    @property
+    def array(self):
+        """The decoded full-resolution image."""
+        with self._lock:
+            if self._img is None:
+                self._img = self._load()
+            return self._img
+
+    @property
+    def shape(self):
+        if self._img is None and self._shape is None:
+            try:
+                with Image.open(self._source()) as im:
+                    width, height = im.size
+                    bands = len(im.getbands())
+                self._shape = (height, width) if self.as_gray or bands == 1 else (height, width, bands)
+            except IOError:
+                pass
+        return self._shape if self._img is None and self._shape is not None else self.array.shape
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.array, dtype)
+
+    def __getitem__(self, idx):
+        return self.array[idx]
+
+    def __getattr__(self, name):
+        return getattr(self.array, name)
+
+    def draft(self, min_width):
+        """Decodes the image at a reduced resolution, at least min_width pixels wide, making use of the DCT-domain
+        downscaling of JPEG decoders (scale factors 1/2, 1/4 and 1/8, see PIL's Image.draft).
+        Returns None if this is not possible (not a JPEG, already decoded, or not large enough to be reduced).
+        Otherwise, returns the image in the same format as the full one (float in [0, 1], grayscale if as_gray).
+        """
+        if self._img is not None:
+            return None
+        try:
+            with Image.open(self._source()) as im:
+                width, height = im.size
+                if im.format != 'JPEG' or width < 2*min_width:
+                    return None
+                # Decoded in color, to convert to grayscale in the same way as the full image (see `Loader`)
+                im.draft(im.mode, (min_width, int(np.ceil(height*min_width/float(width)))))
+                if im.size[0] == width:
+                    return None
+                img = np.asarray(im.convert('RGB' if im.mode not in ('L', 'RGB') else im.mode))
+        except IOError:
+            return None
+        img = img.astype(np.float64)/255.0
+        return color.rgb2gray(img) if self.as_gray and img.ndim == 3 else img
+
+
 class Scaler(object):
     """Scales `image` down to `img_scaled` so that its width is at most 250."""
 
@@ -68,13 +241,105 @@ class Scaler(object):
     def __call__(self, img):
         scale_factor = self.max_width/float(img.shape[1])
         if scale_factor <= 1:
-            img_small = transform.rescale(img, scale_factor, mode='constant', multichannel=False, anti_aliasing=True)
+            # A LazyImage (see `Loader`) may provide a reduced-resolution version to be scaled instead
+            img_draft = img.draft(2*self.max_width) if isinstance(img, LazyImage) else None
+            if img_draft is not None:
+                img_small = transform.rescale(img_draft, self.max_width/float(img_draft.shape[1]), mode='constant',
+                                              multichannel=False, anti_aliasing=True)
+            else:
+                img_small = transform.rescale(np.asarray(img), scale_factor, mode='constant', multichannel=False,
+                                              anti_aliasing=True)
         else:
             scale_factor = 1.0
-            img_small = img
+            img_small = np.asarray(img)
         return img_small, scale_factor
 
 
+class ImagePyramid(object):
+    """
+    Successive 2x reductions of an image (each pixel of a level is the mean of a 2x2 block of the previous level),
+    computed lazily in float32 and shared by the scalers of a pipeline (see `PyramidScaler`).
+
+    >>> p = ImagePyramid(np.arange(48, dtype=float).reshape(6, 8))
+    >>> p.level(1)
+    array([[ 4.5,  6.5,  8.5, 10.5],
+           [20.5, 22.5, 24.5, 26.5],
+           [36.5, 38.5, 40.5, 42.5]], dtype=float32)
+    >>> p.level(2).shape, p.level_for_width(3), p.level_for_width(5)
+    ((1, 2), 1, 0)
+    """
+
+    def __init__(self, img):
+        self.img = img
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def level(self, i):
+        """Returns the i-th level (the 0-th one is the image itself, converted to float32 in [0, 1])."""
+        with self._lock:
+            return self._level(i)
+
+    def _level(self, i):
+        if i not in self._levels:
+            if i == 0:
+                self._levels[0] = util.img_as_float32(np.asarray(self.img))
+            elif i == 1:
+                # Reduce the image directly, so that the full-size float32 copy is never made
+                img = np.asarray(self.img)
+                self._levels[1] = _reduce2x(img, 1.0/255 if img.dtype == np.uint8 else 1.0)
+            else:
+                self._levels[i] = _reduce2x(self._level(i - 1))
+        return self._levels[i]
+
+    def level_for_width(self, min_width):
+        """Returns the index of the smallest level, which is at least min_width pixels wide."""
+        i, width = 0, self.img.shape[1]
+        while width//2 >= min_width:
+            i, width = i + 1, width//2
+        return i
+
+
+def _reduce2x(img, scale=1.0):
+    """Averages the 2x2 blocks of the image (dropping the last row/column if their number is odd)."""
+    h, w = img.shape[0]//2*2, img.shape[1]//2*2
+    result = img[0:h:2, 0:w:2].astype(np.float32)
+    result += img[1:h:2, 0:w:2]
+    result += img[0:h:2, 1:w:2]
+    result += img[1:h:2, 1:w:2]
+    result *= np.float32(0.25*scale)
+    return result
+
+
+class PyramidBuilder(object):
+    """Creates an `ImagePyramid` of `img` (`img_pyramid`)."""
+
+    __depends__ = ['img']
+    __provides__ = ['img_pyramid']
+
+    def __call__(self, img):
+        return ImagePyramid(img)
+
+
+class PyramidScaler(Scaler):
+    """Scales the image down to `img_small` like `Scaler`, starting from the smallest level of `img_pyramid`,
+    which is at least twice as wide as needed. The pyramid is shared, so rescaling the same image to another width
+    (see `TryOtherMaxWidth`) reuses the levels computed already."""
+
+    __depends__ = ['img_pyramid']
+    __provides__ = ['img_small', 'scale_factor']
+
+    def __call__(self, img_pyramid):
+        img = img_pyramid.img
+        # Note that for a LazyImage a reduced-resolution decode may be used instead (see `LazyImage.draft`)
+        i = 0 if isinstance(img, LazyImage) and not img.loaded else img_pyramid.level_for_width(2*self.max_width)
+        if i == 0:
+            return super(PyramidScaler, self).__call__(img)
+        level = img_pyramid.level(i)
+        rescale_factor = self.max_width/float(level.shape[1])
+        img_small = transform.rescale(level, rescale_factor, mode='constant', multichannel=False, anti_aliasing=True)
+        return img_small.astype(np.float64), rescale_factor/2**i
+
+
 class BooneTransform(object):
     """Processes `img_small` according to Hans Boone's method
     (http://www.pyimagesearch.com/2015/11/30/detecting-machine-readable-zones-in-passport-images/)
@@ -84,7 +349,7 @@ class BooneTransform(object):
     __provides__ = ['img_binary']
 
     def __init__(self, square_size=5):
-        self.square_size = 5
+        self.square_size = square_size
 
     def __call__(self, img_small):
         m = morphology.square(self.square_size)
@@ -95,6 +360,107 @@ class BooneTransform(object):
         return img_closed > threshold
 
 
+class FastBooneTransform(BooneTransform):
+    """The same transform as `BooneTransform` (with a bit-identical `img_binary`), which computes the grayscale closings
+    (including the one of the black top-hat) as running maxima and minima along the rows and the columns.
+    The intermediate results are kept in buffers, which are reused across calls (per thread and image shape),
+    unless reuse_buffers is False.
+
+    >>> img = np.random.RandomState(0).rand(40, 60)
+    >>> [(FastBooneTransform(n)(img) == BooneTransform(n)(img)).all() for n in [1, 3, 5, 7]]
+    [True, True, True, True]
+    """
+
+    def __init__(self, square_size=5, reuse_buffers=True):
+        super(FastBooneTransform, self).__init__(square_size)
+        self.reuse_buffers = reuse_buffers
+        self._local = threading.local()
+
+    def __call__(self, img_small):
+        r = self.square_size//2
+        if img_small.dtype != np.float64 or self.square_size % 2 == 0 or min(img_small.shape) <= r:
+            # Integer images are processed differently by the morphology functions of skimage,
+            # even-sized squares are shifted, and tiny images are reflected more than once
+            return super(FastBooneTransform, self).__call__(img_small)
+        try:
+            img_th = self._closing(img_small, 'th')
+            img_th -= img_small
+            img_sob = filters.sobel_v(img_th)
+            np.abs(img_sob, out=img_sob)
+            img_closed = self._closing(img_sob, 'closed')
+            threshold = filters.threshold_otsu(img_closed)
+            return img_closed > threshold
+        finally:
+            if not self.reuse_buffers:
+                self._local.buffers = None
+
+    def _buffer(self, name, shape):
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        if name not in buffers or buffers[name].shape != shape:
+            buffers[name] = np.empty(shape, np.float64)
+        return buffers[name]
+
+    def _closing(self, img, out_name):
+        """Computes the grayscale closing of img with a square (a dilation followed by an erosion) into a buffer."""
+        dilated = self._running(img, np.maximum, 'dilated')
+        return self._running(dilated, np.minimum, out_name)
+
+    def _running(self, img, fn, out_name):
+        """Applies fn (np.maximum or np.minimum) over the square windows around each pixel,
+        with the same ('reflect') boundary handling as in scipy.ndimage."""
+        h, w = img.shape
+        n, r = self.square_size, self.square_size//2
+        out = self._buffer(out_name, (h, w))
+        if r == 0:
+            # A 1x1 window, nothing to pad
+            out[...] = img
+            return out
+        # Along the rows
+        padded = self._buffer('pad_w', (h, w + 2*r))
+        padded[:, r:r + w] = img
+        padded[:, :r] = img[:, r - 1::-1]
+        padded[:, r + w:] = img[:, w - 1:w - r - 1:-1]
+        rows = self._buffer('rows', (h, w))
+        rows[...] = padded[:, :w]
+        for k in range(1, n):
+            fn(rows, padded[:, k:k + w], out=rows)
+        # Along the columns
+        padded = self._buffer('pad_h', (h + 2*r, w))
+        padded[r:r + h] = rows
+        padded[:r] = rows[r - 1::-1]
+        padded[r + h:] = rows[h - 1:h - r - 1:-1]
+        out[...] = padded[:h]
+        for k in range(1, n):
+            fn(out, padded[k:k + h], out=out)
+        return out
+
+
+def _clusters(n, pairs):
+    """Groups the numbers 0..n-1 into the connected components of a graph given by a list of pairs (via union-find).
+    The components are sorted by their smallest element, the elements of each component are sorted too.
+
+    >>> _clusters(6, [(0, 3), (4, 5), (3, 5)])
+    [[0, 3, 4, 5], [1], [2]]
+    """
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i, j in pairs:
+        i, j = find(i), find(j)
+        if i != j:
+            parent[max(i, j)] = min(i, j)
+    clusters = {}
+    for i in range(n):
+        clusters.setdefault(find(i), []).append(i)
+    return [clusters[k] for k in sorted(clusters)]
+
+
 class MRZBoxLocator(object):
     """Extracts putative MRZs as RotatedBox instances from the contours of `img_binary`"""
 
@@ -161,36 +527,184 @@ class MRZBoxLocator(object):
         return False
 
     def _merge_boxes(self, box_list):
-        """Mergest nearby parallel boxes in the given list."""
-        while self._merge_any_two_boxes(box_list):
-            pass
+        """Merges nearby parallel boxes in the given list.
+
+        The pairs of boxes to be merged (see `_are_nearby_parallel_boxes`) are found at once and grouped into clusters
+        (via union-find), each cluster is then replaced with a single box, fit to all of its points.
+        Should this box have a too small aspect ratio, the boxes of the cluster are merged pairwise instead (see `_merge_any_two_boxes`).
+        As the merged boxes may in turn be mergeable, this is repeated until nothing changes.
+        The boxes which were not merged keep their order, the merged ones are appended after them.
+        """
+        while len(box_list) > 1:
+            singles, merged = [], []
+            for cluster in _clusters(len(box_list), np.argwhere(self._nearby_parallel_matrix(box_list))):
+                boxes = [box_list[i] for i in cluster]
+                if len(boxes) > 1:
+                    box = RotatedBox.from_points(np.vstack([b.points for b in boxes]), self.box_type)
+                    if box.height > 0 and box.width/box.height >= self.min_box_aspect:
+                        merged.append(box)
+                        continue
+                    while self._merge_any_two_boxes(boxes):
+                        pass
+                singles.extend(boxes)
+            if len(singles) + len(merged) == len(box_list):
+                break
+            box_list = singles + merged
         return box_list
 
+    def _nearby_parallel_matrix(self, box_list):
+        """The matrix of `_are_nearby_parallel_boxes` for all pairs of the given boxes (only the upper triangle is filled)."""
+        angle = np.array([b.angle for b in box_list])
+        center = np.array([b.center for b in box_list])
+        width = np.array([b.width for b in box_list], float)
+        height = np.array([b.height for b in box_list], float)
+        d_angle = np.abs(angle[:, None] - angle[None, :])
+        aligned = (d_angle <= self.angle_tol) | (np.abs(np.pi - d_angle) <= self.angle_tol)
+        # The distance between the centers along the "up" direction wrt the smaller of the two angles
+        up_angle = np.minimum(angle[:, None], angle[None, :])
+        d_center = center[:, None, :] - center[None, :, :]
+        offset = np.abs(-d_center[..., 0]*np.sin(up_angle) + d_center[..., 1]*np.cos(up_angle))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            width_ratio = width[:, None]/width[None, :]
+        similar = (width[:, None] > 0) & (width[None, :] > 0) & (0.5 < width_ratio) & (width_ratio < 2.0)
+        return np.triu(aligned & (offset < self.lineskip_tol*(height[:, None] + height[None, :])) & similar, 1)
+
+
+class ComponentBoxLocator(MRZBoxLocator):
+    """
+    Extracts putative MRZs as RotatedBox instances from the connected components of `img_binary`.
+
+    Unlike `MRZBoxLocator`, which traces all the contours and fits a box to each of them, this labels the components once
+    and computes their sizes, centroids and orientations (the principal axes of their pixels) for all of them at once.
+    The boxes are only constructed for the components passing the area and aspect ratio filters, which makes a big
+    difference on noisy images with thousands of components. The `points` of a box are its four corners.
+    The boxes are then selected and merged the same way as by `MRZBoxLocator` (box_type is not used).
+
+    >>> img = np.zeros((40, 100), bool)
+    >>> img[10:15, 10:90] = img[20:24, 12:88] = img[30:33, 3:6] = True
+    >>> boxes = ComponentBoxLocator(min_area=50)(img)
+    >>> len(boxes), boxes[0].approx_equal([16.5, 49.5], 80, 14, np.pi/2)
+    (1, True)
+    """
+
+    def __call__(self, img_binary):
+        labels, n = ndimage.label(img_binary)
+        if n == 0:
+            return []
+        # The bounding box areas (the way a contour around the component would bound it)
+        objects = ndimage.find_objects(labels)
+        sizes = np.array([[sl[0].stop - sl[0].start, sl[1].stop - sl[1].start] for sl in objects], float)
+        candidates = np.flatnonzero(sizes[:, 0]*sizes[:, 1] >= self.min_area) + 1
+        if len(candidates) == 0:
+            return []
+
+        # The moments of the candidate components (the pixel coordinates are taken wrt their bounding boxes for precision)
+        keep = np.zeros(n + 1, bool)
+        keep[candidates] = True
+        idx = np.flatnonzero(keep[labels])
+        lab = labels.ravel()[idx]
+        r, c = np.divmod(idx, labels.shape[1])
+        origin = np.array([[sl[0].start, sl[1].start] for sl in objects], float)
+        r = r - origin[lab - 1, 0]
+        c = c - origin[lab - 1, 1]
+        count = np.bincount(lab, minlength=n + 1)[candidates]
+        mr = np.bincount(lab, r, n + 1)[candidates]/count
+        mc = np.bincount(lab, c, n + 1)[candidates]/count
+        crr = np.bincount(lab, r*r, n + 1)[candidates]/count - mr*mr
+        ccc = np.bincount(lab, c*c, n + 1)[candidates]/count - mc*mc
+        crc = np.bincount(lab, r*c, n + 1)[candidates]/count - mr*mc
+        # Orientation of the principal axis (in the same range as in RotatedBox.from_points)
+        angle = 0.5*np.arctan2(2*crc, crr - ccc)
+        angle[angle <= -np.pi/2 + 1e-12] += np.pi
+
+        # Extents along the principal axes
+        pos = np.zeros(n + 1, int)
+        pos[candidates] = np.arange(len(candidates))
+        k = pos[lab]
+        cos, sin = np.cos(angle), np.sin(angle)
+        u = (r - mr[k])*cos[k] + (c - mc[k])*sin[k]
+        v = -(r - mr[k])*sin[k] + (c - mc[k])*cos[k]
+        u_min, u_max = np.full(len(candidates), np.inf), np.full(len(candidates), -np.inf)
+        v_min, v_max = u_min.copy(), u_max.copy()
+        np.minimum.at(u_min, k, u)
+        np.maximum.at(u_max, k, u)
+        np.minimum.at(v_min, k, v)
+        np.maximum.at(v_max, k, v)
+        width, height = u_max - u_min + 1, v_max - v_min + 1
+        survivors = np.flatnonzero(width/height >= self.min_box_aspect)
+
+        results = []
+        for i in survivors:
+            du, dv = (u_min[i] + u_max[i])/2, (v_min[i] + v_max[i])/2
+            center = origin[candidates[i] - 1] + [mr[i] + du*cos[i] - dv*sin[i], mc[i] + du*sin[i] + dv*cos[i]]
+            box = RotatedBox(center, width[i], height[i], angle[i])
+            box.points = box.as_poly()
+            results.append(box)
+
+        # Next sort and leave only max_boxes largest boxes by area
+        results.sort(key = lambda x: -x.area)
+        return self._merge_boxes(results[0:self.max_boxes])
+
 
 class FindFirstValidMRZ(object):
     """Iterates over boxes found by MRZBoxLocator, passes them to BoxToMRZ, finds the first valid MRZ
-    or the best-scoring MRZ"""
+    or the best-scoring MRZ.
+
+    When the pipeline is computed by a `PipelineExecutor`, the boxes are processed concurrently (as its sub-tasks),
+    the result is the same as when they are processed one by one.
+
+    Unless debug is off, the ROI, text and MRZ of each examined box are stored in __data__['__debug__mrz']."""
 
     __provides__ = ['box_idx', 'roi', 'text', 'mrz']
     __depends__ = ['boxes', 'img', 'img_small', 'scale_factor', '__data__']
+    __uses__ = ['__executor__']  # The only value read from __data__ (see `PipelineExecutor.map`)
 
-    def __init__(self, use_original_image=True):
-        self.box_to_mrz = BoxToMRZ(use_original_image)
+    def __init__(self, use_original_image=True, ocr_pool=None, batch_ocr=False, deadline=None, speculative=False,
+                 scheduler=None, line_retries=False, debug=True):
+        """
+        :param ocr_pool: when given (an `OCRWorkerPool`), the ROIs of all boxes are OCR-ed at once on the pool,
+                         and so are the fallback variants of each ROI (see `BoxToMRZ`).
+        :param batch_ocr: when True, the ROIs of all boxes are OCR-ed in a single engine pass (see `ocr_batch`),
+                          and so are the fallback variants of each ROI.
+        :param deadline: an optional `Deadline`. Once it passes, the remaining boxes are not examined and
+                         the best MRZ found so far is returned with aux['budget_exhausted'] set.
+        :param speculative: when True, the fallback variants of each ROI are OCR-ed concurrently (see `BoxToMRZ`).
+        :param scheduler: an optional `StrategyScheduler` for ordering the fallback variants (see `BoxToMRZ`).
+        :param line_retries: when True, the low-confidence lines of each ROI are retried first (see `BoxToMRZ`).
+        :param debug: when False, the results of the boxes are not stored in __data__['__debug__mrz'].
+        """
+        self.box_to_mrz = BoxToMRZ(use_original_image, ocr_pool, batch_ocr, line_retries=line_retries, deadline=deadline,
+                                   speculative=speculative, scheduler=scheduler)
+        self.debug = debug
 
     def __call__(self, boxes, img, img_small, scale_factor, data):
         mrzs = []
-        data['__debug__mrz'] = []
-        for i, b in enumerate(boxes):
-            roi, text, mrz = self.box_to_mrz(b, img, img_small, scale_factor)
-            data['__debug__mrz'].append((roi, text, mrz))
+        debug = [] if self.debug else None
+        if debug is not None:
+            data['__debug__mrz'] = debug
+        if self.box_to_mrz.ocr_at_once:
+            rois = [self.box_to_mrz.extract_roi(b, img, img_small, scale_factor) for b in boxes]
+            texts = self.box_to_mrz.ocr_many(rois, detailed=self.box_to_mrz.line_retries)
+            results = (self.box_to_mrz.recognize(roi, text) for roi, text in zip(rois, texts))
+        elif data.get('__executor__') is not None and len(boxes) > 1:
+            results = data['__executor__'].map(charge_ocr_calls(lambda b: self.box_to_mrz(b, img, img_small, scale_factor)), boxes)
+        else:
+            results = (self.box_to_mrz(b, img, img_small, scale_factor) for b in boxes)
+        for i, (roi, text, mrz) in enumerate(results):
+            if debug is not None:
+                debug.append((roi, text, mrz))
             if mrz.valid:
                 return i, roi, text, mrz
             elif mrz.valid_score > 0:
                 mrzs.append((i, roi, text, mrz))
+            if self.box_to_mrz.expired:
+                break
         if len(mrzs) == 0:
             return None, None, None, None
         else:
             mrzs.sort(key = lambda x: x[3].valid_score)
+            if self.box_to_mrz.expired:
+                mrzs[-1][3].aux['budget_exhausted'] = True
             return mrzs[-1]
 
 
@@ -200,81 +714,342 @@ class BoxToMRZ(object):
     __provides__ = ['roi', 'text', 'mrz']
     __depends__ = ['box', 'img', 'img_small', 'scale_factor']
 
-    def __init__(self, use_original_image=True):
+    def __init__(self, use_original_image=True, ocr_pool=None, batch_ocr=False, line_retries=False, min_confidence=80,
+                 deadline=None, speculative=False, scheduler=None):
         """
         :param use_original_image: when True, the ROI is extracted from img, otherwise from img_small
+        :param ocr_pool: when given (an `OCRWorkerPool`), all fallback variants of the ROI are submitted to the pool at once
+                         instead of being OCR-ed one by one. The result is the same as in the sequential mode.
+        :param batch_ocr: when True, all fallback variants of the ROI are OCR-ed in a single engine pass (see `ocr_batch`).
+        :param line_retries: when True, the fallback variants are first tried on the low-confidence lines
+                             of the OCR result only, before trying them on the whole ROI (see `_try_line_retries`).
+                             The ROI is then OCR-ed via `ocr_detailed`, whose results are not cached.
+        :param min_confidence: lines with a lower OCR confidence (0..100) are considered low-confidence.
+        :param deadline: an optional `Deadline`. OCR calls are cut off when it passes, and the remaining fallback variants
+                         are skipped. An invalid MRZ, returned after that, has aux['budget_exhausted'] set.
+        :param speculative: when True, the fallback variants of the ROI are OCR-ed concurrently with the direct OCR
+                            (on the ocr_pool, if given, otherwise on a shared thread pool). The first variant giving
+                            a valid MRZ wins and the outstanding jobs are cancelled. If no variant is valid,
+                            the result is the same as in the sequential mode.
+        :param scheduler: an optional `StrategyScheduler`, which determines the order of the fallback variants
+                          and records their outcomes and costs.
         """
         self.use_original_image = use_original_image
+        self.ocr_pool = ocr_pool
+        self.batch_ocr = batch_ocr
+        self.line_retries = line_retries
+        self.min_confidence = min_confidence
+        self.deadline = deadline
+        self.speculative = speculative
+        self.scheduler = scheduler
+
+    @property
+    def expired(self):
+        """True if the deadline (if any) has passed."""
+        return self.deadline is not None and self.deadline.expired
+
+    def _timeout(self):
+        return self.deadline.timeout() if self.deadline is not None else None
+
+    def _timed(self, fn, detailed=False):
+        """Calls fn, returning an empty OCR result in case it times out."""
+        try:
+            return fn()
+        except OCRTimeoutError:
+            return OCRResult([]) if detailed else ''
+
+    @property
+    def ocr_at_once(self):
+        """True if several images should be passed to `ocr_many` at once rather than OCR-ed one by one."""
+        return self.ocr_pool is not None or self.batch_ocr
+
+    def ocr_many(self, imgs, detailed=False):
+        """Runs OCR on a list of images, using the pool or the batch mode, if configured.
+
+        :param detailed: when True, `OCRResult` objects are returned instead of texts.
+        """
+        if self.ocr_pool is not None:
+            futures = [self.ocr_pool.submit(img, timeout=self._timeout(), detailed=detailed) for img in imgs]
+            return [self._timed(f.result, detailed) for f in futures]
+        elif self.batch_ocr:
+            try:
+                return ocr_batch(imgs, detailed=detailed, timeout=self._timeout())
+            except OCRTimeoutError:
+                return [OCRResult([]) if detailed else '' for img in imgs]
+        else:
+            fn = ocr_detailed if detailed else ocr
+            return [self._timed(lambda: fn(img, timeout=self._timeout()), detailed) for img in imgs]
+
+    def ocr_roi(self, roi):
+        """Runs OCR on the ROI, returns an `OCRResult` if line retries are enabled and the text otherwise."""
+        fn = ocr_detailed if self.line_retries else ocr
+        return self._timed(lambda: fn(roi, timeout=self._timeout()), self.line_retries)
 
     def __call__(self, box, img, img_small, scale_factor):
-        img = img if self.use_original_image else img_small
+        roi = self.extract_roi(box, img, img_small, scale_factor)
+        return self.recognize(roi)
+
+    def extract_roi(self, box, img, img_small, scale_factor):
+        """Extracts the region of the image corresponding to the given box."""
+        img = np.asarray(img) if self.use_original_image else img_small
         scale = 1.0/scale_factor if self.use_original_image else 1.0
 
         # If the box's angle is np.pi/2 +- 0.01, we shall round it to np.pi/2:
         # this way image extraction is fast and introduces no distortions.
         # and this may be more important than being perfectly straight
         # similar for 0 angle
+        # (The box is copied, as the boxes are inputs of the pipeline component, which must not be modified)
         if abs(abs(box.angle) - np.pi/2) <= 0.01:
+            box = copy.copy(box)
             box.angle = np.pi/2
         if abs(box.angle) <= 0.01:
+            box = copy.copy(box)
             box.angle = 0.0
 
-        roi = box.extract_from_image(img, scale)
-        text = ocr(roi)
+        return box.extract_from_image(img, scale)
 
-        if '>>' in text or ('>' in text and '<' not in text):
-            # Most probably we need to reverse the ROI
-            roi = roi[::-1,::-1]
-            text = ocr(roi)
+    def recognize(self, roi, text=None):
+        """Does OCR and MRZ parsing of the given ROI, trying the fallback variants (see `_fallback_variants`) if necessary.
 
-        if not '<' in text:
-            # Assume this is unrecoverable and stop here (TODO: this may be premature, although it saves time on useless stuff)
-            return roi, text, MRZ.from_ocr(text)
+        :param text: the OCR result for `roi` (a text or an `OCRResult`), if it is already known.
+        :return: a tuple (roi, text, mrz). Note that the returned roi may be flipped wrt the given one.
+        """
+        # In the speculative mode the fallback variants are started right away, while the direct OCR is running
+        speculation = self._speculate(self._fallback_variants(roi)) if self.speculative and text is None else None
+        try:
+            result = text if text is not None else self.ocr_roi(roi)
+            text = result.text if isinstance(result, OCRResult) else result
+
+            if '>>' in text or ('>' in text and '<' not in text):
+                # Most probably we need to reverse the ROI
+                roi = roi[::-1,::-1]
+                if speculation is not None:
+                    speculation.cancel()
+                    speculation = self._speculate(self._fallback_variants(roi))
+                result = self.ocr_roi(roi)
+                text = result.text if isinstance(result, OCRResult) else result
+
+            if not '<' in text:
+                # Assume this is unrecoverable and stop here (TODO: this may be premature, although it saves time on useless stuff)
+                return roi, text, MRZ.from_ocr(text)
+
+            mrz = MRZ.from_ocr(text)
+            mrz.aux['method'] = 'direct'
+
+            # Now try improving the result via hacks, first on the doubtful lines only, then on the whole ROI
+            if not mrz.valid and self.line_retries and isinstance(result, OCRResult):
+                text, mrz = self._try_line_retries(roi, result, text, mrz)
+            if not mrz.valid:
+                text, mrz = self._try_fallback_variants(roi, text, mrz, speculation)
+            if not mrz.valid and self.expired:
+                mrz.aux['budget_exhausted'] = True
+
+            return roi, text, mrz
+        finally:
+            if speculation is not None:
+                speculation.cancel()
+
+    def _fallback_variants(self, roi):
+        """Returns the list of fallback strategies for improving the OCR result, in the order they are tried
+        (as given below, or as determined by the scheduler, if any).
+        Each strategy is a pair (method, img_fn), where img_fn() computes the image to be OCR-ed
+        (or returns None if the strategy is not applicable)."""
+        roi_b = []
+        lock = threading.Lock()
+        def black_tophat():
+            with lock:
+                if not roi_b:
+                    roi_b.append(morphology.black_tophat(roi, morphology.disk(5)))
+            return roi_b[0]
+        variants = [('rescaled(3)', lambda: self._rescaled(roi, 3)),
+                    # Sometimes the filter used for enlargement is important!
+                    ('rescaled(1)', lambda: self._rescaled(roi, 1)),
+                    ('black_tophat', black_tophat),
+                    ('black_tophat(rescaled(3))', lambda: self._rescaled(black_tophat(), 3))]
+        if self.scheduler is not None:
+            img_fns = dict(variants)
+            variants = [(method, img_fns[method]) for method in self.scheduler.order([m for m, f in variants])]
+        return variants
+
+    def _try_fallback_variants(self, roi, cur_text, cur_mrz, speculation=None):
+        """Tries the fallback variants in order until a valid MRZ is found. A variant's result replaces the current one
+        if it has a strictly better valid_score.
+
+        :param speculation: the already running OCR jobs for the variants (see `_speculate`). Their results are examined
+                            as they complete. To keep the outcome independent of the completion order, the best variant is
+                            chosen by (valid_score, -index), which is equivalent to the sequential selection.
+        """
+        variants = self._fallback_variants(roi)
+        order = [method for method, img_fn in variants]
+        if speculation is not None:
+            results = [] if self.expired else speculation.results(ordered=False)
+        else:
+            results = self._ocr_variants(variants, ordered=False)
+        best = (cur_mrz.valid_score, 1)
+        for method, new_text, cost in results:
+            new_mrz = MRZ.from_ocr(new_text)
+            new_mrz.aux['method'] = method
+            if self.scheduler is not None:
+                self.scheduler.record(method, new_mrz.valid, cost)
+            key = (new_mrz.valid_score, -order.index(method))
+            if key > best:
+                best, cur_text, cur_mrz = key, new_text, new_mrz
+            if cur_mrz.valid:
+                break
+        return cur_text, cur_mrz
 
-        mrz = MRZ.from_ocr(text)
-        mrz.aux['method'] = 'direct'
+    def _try_line_retries(self, roi, result, cur_text, cur_mrz):
+        """Tries the fallback variants on the regions of the doubtful lines of the OCR result (those with confidence
+        below min_confidence), least confident first, unless all the lines are doubtful.
+        A line's new text replaces the current one if this gives a strictly better valid_score of the whole MRZ.
+        This is much cheaper than OCR-ing the variants of the whole ROI."""
+        lines = cur_text.split('\n')
+        candidates = [i for i in range(len(result.lines)) if result.line_box(i) is not None and _is_mrz_line(lines[i])]
+        doubtful = [i for i in result.low_confidence_lines(self.min_confidence) if i in candidates]
+        if len(doubtful) == len(candidates):
+            # Nothing to be saved wrt retrying the whole ROI
+            return cur_text, cur_mrz
+        variants = []
+        for i in doubtful:
+            line_roi = self._line_region(roi, result.line_box(i))
+            variants.extend(((i, method), img_fn) for method, img_fn in self._fallback_variants(line_roi))
+
+        fixes = {}
+        for (i, method), new_text, cost in self._ocr_variants(variants):
+            new_lines = [ln.replace(' ', '') for ln in new_text.split('\n') if _is_mrz_line(ln)]
+            if not new_lines:
+                continue
+            new_lines = lines[:i] + [max(new_lines, key=len)] + lines[i+1:]
+            new_fixes = dict(fixes, **{str(i): method})
+            new_mrz = MRZ.from_ocr('\n'.join(new_lines))
+            new_mrz.aux['method'] = 'line_retry(%s)' % ', '.join('%s:%s' % f for f in sorted(new_fixes.items()))
+            if new_mrz.valid_score > cur_mrz.valid_score:
+                lines, cur_text, cur_mrz, fixes = new_lines, '\n'.join(new_lines), new_mrz, new_fixes
+            if cur_mrz.valid:
+                break
+        return cur_text, cur_mrz
 
-        # Now try improving the result via hacks
-        if not mrz.valid:
-            text, mrz = self._try_larger_image(roi, text, mrz)
+    def _line_region(self, roi, box):
+        """Cuts out the region of a line with the given box (left, top, right, bottom) from the ROI with some margin."""
+        left, top, right, bottom = box
+        margin = max(bottom - top, 1)
+        return roi[max(top - margin//2, 0):bottom + margin//2, max(left - margin, 0):right + margin]
+
+    def _ocr_variants(self, variants, ordered=True):
+        """Computes the images of the given variants (pairs (method, img_fn)) and OCR-s them. Returns an iterable over
+        triples (method, text, cost) for the applicable variants, where cost is the time spent on the variant in seconds. In the sequential mode, the variants are processed lazily.
+        In the speculative mode, they are processed concurrently and, unless ordered is True, reported as they complete.
+        No variants are processed after the deadline (if any)."""
+        if self.expired:
+            return []
+        elif self.speculative:
+            return self._speculate(variants).results(ordered)
+        elif self.ocr_at_once:
+            tic = time.time()
+            methods, imgs = [], []
+            for method, img_fn in variants:
+                img = img_fn()
+                if img is not None:
+                    methods.append(method)
+                    imgs.append(img)
+            texts = self.ocr_many(imgs)
+            cost = (time.time() - tic) / max(len(imgs), 1)
+            return [(method, text, cost) for method, text in zip(methods, texts)]
+        else:
+            return self._ocr_variants_lazily(variants)
+
+    def _ocr_variants_lazily(self, variants):
+        for method, img_fn in variants:
+            if self.expired:
+                break
+            tic = time.time()
+            img = img_fn()
+            if img is not None:
+                text = self._timed(lambda: ocr(img, timeout=self._timeout()))
+                yield method, text, time.time() - tic
+
+    def _speculate(self, variants):
+        """Starts the OCR jobs for all the given variants at once, returns a `_Speculation`.
+        With an ocr_pool, the images are computed here and OCR-ed on the pool, otherwise both are done on a thread pool."""
+        cancelled = threading.Event()
+        jobs = []
+        for method, img_fn in variants:
+            if self.ocr_pool is not None:
+                img = img_fn()
+                if img is not None:
+                    jobs.append((method, self.ocr_pool.submit(img, timeout=self._timeout()), time.time()))
+            else:
+                jobs.append((method, _speculation_executor().submit(charge_ocr_calls(self._speculative_job), img_fn, cancelled), None))
+        return _Speculation(jobs, cancelled)
 
-        # Sometimes the filter used for enlargement is important!
-        if not mrz.valid:
-            text, mrz = self._try_larger_image(roi, text, mrz, 1)
+    def _speculative_job(self, img_fn, cancelled):
+        """Computes and OCR-s a variant, returns a pair (text, cost) or None, if not applicable or cancelled."""
+        tic = time.time()
+        img = None if cancelled.is_set() else img_fn()
+        if img is None or cancelled.is_set():
+            return None
+        return self._timed(lambda: ocr(img, timeout=self._timeout())), time.time() - tic
 
-        if not mrz.valid:
-            text, mrz = self._try_black_tophat(roi, text, mrz)
+    def _rescaled(self, roi, filter_order=3):
+        """Returns the ROI, enlarged to around 1050 pixels wide, or None if it is wider than 700 pixels already."""
+        if roi.shape[1] > 700:
+            return None
+        scale_by = int(1050.0/roi.shape[1] + 0.5)
+        return transform.rescale(roi, scale_by, order=filter_order, mode='constant', multichannel=False, anti_aliasing=True)
 
-        return roi, text, mrz
 
-    def _try_larger_image(self, roi, cur_text, cur_mrz, filter_order=3):
-        """Attempts to improve the OCR result by scaling the image. If the new mrz is better, returns it, otherwise returns
-        the old mrz."""
-        if roi.shape[1] <= 700:
-            scale_by = int(1050.0/roi.shape[1] + 0.5)
-            roi_lg = transform.rescale(roi, scale_by, order=filter_order, mode='constant', multichannel=False, anti_aliasing=True)
-            new_text = ocr(roi_lg)
-            new_mrz = MRZ.from_ocr(new_text)
-            new_mrz.aux['method'] = 'rescaled(%d)' % filter_order
-            if new_mrz.valid_score > cur_mrz.valid_score:
-                cur_mrz = new_mrz
-                cur_text = new_text
-        return cur_text, cur_mrz
+class _Speculation(object):
+    """A set of concurrently running OCR jobs for the variants of an image (see `BoxToMRZ._speculate`)."""
+
+    def __init__(self, jobs, cancelled):
+        """
+        :param jobs: a list of triples (method, future, submitted). The future gives either the text (then the cost is measured
+                     from the submission time), or a pair (text, cost), or None if the variant is not applicable.
+        :param cancelled: a threading.Event, which tells the jobs that were not started yet to do nothing.
+        """
+        self.jobs = jobs
+        self.cancelled = cancelled
+
+    def results(self, ordered=True):
+        """Yields triples (method, text, cost) for the applicable variants, in the order of the variants or as the jobs complete.
+        The outstanding jobs are cancelled once the iteration is over (or abandoned)."""
+        jobs = dict((f, (m, submitted)) for m, f, submitted in self.jobs)
+        try:
+            for f in ([f for m, f, submitted in self.jobs] if ordered else as_completed(jobs)):
+                method, submitted = jobs[f]
+                try:
+                    result = f.result()
+                except OCRTimeoutError:
+                    result = ''
+                if result is None:
+                    continue
+                text, cost = result if isinstance(result, tuple) else (result, time.time() - submitted)
+                yield method, text, cost
+        finally:
+            self.cancel()
 
-    def _try_black_tophat(self, roi, cur_text, cur_mrz):
-        roi_b = morphology.black_tophat(roi, morphology.disk(5))
-        new_text = ocr(roi_b)  # There are some examples where this line basically hangs for an undetermined amount of time.
-        new_mrz = MRZ.from_ocr(new_text)
-        if new_mrz.valid_score > cur_mrz.valid_score:
-            new_mrz.aux['method'] = 'black_tophat'
-            cur_text, cur_mrz = new_text, new_mrz
+    def cancel(self):
+        self.cancelled.set()
+        for m, f, submitted in self.jobs:
+            f.cancel()
 
-        new_text, new_mrz = self._try_larger_image(roi_b, cur_text, cur_mrz)
-        if new_mrz.valid_score > cur_mrz.valid_score:
-            new_mrz.aux['method'] = 'black_tophat(rescaled(3))'
-            cur_text, cur_mrz = new_text, new_mrz
 
-        return cur_text, cur_mrz
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _speculation_executor():
+    """The thread pool shared by all BoxToMRZ instances in the speculative mode."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(4, multiprocessing.cpu_count()))
+        return _executor
+
+
+def _is_mrz_line(line):
+    """Whether a line of OCR output may be a line of the MRZ (the same criterion as used by `MRZOCRCleaner`)."""
+    return len(line.replace(' ', '')) >= 20 or '<<' in line
 
 
 class TryOtherMaxWidth(object):
@@ -285,14 +1060,23 @@ class TryOtherMaxWidth(object):
 
     __provides__ = ['mrz_final']
     __depends__ = ['mrz', '__pipeline__']
+    __uses__ = ['img', 'img_binary', 'img_pyramid']  # The rerun recomputes the rest
 
-    def __init__(self, other_max_width=1000):
+    def __init__(self, other_max_width=1000, deadline=None):
+        """
+        :param deadline: an optional `Deadline`, after which the pipeline is not rerun.
+        """
         self.other_max_width = other_max_width
+        self.deadline = deadline
 
     def __call__(self, mrz, __pipeline__):
+        if self.deadline is not None and self.deadline.expired:
+            return mrz
         # We'll only try this if we see that img_binary.mean() is very small or img.mean() is very large (i.e. image is mostly white).
         if mrz is None and (__pipeline__['img_binary'].mean() < 0.01 or __pipeline__['img'].mean() > 0.95):
-            __pipeline__.replace_component('scaler', Scaler(self.other_max_width))
+            scaler = __pipeline__.components['scaler']
+            scaler = type(scaler)(self.other_max_width) if isinstance(scaler, Scaler) else Scaler(self.other_max_width)
+            __pipeline__.replace_component('scaler', scaler)
             new_mrz = __pipeline__['mrz']
             if new_mrz is not None:
                 new_mrz.aux['method'] = new_mrz.aux['method'] + '|max_width(%d)' % self.other_max_width
@@ -303,32 +1087,179 @@ class TryOtherMaxWidth(object):
 class MRZPipeline(Pipeline):
     """This is the "currently best-performing" pipeline for parsing MRZ from a given image file."""
 
-    def __init__(self, filename):
+    def __init__(self, filename, ocr_pool=None, batch_ocr=False, time_budget=None, speculative=False, scheduler=None,
+                 lazy_decode=False, image_pyramid=False, connected_components=False, instrument=False, executor=None,
+                 lean=False, keep=(), line_retries=False, fast_boone=False):
+        """
+        :param filename: the image file name, its contents (bytes), a binary stream or a NumPy array (see `Loader`).
+        :param ocr_pool: an optional `OCRWorkerPool` for running the OCR requests (see `FindFirstValidMRZ`).
+        :param batch_ocr: when True, OCR requests are grouped into batches (see `FindFirstValidMRZ`).
+        :param time_budget: an optional time limit in seconds (counted from the creation of the pipeline), after which
+                            the remaining fallback strategies are skipped and the best MRZ found so far is returned
+                            (with aux['budget_exhausted'] set, unless it is valid).
+        :param speculative: when True, the fallback variants of each ROI are OCR-ed concurrently (see `BoxToMRZ`).
+        :param scheduler: an optional `StrategyScheduler` for ordering the fallback variants (see `BoxToMRZ`).
+        :param lazy_decode: when True, boxes are detected on a reduced-resolution decode of the (JPEG) image and
+                            the full image is only decoded when a ROI is extracted from it (see `Loader`).
+        :param image_pyramid: when True, the image is scaled down via a shared `ImagePyramid` (see `PyramidScaler`).
+        :param connected_components: when True, the MRZ candidate boxes are found via connected component labeling
+                                     rather than contour tracing (see `ComponentBoxLocator`).
+        :param instrument: when True, the time and the number of OCR calls ('ocr_calls', see `ocr.ocr_call_count`,
+                           counted per thread, so that concurrently running components are told apart)
+                           of each component are recorded in `stats` (see `Pipeline.instrument`, which may also be
+                           called directly to trace memory).
+        :param executor: an optional `PipelineExecutor`, which computes the `result`, running the independent components
+                         and the processing of the candidate boxes (see `FindFirstValidMRZ`) concurrently.
+        :param lean: when True, the intermediate values (the images, boxes, etc.) are freed as soon as they are no longer
+                     needed (see `Pipeline.keep`), the results of all the boxes are not stored in __debug__mrz and
+                     the work buffers of the fast Boone transform are not kept between calls, so that only the result and
+                     the values listed in keep remain in the pipeline.
+        :param keep: the intermediate values to be kept in the lean mode (e.g. ['roi']).
+        :param line_retries: when True, the low-confidence lines of each ROI are retried first (see `BoxToMRZ`).
+        :param fast_boone: when True, `img_binary` is computed by `FastBooneTransform` rather than `BooneTransform`.
+        """
         super(MRZPipeline, self).__init__()
         self.version = '1.0'  # In principle we might have different pipelines in use, so possible backward compatibility is an issue
         self.filename = filename
-        self.add_component('loader', Loader(filename))
-        self.add_component('scaler', Scaler())
-        self.add_component('boone', BooneTransform())
-        self.add_component('box_locator', MRZBoxLocator())
-        self.add_component('mrz', FindFirstValidMRZ())
-        self.add_component('other_max_width', TryOtherMaxWidth())
+        self.deadline = Deadline(time_budget)
+        self.executor = executor
+        self.counters['ocr_calls'] = lambda: ocr_call_count(thread=True)
+        if instrument:
+            self.instrument()
+        if lean:
+            self.keep = list(keep)
+        self.add_component('loader', Loader(filename, lazy=lazy_decode))
+        if image_pyramid:
+            self.add_component('pyramid', PyramidBuilder())
+            self.add_component('scaler', PyramidScaler())
+        else:
+            self.add_component('scaler', Scaler())
+        self.add_component('boone', FastBooneTransform(reuse_buffers=not lean) if fast_boone else BooneTransform())
+        self.add_component('box_locator', ComponentBoxLocator() if connected_components else MRZBoxLocator())
+        self.add_component('mrz', FindFirstValidMRZ(ocr_pool=ocr_pool, batch_ocr=batch_ocr, deadline=self.deadline,
+                                                    speculative=speculative, scheduler=scheduler,
+                                                    line_retries=line_retries, debug=not lean))
+        self.add_component('other_max_width', TryOtherMaxWidth(deadline=self.deadline))
 
     @property
     def result(self):
+        if self.executor is not None:
+            return self.executor.compute(self, ['mrz_final'])[0]
         return self['mrz_final']
 
 
-def read_mrz(filename, save_roi=False):
+class MRZPlan(object):
+    """
+    `MRZPipeline`, compiled into a `PipelinePlan` for recognizing many documents, e.g. in a long-lived worker.
+    The components are created and the order of their execution is determined once, each call then only loads the image
+    and runs the components on it. The time budget (if any) is counted anew for each document.
+
+    As the components are shared by the calls, a plan should not be called from several threads at once
+    (use one plan per thread). In the lean mode (see `MRZPipeline`), the 'roi' is kept along with the result (for save_roi).
+
+    >>> plan = MRZPlan()
+    >>> plan.plan.order
+    ['scaler', 'boone', 'box_locator', 'mrz', 'other_max_width']
+    """
+
+    def __init__(self, lazy_decode=False, time_budget=None, **kwargs):
+        """
+        :param lazy_decode: when True, JPEG images are decoded lazily (see `Loader`).
+        :param time_budget: an optional time limit in seconds for the recognition of each document (see `MRZPipeline`).
+        :param kwargs: other parameters of `MRZPipeline` (ocr_pool, batch_ocr, speculative, scheduler, image_pyramid, ...).
+                       With an executor, the components are run in order, but the candidate boxes are processed concurrently.
+        """
+        self.lazy_decode = lazy_decode
+        self.time_budget = time_budget
+        self.pipeline = MRZPipeline(None, lazy_decode=lazy_decode, **kwargs)
+        keep = self.pipeline.keep + ['roi'] if self.pipeline.keep is not None else None
+        self.plan = self.pipeline.compile(['mrz_final'], inputs=['img'], keep=keep)
+
+    def run(self, filename):
+        """Runs the plan on a given image (anything accepted by `Loader`), returns the resulting `PipelineRun`."""
+        self.pipeline.deadline.reset(self.time_budget)
+        img = Loader(filename, lazy=self.lazy_decode)()
+        if self.pipeline.executor is not None:
+            # The candidate boxes are processed concurrently, see `FindFirstValidMRZ`
+            return self.plan.run(img=img, __executor__=self.pipeline.executor)
+        return self.plan.run(img=img)
+
+    def __call__(self, filename, save_roi=False):
+        """Returns the MRZ, found in a given image, as `read_mrz` does."""
+        p = self.run(filename)
+        mrz = p['mrz_final']
+        if mrz is not None:
+            if save_roi: mrz.aux['roi'] = p['roi']
+            if p.stats is not None: mrz.aux['stats'] = p.stats
+        return mrz
+
+
+def read_mrz(filename, save_roi=False, ocr_pool=None, batch_ocr=False, time_budget=None, speculative=False,
+             scheduler=None, lazy_decode=False, image_pyramid=False, connected_components=False, multipage=False,
+             max_pages=None, instrument=False, executor=None, lean=False, line_retries=False, fast_boone=False):
     """The main interface function to this module, encapsulating the recognition pipeline.
        Given an image filename, runs MRZPipeline on it, returning the parsed MRZ object.
 
+    :param filename: the image file name. The image may also be given as its contents (bytes or a memoryview),
+                     a binary stream (e.g. an uploaded file) or a NumPy array.
     :param save_roi: when this is True, the .aux['roi'] field will contain the Region of Interest where the MRZ was parsed from.
+    :param ocr_pool: an optional `OCRWorkerPool` for running the OCR requests.
+    :param batch_ocr: when True, OCR requests are grouped into batches, each recognized in a single engine pass.
+    :param time_budget: an optional time limit in seconds for the recognition (see `MRZPipeline`).
+    :param speculative: when True, the fallback OCR variants are run concurrently, the first valid one wins.
+    :param scheduler: an optional `StrategyScheduler`, which orders the fallback OCR variants by their expected
+                      success per second (and learns from the outcomes).
+    :param lazy_decode: when True, JPEG images are decoded at a reduced resolution for locating the MRZ,
+                        and at full resolution only when needed for OCR.
+    :param image_pyramid: when True, the image is scaled down via a shared image pyramid (see `PyramidScaler`).
+    :param connected_components: when True, the candidate boxes are found via connected component labeling
+                                 (see `ComponentBoxLocator`).
+    :param multipage: when True, all the images of the file (see `iter_images`), rather than the first one, are examined
+                      one by one until a valid MRZ is found. Otherwise, the MRZ with the best valid_score is returned.
+                      The index of the image is stored in .aux['page']. The time_budget applies to all the images.
+    :param max_pages: in the multipage mode, only the images of the first max_pages pages are examined.
+    :param instrument: when True, the per-component statistics of the pipeline (see `Pipeline.instrument`) are stored
+                       in .aux['stats'] (in the multipage mode - those of the image the MRZ was found in).
+    :param executor: an optional `PipelineExecutor` for processing the image concurrently (see `MRZPipeline`).
+    :param lean: when True, the intermediate images are freed as soon as they are no longer needed (see `MRZPipeline`),
+                 reducing the memory used by the recognition.
+    :param line_retries: when True, the OCR result of a ROI with per-character confidences is obtained, and
+                         the low-confidence lines are retried first, before retrying the whole ROI (see `BoxToMRZ`).
+    :param fast_boone: when True, the faster implementation of the Boone transform is used (see `FastBooneTransform`).
     """
     print("\n\t\tRunning Fork by chekin.io\n\t\t===========================\n")
-    p = MRZPipeline(filename)
+    kwargs = dict(ocr_pool=ocr_pool, batch_ocr=batch_ocr, speculative=speculative, scheduler=scheduler,
+                  lazy_decode=lazy_decode, image_pyramid=image_pyramid, connected_components=connected_components,
+                  instrument=instrument, executor=executor, lean=lean, keep=['roi'] if save_roi else [],
+                  line_retries=line_retries, fast_boone=fast_boone)
+    if multipage:
+        return _read_mrz_multipage(filename, save_roi, time_budget, max_pages, **kwargs)
+    p = MRZPipeline(filename, time_budget=time_budget, **kwargs)
     mrz = p.result
 
     if mrz is not None:
         if save_roi: mrz.aux['roi'] = p['roi']
+        if p.stats is not None: mrz.aux['stats'] = p.stats
     return mrz
+
+
+def _read_mrz_multipage(filename, save_roi, time_budget, max_pages, **kwargs):
+    """Runs MRZPipeline on the images of the file one by one, see `read_mrz`."""
+    deadline = Deadline(time_budget)
+    best = None
+    for i, img in enumerate(iter_images(filename, max_pages=max_pages)):
+        if deadline.expired:
+            if best is not None:
+                best.aux['budget_exhausted'] = True
+            break
+        p = MRZPipeline(img, time_budget=deadline.remaining(), **kwargs)
+        mrz = p.result
+        if mrz is not None:
+            mrz.aux['page'] = i
+            if save_roi: mrz.aux['roi'] = p['roi']
+            if p.stats is not None: mrz.aux['stats'] = p.stats
+            if mrz.valid:
+                return mrz
+            if best is None or mrz.valid_score > best.valid_score:
+                best = mrz
+    return best
@@ -0,0 +1,335 @@
+'''
+PassportEye::MRZ: Machine-readable zone extraction and parsing.
+A template-matching recognizer for the OCR-B characters of the MRZ.
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+
+import hashlib
+import numpy as np
+import pkg_resources
+from scipy import ndimage
+from skimage import filters
+from ..util.ocr import OCRBackend, OCRChar, OCRResult, MRZ_WHITELIST, make_backend, call_backend, count_ocr_call, \
+    backend_identity
+
+# Known MRZ line lengths (TD1, TD2, TD3/MRVA) used as a prior for the number of characters in a line.
+MRZ_LINE_LENGTHS = [30, 36, 44]
+
+
+class OCRBRecognizer(object):
+    """
+    Recognizes MRZ text in an ROI (as extracted by BoxToMRZ) without Tesseract, relying on the fact that
+    the MRZ is always printed in the monospaced OCR-B font with a fixed alphabet of 37 characters.
+
+    The recognition proceeds as follows:
+        - The ROI is binarized (Otsu), and split into text lines using the horizontal projection profile.
+        - Each line is split into equally-spaced character cells. The character pitch is estimated from the
+          connected components of the line, and the number of cells is snapped to the nearest valid MRZ line length.
+        - Each cell is normalized to a fixed-size glyph (centered at the ink's center of mass), and all the glyphs
+          are classified in one vectorized pass via normalized correlation against the templates.
+
+    The result is the recognized text along with per-character scores (correlation values between -1 and 1).
+    Characters, which are too similar in OCR-B to be told apart reliably (O, 0 and Q, see `CONFUSABLE`), are marked as ambiguous
+    when the best match beats the other characters of its group by less than `min_margin`.
+
+    The templates are loaded from the file `ocrb_templates.npz` bundled with the package (if present) or from a given file.
+    New templates can be computed from labeled ROIs via `fit` or from the glyphs of a font via `fit_font`.
+    The bundled templates were computed by `fit_font` from DejaVu Sans Mono (shipped with matplotlib), as OCR-B itself can not
+    be redistributed. Refitting them from an actual OCR-B font file is recommended when one is available.
+    """
+
+    GLYPH_SHAPE = (20, 14)
+    CONFUSABLE = ['0OQ']
+
+    def __init__(self, templates='default', line_lengths=MRZ_LINE_LENGTHS, min_margin=0.02):
+        """
+        :param templates: a filename of an .npz file with the templates, 'default' for the bundled ones or None for no templates.
+        :param line_lengths: the possible numbers of characters in a line (an empty list means no constraint).
+        :param min_margin: the minimal score difference between a confusable character and the rest of its group,
+                           below which the character is considered ambiguous.
+        """
+        self.line_lengths = line_lengths
+        self.min_margin = min_margin
+        self.labels = np.array([], dtype='U1')
+        self.templates = np.zeros((0, self.GLYPH_SHAPE[0]*self.GLYPH_SHAPE[1]))
+        if templates == 'default':
+            templates = pkg_resources.resource_filename('passporteye.mrz', 'ocrb_templates.npz')
+        if templates is not None:
+            self.load(templates)
+
+    def __call__(self, roi):
+        """Recognizes the text in a given ROI.
+
+        :return: a tuple (text, scores), where text contains the recognized lines, separated by newlines
+                 and scores is a list of per-character score arrays, one per line.
+        """
+        result = self.recognize(roi)
+        return result.text, [np.array([c.conf for c in line]) / 100.0 for line in result.lines]
+
+    def recognize(self, roi, ambiguous=False):
+        """Recognizes the text in a given ROI, returns an `OCRResult` with the character boxes
+        and confidences (the scores, mapped to the range 0..100).
+
+        :param ambiguous: when True, a pair (result, lines) is returned, where lines is the list of indices
+                          of the lines containing ambiguous characters.
+        """
+        lines = self.segment(roi, boxes=True)
+        if not lines or len(self.labels) == 0:
+            return (OCRResult([]), []) if ambiguous else OCRResult([])
+        labels, scores, margins = self.classify(np.vstack([g for g, b in lines]))
+        result, ambiguous_lines, i = [], [], 0
+        for k, (g, b) in enumerate(lines):
+            result.append([OCRChar(c, tuple(box), 100.0*s)
+                           for c, box, s in zip(labels[i:i+len(g)], b.tolist(), scores[i:i+len(g)].tolist())])
+            if np.any(margins[i:i+len(g)] < self.min_margin):
+                ambiguous_lines.append(k)
+            i += len(g)
+        return (OCRResult(result), ambiguous_lines) if ambiguous else OCRResult(result)
+
+    def classify(self, glyphs):
+        """Classifies a matrix of normalized glyph vectors (see `segment`), returns arrays of labels, scores and margins.
+        The margin of a character is the difference between its score and the best score among the other characters
+        of its `CONFUSABLE` group (infinite for characters, which are not in any group, or whose group has no other templates).
+        """
+        corr = np.dot(glyphs, self.templates.T)
+        best = np.argmax(corr, axis=1)
+        scores = corr[np.arange(len(best)), best]
+        margins = np.full(len(best), np.inf)
+        for group in self.CONFUSABLE:
+            members = np.nonzero(np.in1d(self.labels, list(group)))[0]
+            for m in members:
+                others = members[members != m]
+                rows = best == m
+                if len(others) and rows.any():
+                    margins[rows] = scores[rows] - corr[rows][:, others].max(axis=1)
+        return self.labels[best], scores, margins
+
+    def segment(self, roi, boxes=False):
+        """Splits the ROI into lines and characters.
+
+        :param boxes: when True, the boxes (left, top, right, bottom) of the characters are returned as well.
+        :return: a list with a matrix of normalized glyph vectors (one row per character) for each line,
+                 or a list of pairs (glyphs, boxes) if boxes is True.
+        """
+        ink = self._ink(roi)
+        if ink is None:
+            return []
+        binary = ink > filters.threshold_otsu(ink)
+        lines = self._lines(binary)
+        result = []
+        for i, (top, bottom) in enumerate(lines):
+            # The line may be slightly skewed, hence the glyphs are looked for in a somewhat wider band
+            margin = (bottom - top) // 2
+            lo = max(top - margin, lines[i-1][1] if i > 0 else 0)
+            hi = min(bottom + margin, lines[i+1][0] if i + 1 < len(lines) else binary.shape[0])
+            cells = self._cells(binary[top:bottom])
+            if cells is not None:
+                glyphs, line_boxes = self._glyphs(ink[lo:hi], binary[lo:hi], cells, bottom - top)
+                line_boxes[:, [1, 3]] += lo
+                result.append((glyphs, line_boxes) if boxes else glyphs)
+        return result
+
+    def fit(self, rois, texts):
+        """Computes the templates from a list of ROIs with known texts (one template per character, averaged).
+        Only the lines, for which the number of segmented characters matches the text, are used.
+        The character '?' in a text may be used to mark characters that should be ignored.
+        """
+        samples = {}
+        for roi, text in zip(rois, texts):
+            text_lines = text.split('\n')
+            line_glyphs = self.segment(roi)
+            if len(line_glyphs) != len(text_lines):
+                continue
+            for glyphs, ln in zip(line_glyphs, text_lines):
+                if len(glyphs) != len(ln):
+                    continue
+                for g, c in zip(glyphs, ln):
+                    if c != '?':
+                        samples.setdefault(c, []).append(g)
+        labels = sorted(samples)
+        templates = np.array([_normalize(np.mean(samples[c], axis=0)) for c in labels])
+        self.labels = np.array(labels, dtype='U1')
+        self.templates = templates.reshape(len(labels), -1)
+
+    def fit_font(self, font_file, font_sizes=(24, 32, 40), alphabet=MRZ_WHITELIST):
+        """Computes the templates from the glyphs of a TrueType/OpenType font (e.g. OCR-B), rendered in MRZ-like lines
+        at several sizes (see `fit`). Requires PIL (Pillow)."""
+        from PIL import Image, ImageDraw, ImageFont
+        rois, texts = [], []
+        for size in font_sizes:
+            font = ImageFont.truetype(font_file, size)
+            for k in range(len(alphabet)):
+                text = (alphabet[k:] + alphabet[:k] + '<'*MRZ_LINE_LENGTHS[-1])[:MRZ_LINE_LENGTHS[-1]]
+                left, top, right, bottom = font.getbbox(text)
+                img = Image.new('L', (right + size, bottom + size), 255)
+                ImageDraw.Draw(img).text((size//2, size//2), text, font=font, fill=0)
+                rois.append(np.asarray(img, dtype=np.float64) / 255.0)
+                texts.append(text)
+        self.fit(rois, texts)
+
+    def save(self, filename):
+        np.savez_compressed(filename, labels=self.labels, templates=self.templates.astype(np.float32))
+
+    def load(self, filename):
+        data = np.load(filename)
+        self.labels = data['labels']
+        self.templates = data['templates'].astype(np.float64)
+
+    def _ink(self, roi):
+        """Converts the ROI to "ink intensity" (ink is high, background low), fixing the polarity if needed."""
+        roi = np.asarray(roi, dtype=np.float64)
+        lo, hi = roi.min(), roi.max()
+        if hi - lo < 1e-6 or roi.shape[0] < 8 or roi.shape[1] < 8:
+            return None
+        ink = (hi - roi) / (hi - lo)
+        if np.median(ink) > 0.5:
+            ink = 1.0 - ink
+        return ink
+
+    def _lines(self, binary, min_height_ratio=0.4):
+        """Finds text lines as runs of rows with ink in the horizontal projection profile."""
+        profile = binary.mean(axis=1)
+        rows = profile > max(0.02, 0.25*profile.max())
+        lines = _runs(rows)
+        if not lines:
+            return []
+        max_height = max(b - t for t, b in lines)
+        return [(t, b) for t, b in lines if b - t >= min_height_ratio*max_height]
+
+    def _cells(self, line_binary):
+        """Splits a line into equally-spaced character cells, returns the array of cell boundaries (or None)."""
+        labeled, n = ndimage.label(line_binary, structure=np.ones((3, 3)))
+        if n < 2:
+            return None
+        objs = ndimage.find_objects(labeled)
+        height = line_binary.shape[0]
+        # Ignore specks of noise
+        spans = np.array([(o[1].start, o[1].stop) for o in objs if o[0].stop - o[0].start >= 0.3*height])
+        if len(spans) < 2:
+            return None
+        centers = np.sort(spans.mean(axis=1))
+        pitch = np.median(np.diff(centers))
+        if pitch <= 0:
+            return None
+        n_chars = int(round((centers[-1] - centers[0]) / pitch)) + 1
+        if self.line_lengths:
+            nearest = min(self.line_lengths, key=lambda k: abs(k - n_chars))
+            if abs(nearest - n_chars) <= 0.15*nearest:
+                n_chars = nearest
+        pitch = (centers[-1] - centers[0]) / (n_chars - 1)
+        return np.linspace(centers[0] - pitch/2, centers[-1] + pitch/2, n_chars + 1)
+
+    def _glyphs(self, band_ink, band_binary, cells, height):
+        """Cuts out the glyphs of the given cells from the band around a line and normalizes them,
+        returns the matrix of glyph vectors along with the (integer) array of glyph boxes. Each glyph is centered horizontally at its center of mass. Vertically, the glyphs follow a straight line,
+        fitted to the centers of the full-height glyphs (this compensates for slight skew of the ROI)."""
+        n = len(cells) - 1
+        pitch = cells[1] - cells[0]
+        x_centers, y_extents = np.empty(n), np.full((n, 2), np.nan)
+        for i, (left, right) in enumerate(zip(cells[:-1], cells[1:])):
+            left, right = max(int(left), 0), int(np.ceil(right))
+            cell = band_binary[:, left:right]
+            col_mass = cell.sum(axis=0)
+            mass = col_mass.sum()
+            x_centers[i] = left + np.dot(col_mass, np.arange(len(col_mass)))/mass if mass > 0 else (cells[i] + cells[i+1])/2
+            rows = np.nonzero(cell.any(axis=1))[0]
+            if len(rows):
+                y_extents[i] = rows[0], rows[-1] + 1
+
+        k = np.arange(n)
+        heights = y_extents[:, 1] - y_extents[:, 0]
+        with np.errstate(invalid='ignore'):
+            full = heights >= 0.8*np.nanmedian(heights) if not np.all(np.isnan(heights)) else np.zeros(n, dtype=bool)
+        if full.sum() >= 2:
+            slope, intercept = np.polyfit(k[full], y_extents[full].mean(axis=1), 1)
+            y_centers = intercept + slope*k
+        else:
+            y_centers = np.full(n, band_ink.shape[0]/2.0)
+
+        rr = y_centers[:, None, None] + np.linspace(-height/2.0, height/2.0, self.GLYPH_SHAPE[0])[None, :, None]
+        cc = x_centers[:, None, None] + np.linspace(-pitch/2.0, pitch/2.0, self.GLYPH_SHAPE[1])[None, None, :]
+        rr, cc = np.broadcast_arrays(rr, cc)
+        glyphs = ndimage.map_coordinates(band_ink, [rr.ravel(), cc.ravel()], order=1, mode='constant', cval=0.0)
+        boxes = np.column_stack([x_centers - pitch/2.0, y_centers - height/2.0, x_centers + pitch/2.0, y_centers + height/2.0])
+        return _normalize(glyphs.reshape(n, -1)), np.round(boxes).astype(int)
+
+
+class OCRBBackend(OCRBackend):
+    """An OCR backend, which uses `OCRBRecognizer` for MRZ recognition, and falls back to another backend
+    (Tesseract by default) when the recognizer is not confident, when a line contains an ambiguous character
+    (e.g. O vs 0) or when not in MRZ mode.
+
+    Each request counts as a single OCR call (see `ocr.ocr_call_count`), whether it is served by the recognizer
+    or by the fallback.
+
+    The backend is opt-in (it is never selected by `ocr.set_backend('auto')`). With the bundled templates, rendered from
+    a substitute font (see `OCRBRecognizer`), the recognizer is rarely confident on real scans, hence nearly every request
+    ends up at the fallback, after the cost of the recognition. Use it with templates fitted from an OCR-B font.
+    """
+
+    counts_calls = True
+
+    def __init__(self, recognizer=None, fallback='auto', min_score=0.6):
+        """
+        :param recognizer: an `OCRBRecognizer` instance (default: one with the bundled templates).
+        :param fallback: the fallback backend (see `passporteye.util.ocr.set_backend` for possible values).
+        :param min_score: the recognizer's result is used if the lowest mean per-line score reaches this value.
+        """
+        self.recognizer = recognizer if recognizer is not None else OCRBRecognizer()
+        self.fallback = make_backend(fallback)
+        self.min_score = min_score
+
+    def identity(self):
+        r = self.recognizer
+        templates = hashlib.blake2b(np.ascontiguousarray(r.templates).tobytes() + ''.join(r.labels).encode('utf-8'),
+                                    digest_size=8).hexdigest()
+        return '%s(%s, %s, %s, %s)' % (super(OCRBBackend, self).identity(), templates, r.min_margin, self.min_score,
+                                       backend_identity(self.fallback))
+
+    def __call__(self, img, mrz_mode=True, timeout=None):
+        result = self._recognize(img) if mrz_mode else None
+        if result is not None:
+            count_ocr_call()
+            return result.text
+        return call_backend(self.fallback, self.fallback, img, mrz_mode, timeout)
+
+    def detailed(self, img, mrz_mode=True, timeout=None):
+        result = self._recognize(img) if mrz_mode else None
+        if result is not None:
+            count_ocr_call()
+            return result
+        detailed = getattr(self.fallback, 'detailed', None)
+        if detailed is not None:
+            try:
+                return call_backend(self.fallback, detailed, img, mrz_mode, timeout)
+            except NotImplementedError:
+                pass
+        return OCRResult.from_text(call_backend(self.fallback, self.fallback, img, mrz_mode, timeout))
+
+    def _recognize(self, img):
+        """Runs the recognizer, returns its result if it is acceptable (confident enough, with no ambiguous lines) or None."""
+        result, ambiguous = self.recognizer.recognize(img, ambiguous=True)
+        if result.lines and not ambiguous and min(np.mean([c.conf for c in line]) for line in result.lines) >= 100*self.min_score:
+            return result
+        return None
+
+
+def _normalize(x):
+    """Normalizes vectors (rows of x) to zero mean and unit length, so that dot products become correlations."""
+    x = np.asarray(x, dtype=np.float64)
+    x = x - x.mean(axis=-1, keepdims=True)
+    norm = np.sqrt((x*x).sum(axis=-1, keepdims=True))
+    return x / np.where(norm > 0, norm, 1)
+
+
+def _runs(mask):
+    """Returns the list of (start, end) index ranges of the runs of True values in a boolean vector.
+
+    >>> _runs(np.array([0, 1, 1, 0, 1], dtype=bool))
+    [(1, 3), (4, 5)]
+    """
+    d = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return list(zip(np.nonzero(d == 1)[0].tolist(), np.nonzero(d == -1)[0].tolist()))
+
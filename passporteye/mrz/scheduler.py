@@ -0,0 +1,96 @@
+'''
+PassportEye::MRZ: Machine-readable zone extraction and parsing.
+Adaptive ordering of the fallback OCR strategies.
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+
+import json
+import threading
+
+
+class StrategyScheduler(object):
+    """
+    Keeps running statistics of the fallback strategies of `BoxToMRZ` (the number of attempts, the number of successes,
+    i.e. valid MRZs, and the total time spent) and orders the strategies by their expected success per second:
+
+        ((successes + 1) / (attempts + 2)) / mean_cost
+
+    Strategies without statistics get the mean cost of the known ones and keep their relative order.
+    Method names are normalized by stripping the pipeline-level suffixes (such as '|max_width(1000)'), as those denote
+    the same strategy applied to a differently scaled image.
+
+    >>> s = StrategyScheduler()
+    >>> s.order(['rescaled(3)', 'rescaled(1)', 'black_tophat'])
+    ['rescaled(3)', 'rescaled(1)', 'black_tophat']
+    >>> for i in range(10):
+    ...     s.record('rescaled(3)', False, 0.5)
+    ...     s.record('black_tophat|max_width(1000)', True, 0.25)
+    >>> s.order(['rescaled(3)', 'rescaled(1)', 'black_tophat'])
+    ['black_tophat', 'rescaled(1)', 'rescaled(3)']
+    >>> s.stats['black_tophat']
+    {'attempts': 10, 'successes': 10, 'cost': 2.5}
+    """
+
+    def __init__(self, stats_file=None):
+        """
+        :param stats_file: an optional JSON file with statistics to start from (see `save` and the `evaluate_mrz` script).
+        """
+        self.stats = {}     # All the statistics (loaded and recorded)
+        self.recorded = {}  # The statistics recorded by this instance only
+        self._lock = threading.Lock()
+        if stats_file is not None:
+            self.load(stats_file)
+
+    def record(self, method, success, cost):
+        """Records an attempt of a strategy: whether it gave a valid MRZ and how long it took (in seconds)."""
+        attempt = {method: {'attempts': 1, 'successes': int(bool(success)), 'cost': cost}}
+        self.merge(attempt)
+        with self._lock:
+            _add_stats(self.recorded, attempt)
+
+    def merge(self, stats):
+        """Adds the given statistics (a dictionary in the format of `stats`) to the current ones."""
+        with self._lock:
+            _add_stats(self.stats, stats)
+
+    def order(self, methods):
+        """Returns the given strategy names, ordered by their expected success per second (highest first)."""
+        with self._lock:
+            stats = [self.stats.get(_strategy(m)) for m in methods]
+            known = [st['cost'] / st['attempts'] for st in stats if st is not None and st['attempts'] > 0]
+        default_cost = sum(known) / len(known) if known else 1.0
+
+        def rate(st):
+            if st is None or st['attempts'] == 0:
+                return 0.5 / default_cost
+            return ((st['successes'] + 1.0) / (st['attempts'] + 2.0)) / max(st['cost'] / st['attempts'], 1e-6)
+        rates = [rate(st) for st in stats]
+        return [methods[i] for i in sorted(range(len(methods)), key=lambda i: -rates[i])]
+
+    def save(self, filename):
+        with self._lock:
+            with open(filename, 'w') as f:
+                json.dump({'strategies': self.stats}, f, indent=2, sort_keys=True)
+
+    def load(self, filename):
+        """Loads statistics from a JSON file (in addition to the current ones)."""
+        with open(filename) as f:
+            self.merge(json.load(f)['strategies'])
+
+
+def _add_stats(stats, other):
+    for method, st in other.items():
+        cur = stats.setdefault(_strategy(method), {'attempts': 0, 'successes': 0, 'cost': 0.0})
+        for k in cur:
+            cur[k] += st.get(k, 0)
+
+
+def _strategy(method):
+    """The strategy name, corresponding to a method name, as recorded in mrz.aux['method'].
+
+    >>> _strategy('rescaled(3)|max_width(1000)')
+    'rescaled(3)'
+    """
+    return method.split('|')[0]
@@ -7,22 +7,69 @@ License: MIT
 '''
 import argparse, time, glob, pkg_resources, os, multiprocessing, logging, json, shutil
 from collections import Counter
+import numpy as np
 from skimage import io
 import passporteye
-from .image import read_mrz
+from .image import MRZPipeline
+from .scheduler import StrategyScheduler
 
 def process_file(params):
     """
-    Processes a file and returns the parsed MRZ (or None if no candidate regions were even found).
+    Processes a file and returns the parsed MRZ (or None if no candidate regions were even found),
+    along with the statistics of the fallback strategies tried (see `StrategyScheduler`)
+    and the statistics of the pipeline components (see `Pipeline.instrument`).
+    The optional third parameter is a strategy statistics file, used for ordering the fallback strategies.
+    The optional fourth parameter, when True, enables tracing of the memory allocations of the components.
+    The optional fifth parameter, when True, enables recording the statistics of the fallback strategies.
+    Unless a statistics file is given or the statistics are recorded, the fallback strategies are tried in their fixed
+    default order (a scheduler would reorder them by the measured time, which would make the results depend on timing).
     """
     tic = time.time()
-    filename, save_roi = params
+    filename, save_roi = params[:2]
+    stats_file = params[2] if len(params) > 2 else None
+    trace_memory = params[3] if len(params) > 3 else False
+    record_stats = params[4] if len(params) > 4 else False
+    scheduler = StrategyScheduler(stats_file) if stats_file is not None or record_stats else None
+    p = MRZPipeline(filename, scheduler=scheduler)
+    p.instrument(trace_memory)
     try:
-        mrz = read_mrz(filename, save_roi=save_roi)
+        mrz = p.result
+        if mrz is not None and save_roi:
+            mrz.aux['roi'] = p['roi']
     except Exception:
         mrz = None
     walltime = time.time() - tic
-    return (filename, mrz, walltime)
+    return (filename, mrz, walltime, scheduler.recorded if scheduler is not None else {}, p.stats)
+
+
+def stage_table(stats_list):
+    """
+    Given a list of per-file component statistics (see `Pipeline.instrument`), returns the lines of a table with the
+    50%, 95% and 99% percentiles of the wall time, CPU time, OCR calls and peak memory of each component (stage) per file.
+    A component which was not run for a file counts as taking no time there.
+
+    >>> lines = stage_table([{'mrz': {'calls': 1, 'wall_time': 0.5, 'cpu_time': 0.25, 'ocr_calls': 2, 'peak_memory': None}}])
+    >>> print(lines[2])
+    mrz                     500.0    500.0    500.0    250.0    250.0    250.0      2      2      2
+    """
+    names = []
+    for st in stats_list:
+        names += [n for n in st if n not in names]
+    header = "%-20s %8s %8s %8s %8s %8s %8s %6s %6s %6s" % ('', 'wall p50', 'p95', 'p99', 'cpu p50', 'p95', 'p99', 'ocr 50', '95', '99')
+    columns = [('wall_time', 1000.0), ('cpu_time', 1000.0), ('ocr_calls', 1)]
+    if any(c.get('peak_memory') is not None for st in stats_list for c in st.values()):
+        header += " %8s %8s %8s" % ('MB p50', 'p95', 'p99')
+        columns.append(('peak_memory', 1.0/2**20))
+    lines = ["Stage times (ms), OCR calls and peak memory (MB) per file:", header]
+    for name in names:
+        line = "%-20s" % name
+        for key, mult in columns:
+            values = [(st[name][key] or 0) * mult if name in st else 0 for st in stats_list]
+            p = np.percentile(values, [50, 95, 99])
+            line += (" %6d %6d %6d" % tuple(p)) if key == 'ocr_calls' else (" %8.1f %8.1f %8.1f" % tuple(p))
+        lines.append(line)
+    return lines
+
 
 def evaluate_mrz():
     """
@@ -39,6 +86,12 @@ def evaluate_mrz():
     parser.add_argument('-rd', '--roi-dir', default=None,
                                 help='Extract ROIs to this directory')
     parser.add_argument('-l', '--limit', default=-1, type=int, help='Only process the first <limit> files in the directory.')
+    parser.add_argument('--load-stats', default=None,
+                                help='Order the fallback OCR strategies according to the statistics in this file')
+    parser.add_argument('--save-stats', default=None,
+                                help='Save the statistics of the fallback OCR strategies (attempts, successes, time) to this file')
+    parser.add_argument('--trace-memory', action='store_true',
+                                help='Report the peak memory allocated by each stage of the pipeline (slows down the processing)')
     args = parser.parse_args()
     files = sorted(glob.glob(os.path.join(args.data_dir, '*.*')))
     if args.limit >= 0:
@@ -70,10 +123,15 @@ def evaluate_mrz():
             return '?'
 
     method_stats = Counter()
+    strategy_stats = StrategyScheduler()
+    stage_stats = []
 
-    for result in pool.imap_unordered(process_file, [(f, save_roi) for f in files]):
-        filename, mrz, walltime = result
+    params = [(f, save_roi, args.load_stats, args.trace_memory, args.save_stats is not None) for f in files]
+    for filename, mrz, walltime, stats, component_stats in pool.imap_unordered(process_file, params):
+        result = (filename, mrz, walltime)
         results.append(result)
+        strategy_stats.merge(stats)
+        stage_stats.append(component_stats)
         log.info("Processed %s in %0.2fs (score %d) [%s]" % (os.path.basename(filename), walltime, valid_score(mrz), score_change_type(filename, mrz)))
         log.debug("\t%s" % str(mrz))
 
@@ -111,6 +169,10 @@ def evaluate_mrz():
     print("Methods used:")
     for stat in method_stats.most_common():
         print("  %s: %d" % stat)
+    for line in stage_table(stage_stats):
+        print(line)
+    if args.save_stats is not None:
+        strategy_stats.save(args.save_stats)
 
 def mrz():
     """
@@ -124,7 +186,7 @@ def mrz():
     parser.add_argument('--version', action='version', version='PassportEye MRZ v%s' % passporteye.__version__)
     args = parser.parse_args()
 
-    filename, mrz, walltime = process_file((args.filename, args.save_roi is not None))
+    filename, mrz, walltime, stats, component_stats = process_file((args.filename, args.save_roi is not None))
     d = mrz.to_dict() if mrz is not None else {'mrz_type': None, 'valid': False, 'valid_score': 0}
     d['walltime'] = walltime
     d['filename'] = filename
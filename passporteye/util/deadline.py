@@ -0,0 +1,60 @@
+'''
+PassportEye::Util: Time budget tracking.
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+
+import time
+
+
+class Deadline(object):
+    """
+    A point in time by which a computation should be complete, used to cut off optional (fallback) steps
+    of the recognition pipeline.
+
+    >>> d = Deadline(10)
+    >>> d.expired, 9 < d.remaining() <= 10, d.timeout(5)
+    (False, True, 5)
+    >>> Deadline(0).expired
+    True
+    >>> d = Deadline(None)
+    >>> d.expired, d.remaining(), d.timeout(5)
+    (False, None, 5)
+    """
+
+    def __init__(self, time_budget=None, clock=time.time):
+        """
+        :param time_budget: the number of seconds from now until the deadline (None means no deadline).
+        :param clock: the function returning the current time in seconds.
+        """
+        self.clock = clock
+        self.reset(time_budget)
+
+    def reset(self, time_budget=None):
+        """Moves the deadline to the given number of seconds from now (None means no deadline).
+
+        >>> d = Deadline(0)
+        >>> d.reset(10)
+        >>> d.expired
+        False
+        """
+        self.time_budget = time_budget
+        self.deadline = self.clock() + time_budget if time_budget is not None else None
+
+    def remaining(self):
+        """The number of seconds left (zero if the deadline has passed) or None if there is no deadline."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - self.clock(), 0.0)
+
+    @property
+    def expired(self):
+        return self.deadline is not None and self.clock() >= self.deadline
+
+    def timeout(self, timeout=None):
+        """Returns the timeout for an operation, which must not exceed the remaining time nor the given timeout (if any)."""
+        remaining = self.remaining()
+        if remaining is None or (timeout is not None and timeout < remaining):
+            return timeout
+        return remaining
@@ -5,10 +5,15 @@ Author: Konstantin Tretyakov
 License: MIT
 '''
 import numpy as np
-from sklearn.decomposition import PCA
 from matplotlib import pyplot as plt
 from matplotlib import patches
-from skimage import transform
+from skimage import img_as_float
+from scipy import ndimage
+from scipy.spatial import ConvexHull
+try:
+    from scipy.spatial import QhullError
+except ImportError:
+    from scipy.spatial.qhull import QhullError
 
 
 class RotatedBox(object):
@@ -124,6 +129,11 @@ class RotatedBox(object):
         Note that the box coordinates are interpreted as "image coordinates" (i.e. x is row and y is column),
         and box angle is considered to be relative to the vertical (i.e. np.pi/2 is "normal orientation")
 
+        Only the pixels of the output are computed: each of them is mapped to the source image by a single affine transform
+        and interpolated (bilinearly) from the part of the image around the box. For a box in "normal orientation"
+        the output is simply a part of the image. The output is cut down to the rows and columns which overlap with the image
+        (any remaining pixels outside of the image, i.e. the corners of a tilted box, repeat the nearest edge pixels of the image).
+
         :param img: a numpy ndarray suitable for image processing via skimage.
         :param scale: the RotatedBox is scaled by this value before performing the extraction.
             This is necessary when, for example, the location of a particular feature is determined using a smaller image,
@@ -134,63 +144,72 @@ class RotatedBox(object):
         :param margin_height: The margin that should be added to the height dimension of the box from each side.
         :return: a numpy ndarray, corresponding to the extracted region (aligned straight).
 
-        TODO: This could be made more efficient if we avoid rotating the full image and cut out the ROI from it beforehand.
-        """
-        rotate_by = (np.pi/2 - self.angle)*180/np.pi
-        img_rotated = transform.rotate(img, angle=rotate_by, center=[self.center[1]*scale, self.center[0]*scale], resize=True)
-        # The resizeable transform will shift the resulting image somewhat wrt original coordinates.
-        # When we cut out the box we will compensate for this shift.
-        shift_c, shift_r = self._compensate_rotation_shift(img, scale)
-
-        r1 = max(int((self.center[0] - self.height/2 - margin_height)*scale - shift_r), 0)
-        r2 = int((self.center[0] + self.height/2 + margin_height)*scale - shift_r)
-        c1 = max(int((self.center[1] - self.width/2 - margin_width)*scale - shift_c), 0)
-        c2 = int((self.center[1] + self.width/2 + margin_width)*scale - shift_c)
-        return img_rotated[r1:r2, c1:c2]
-
-    def _compensate_rotation_shift(self, img, scale):
-        """This is an auxiliary method used by extract_from_image.
-        It is needed due to particular specifics of the skimage.transform.rotate implementation.
-        Namely, when you use rotate(... , resize=True), the rotated image is rotated and shifted by certain amount.
-        Thus when we need to cut out the box from the image, we need to account for this shift.
-        We do this by repeating the computation from skimage.transform.rotate here.
-
-        TODO: This makes the code uncomfortably coupled to SKImage (e.g. this logic is appropriate for skimage 0.12.1, but not for 0.11,
-        and no one knows what happens in later versions). A solution would be to use skimage.transform.warp with custom settings, but we can think of it later.
+        >>> img = np.arange(100.0).reshape(10, 10)
+        >>> RotatedBox([4, 5], 4, 2, np.pi/2).extract_from_image(img, margin_width=1, margin_height=0)
+        array([[32., 33., 34., 35., 36., 37.],
+               [42., 43., 44., 45., 46., 47.]])
+        >>> RotatedBox([4, 5], 4, 2, 0).extract_from_image(img, margin_width=1, margin_height=0)
+        array([[16., 26., 36., 46., 56., 66.],
+               [15., 25., 35., 45., 55., 65.]])
+        >>> RotatedBox([1, 8], 4, 2, np.pi/2).extract_from_image(img, margin_width=1, margin_height=1)
+        array([[ 5.,  6.,  7.,  8.,  9.],
+               [15., 16., 17., 18., 19.],
+               [25., 26., 27., 28., 29.]])
+        >>> RotatedBox([20, 20], 4, 2, np.pi/2).extract_from_image(img).shape
+        (0, 0)
         """
-        ctr = np.asarray([self.center[1]*scale, self.center[0]*scale])
-        tform1 = transform.SimilarityTransform(translation=ctr)
-        tform2 = transform.SimilarityTransform(rotation=np.pi/2 - self.angle)
-        tform3 = transform.SimilarityTransform(translation=-ctr)
-        tform = tform3 + tform2 + tform1
-
-        rows, cols = img.shape[0], img.shape[1]
-        corners = np.array([
-            [0, 0],
-            [0, rows - 1],
-            [cols - 1, rows - 1],
-            [cols - 1, 0]
-        ])
-        corners = tform.inverse(corners)
-        minc = corners[:, 0].min()
-        minr = corners[:, 1].min()
-        maxc = corners[:, 0].max()
-        maxr = corners[:, 1].max()
-
-        # SKImage 0.11 version
-        out_rows = maxr - minr + 1
-        out_cols = maxc - minc + 1
-
-        # fit output image in new shape
-        return ((cols - out_cols) / 2., (rows - out_rows) / 2.)
-
+        img = img_as_float(img)
+        center = self.center*scale
+        # The output grid: output pixel (i, j) corresponds to the offsets (r1 + i, c1 + j) from the box center along
+        # its "height" and "width" directions (the grid is aligned with the pixels of the image in "normal orientation")
+        r1 = int(np.floor((self.center[0] - self.height/2 - margin_height)*scale))
+        r2 = int(np.floor((self.center[0] + self.height/2 + margin_height)*scale))
+        c1 = int(np.floor((self.center[1] - self.width/2 - margin_width)*scale))
+        c2 = int(np.floor((self.center[1] + self.width/2 + margin_width)*scale))
+        output_shape = (max(r2 - r1, 0), max(c2 - c1, 0))
+        v_height = np.array([np.sin(self.angle), -np.cos(self.angle)])
+        v_width = np.array([np.cos(self.angle), np.sin(self.angle)])
+        matrix = np.column_stack([v_height, v_width])
+        offset = center + (r1 - center[0])*v_height + (c1 - center[1])*v_width
+
+        # Cut the output down to the rows and columns which have pixels inside the image. For each output row i,
+        # the columns j mapped inside the image (up to half a pixel) are found by solving the constraints
+        # -0.5 <= matrix[k, 0]*i + matrix[k, 1]*j + offset[k] <= img.shape[k] - 0.5 for j
+        rows = np.arange(output_shape[0])
+        j_lo, j_hi = np.zeros(len(rows)), np.full(len(rows), output_shape[1] - 1.0)
+        for k in range(2):
+            lo_k = -0.5 - matrix[k, 0]*rows - offset[k]
+            hi_k = img.shape[k] - 0.5 - matrix[k, 0]*rows - offset[k]
+            if abs(matrix[k, 1]) > 1e-9:
+                b1, b2 = lo_k/matrix[k, 1], hi_k/matrix[k, 1]
+                j_lo, j_hi = np.maximum(j_lo, np.minimum(b1, b2)), np.minimum(j_hi, np.maximum(b1, b2))
+            else:
+                j_hi[(lo_k > 1e-9) | (hi_k < -1e-9)] = -1
+        j_lo, j_hi = np.ceil(j_lo - 1e-9), np.floor(j_hi + 1e-9)
+        rows = rows[j_lo <= j_hi]
+        if len(rows) == 0:
+            return np.zeros((0, 0) + img.shape[2:])
+        lo = np.array([rows[0], j_lo[rows].min()])
+        hi = np.array([rows[-1], j_hi[rows].max()]) + 1
+        offset = offset + np.dot(matrix, lo)
+        output_shape = tuple(int(x) for x in hi - lo)
+
+        # Crop the part of the image needed for interpolation
+        corners = np.dot([[0, 0], [0, output_shape[1] - 1], [output_shape[0] - 1, 0], [output_shape[0] - 1, output_shape[1] - 1]], matrix.T) + offset
+        lo = np.maximum(np.floor(corners.min(0)).astype(int) - 2, 0)
+        hi = np.minimum(np.ceil(corners.max(0)).astype(int) + 3, img.shape[:2])
+        crop = img[lo[0]:hi[0], lo[1]:hi[1]]
+        if crop.ndim == 2:
+            return ndimage.affine_transform(crop, matrix, offset - lo, output_shape, order=1, mode='nearest')
+        return np.dstack([ndimage.affine_transform(crop[..., k], matrix, offset - lo, output_shape, order=1, mode='nearest')
+                          for k in range(crop.shape[2])])
 
     @staticmethod
     def from_points(points, box_type='bb'):
         """
         Interpret a given point cloud as a RotatedBox, using PCA to determine the potential orientation (the longest component becomes width)
-        This is basically an approximate version of a min-area-rectangle algorithm.
-        TODO: Test whether using a true min-area-rectangle algorithm would be more precise or faster.
+        This is basically an approximate version of a min-area-rectangle algorithm (the exact one is available as box_type `'minarea'`).
+        The principal components are computed in closed form from the 2x2 covariance matrix of the points.
 
         :param points: An n x 2 numpy array of coordinates.
         :param box_type: The kind of method used to estimate the "box".
@@ -201,6 +220,7 @@ class RotatedBox(object):
                           10% and 90% quantile of the corresponding coordinates (rather than 0% and 100%, i.e. min and max).
                           This helps against accidental noise in the contour.
                           The `'mrz'` correction is only applied when there are at least 10 points in the set.
+                - `'minarea'`, denoting the true minimum-area bounding rectangle (see `min_area_rect`).
         :returns: a RotatedBox, bounding the given set of points, oriented according to the principal components.
 
         >>> RotatedBox.from_points([[0,0]])
@@ -211,42 +231,79 @@ class RotatedBox(object):
         >>> assert RotatedBox.from_points([[0,0], [2,4], [0,4], [2,0]]).approx_equal([1, 2], 4, 2, np.pi/2)
         >>> assert RotatedBox.from_points([[0,0], [1,1.5], [2,0]]).approx_equal([1, 0.75], 2, 1.5, 0)
         >>> assert RotatedBox.from_points([[0,0], [0,1], [1,1]]).approx_equal([0.25, 0.75], np.sqrt(2), np.sqrt(2)/2, np.pi/4)
+        >>> pts = [[x, y] for x in range(21) for y in [0, 2]] + [[10, 3]]  # A "bump" is ignored by the 'mrz' box type
+        >>> assert RotatedBox.from_points(pts, 'mrz').approx_equal([10, 1], 20, 2, 0)
+        >>> assert RotatedBox.from_points([[0,0], [0,1], [1,1]], 'minarea').approx_equal([0.25, 0.75], np.sqrt(2), np.sqrt(2)/2, np.pi/4)
         """
         points = np.asfarray(points)
         if points.shape[0] == 1:
             return RotatedBox(points[0], width=0.0, height=0.0, angle=0.0, points=points)
-
-        m = PCA(2).fit(points)
-        # Find the angle
-        angle = (np.arctan2(m.components_[0,1], m.components_[0,0]) % np.pi)
-        if abs(angle - np.pi) < angle:
-            # Here the angle is always between -pi and pi
-            # If the principal component happened to be oriented so that the angle happens to be > pi/2 by absolute value,
-            # we flip the direction
-            angle = angle - np.pi if angle > 0 else angle + np.pi
-        points_transformed = m.transform(points)
-        ll = np.min(points_transformed, 0)
-        ur = np.max(points_transformed, 0)
-        wh = ur - ll
-
-        # Now compute and return the bounding box
-        if box_type == 'bb' or (box_type == 'mrz' and points.shape[0] < 10):
-            # We know that if we rotate the points around m.mean_, we get a box with bounds ur and ll
-            # The center of this box is (ur+ll)/2 + mean, which is not the same as the mean,
-            # hence to get the center of the original box we need to "unrotate" this box back.
-            return RotatedBox(np.dot(m.components_.T, (ll+ur)/2) + m.mean_, width=wh[0], height=wh[1], angle=angle, points=points)
-        elif box_type == 'mrz':
+        if box_type == 'minarea':
+            return min_area_rect(points)
+
+        # The principal axis of the 2x2 covariance matrix [[a, b], [b, c]] is at the angle 0.5*arctan2(2b, a - c),
+        # which lies in (-pi/2, pi/2]
+        mean = points.mean(0)
+        d = points - mean
+        a, c, b = np.mean(d[:, 0]*d[:, 0]), np.mean(d[:, 1]*d[:, 1]), np.mean(d[:, 0]*d[:, 1])
+        angle = 0.5*np.arctan2(2*b, a - c)
+        if angle <= -np.pi/2:
+            angle += np.pi
+        components = np.array([[np.cos(angle), np.sin(angle)], [-np.sin(angle), np.cos(angle)]])
+        points_transformed = np.dot(d, components.T)
+
+        if box_type == 'mrz' and points.shape[0] >= 10:
             # When working with MRZ detection from contours, we may have minor "bumps" in the contour,
             # that should be ignored at least along the long ("horizontal") side.
             # To do that, we will use 10% and 90% quantiles as the bounds of the box instead of the max and min.
             # We drop all points which lie beyond and simply repeat the estimation (now 'bb-style') without them.
-            h_coord = sorted(points_transformed[:,1])
-            n = len(h_coord)
-            bottom, top = h_coord[n/10], h_coord[n*9/10]
-            valid_points = np.logical_and(points_transformed[:,1]>=bottom, points_transformed[:,1]<=top)
+            n = points.shape[0]
+            h_coord = np.partition(points_transformed[:, 1], [n//10, n*9//10])
+            bottom, top = h_coord[n//10], h_coord[n*9//10]
+            valid_points = np.logical_and(points_transformed[:, 1] >= bottom, points_transformed[:, 1] <= top)
             rb = RotatedBox.from_points(points[valid_points, :], 'bb')
             rb.points = points
             return rb
-        else:
+        elif box_type not in ['bb', 'mrz']:
             raise ValueError("Unknown parameter value: box_type=%s" % box_type)
 
+        ll = np.min(points_transformed, 0)
+        ur = np.max(points_transformed, 0)
+        wh = ur - ll
+        # We know that if we rotate the points around the mean, we get a box with bounds ur and ll
+        # The center of this box is (ur+ll)/2 + mean, which is not the same as the mean,
+        # hence to get the center of the original box we need to "unrotate" this box back.
+        return RotatedBox(np.dot(components.T, (ll+ur)/2) + mean, width=wh[0], height=wh[1], angle=angle, points=points)
+
+
+def min_area_rect(points):
+    """Returns the minimum-area RotatedBox, containing a given n x 2 set of points.
+    The rectangle is found by "rotating calipers": one of its sides must be collinear with an edge of the convex hull.
+    As in `RotatedBox.from_points`, the longer side becomes the width and the angle is in (-pi/2, pi/2].
+    Degenerate (e.g. collinear) point sets get the PCA-oriented box of `RotatedBox.from_points`.
+
+    >>> assert min_area_rect([[0, 0], [3, 3], [2, 4], [-1, 1], [1, 2]]).approx_equal([1, 2], np.sqrt(18), np.sqrt(2), np.pi/4)
+    >>> assert min_area_rect([[0, 0], [4, 0], [4, 1], [0, 1], [2, 1.5]]).approx_equal([2, 0.75], 4, 1.5, 0)
+    """
+    points = np.asfarray(points)
+    try:
+        hull = points[ConvexHull(points).vertices]
+    except (QhullError, ValueError):
+        return RotatedBox.from_points(points)
+    edges = np.roll(hull, -1, axis=0) - hull
+    angles = np.arctan2(edges[:, 1], edges[:, 0])
+    cos, sin = np.cos(angles), np.sin(angles)
+    # The hull vertices in the coordinate frame of each edge (rows: edges, columns: vertices)
+    u = np.outer(cos, hull[:, 0]) + np.outer(sin, hull[:, 1])
+    v = np.outer(-sin, hull[:, 0]) + np.outer(cos, hull[:, 1])
+    u_min, u_max, v_min, v_max = u.min(1), u.max(1), v.min(1), v.max(1)
+    i = np.argmin((u_max - u_min)*(v_max - v_min))
+    width, height, angle = u_max[i] - u_min[i], v_max[i] - v_min[i], angles[i]
+    uc, vc = (u_min[i] + u_max[i])/2, (v_min[i] + v_max[i])/2
+    center = [uc*cos[i] - vc*sin[i], uc*sin[i] + vc*cos[i]]
+    if height > width:
+        width, height, angle = height, width, angle + np.pi/2
+    angle = (angle + np.pi/2) % np.pi - np.pi/2
+    if angle <= -np.pi/2 + 1e-12:
+        angle += np.pi
+    return RotatedBox(center, width, height, angle, points=points)
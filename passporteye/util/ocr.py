@@ -1,54 +1,696 @@
 '''
-PassportEye::Util: Interface between SKImage and the PyTesseract OCR
-NB: You must have the "tesseract" tool present in your path for this to work.
+PassportEye::Util: Interface between SKImage and the Tesseract OCR.
+
+The actual recognition is delegated to a pluggable "backend" (see `OCRBackend`).
+The following backends are provided:
+    - `TesserocrBackend` runs Tesseract in-process via the (optional) `tesserocr` bindings. The engine and its language
+      model are loaded once per worker and reused for all subsequent calls.
+    - `TesseractPipeBackend` invokes the "tesseract" command-line tool for each call, passing the image via stdin
+      and reading the result from stdout, without touching the filesystem.
+    - `TesseractCmdBackend` invokes the "tesseract" command-line tool for each call via PyTesseract,
+      exchanging the data via temporary files.
+    NB: The latter two require the "tesseract" tool (version 4 or later) to be present in your path.
+By default the in-process backend is used whenever `tesserocr` is installed, otherwise the stdin/stdout one.
+
+All backends support timeouts: a call which does not complete in time is cut off (the tesseract process is killed,
+the in-process engine is cancelled) and raises OCRTimeoutError. A default timeout may be given on construction of a backend
+and may be overridden by the `timeout` parameter of `ocr`, `ocr_detailed` and `ocr_batch`.
 
 Author: Konstantin Tretyakov
 License: MIT
 '''
 
 from pytesseract import pytesseract
-from scipy.misc import imsave
+from collections import OrderedDict, namedtuple
+import bisect
+import numpy as np
+import os
+import re
+import shlex
+import subprocess
 import sys
 import tempfile
+import threading
+
+MRZ_WHITELIST = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789><"
+MRZ_CONFIG = "--psm 6 -c tessedit_char_whitelist=%s -c load_system_dawg=F -c load_freq_dawg=F" % MRZ_WHITELIST
+
+
+def ocr(img, mrz_mode=True, timeout=None):
+    """Runs Tesseract on a given image using the currently selected OCR backend (see `set_backend`).
+
+    :param img: a 2D numpy ndarray (as produced by skimage).
+    :param mrz_mode: when this is True (default) the tesseract is configured to recognize MRZs rather than arbitrary texts.
+    :param timeout: time limit for the call in seconds (None means the backend's default). Raises OCRTimeoutError when exceeded.
+                    Ignored by backends which are not `OCRBackend` instances.
+
+    If a cache is configured (see `set_cache`), the results are looked up there first.
+    """
+    backend = get_backend()
+    if _cache is None:
+        return call_backend(backend, backend, img, mrz_mode, timeout)
+    return _cache.lookup(img, mrz_mode, lambda: call_backend(backend, backend, img, mrz_mode, timeout),
+                         backend_identity(backend))
+
+
+def ocr_detailed(img, mrz_mode=True, timeout=None):
+    """Runs OCR on a given image like `ocr`, but returns an `OCRResult` with the per-character boxes and confidences.
+
+    If the current backend can not provide those (i.e. does not implement `OCRBackend.detailed`),
+    the result only contains the text (see `OCRResult.from_text`). Detailed results are not cached.
+    """
+    backend = get_backend()
+    detailed = getattr(backend, 'detailed', None)
+    if detailed is not None:
+        try:
+            return call_backend(backend, detailed, img, mrz_mode, timeout)
+        except NotImplementedError:
+            pass
+    return OCRResult.from_text(ocr(img, mrz_mode, timeout))
+
+
+def ocr_batch(imgs, mrz_mode=True, detailed=False, timeout=None):
+    """Runs OCR on several images in a single engine pass, returns the list of recognized texts.
+
+    The images are stacked (see `tile_images`) into a single canvas, which is recognized at once,
+    and the recognized lines are then assigned back to the images according to their positions (see `OCRResult.split`).
+    Images with cached results (see `set_cache`) are not included in the canvas.
+    If the backend can not report text positions (i.e. does not implement `OCRBackend.tsv`), the images are OCR-ed one by one.
+    Backends with a `batch` method (such as `ocr_pool.OCRWorkerPool`) are given the (uncached) images to recognize as a whole.
+
+    :param detailed: when True, `OCRResult` objects are returned instead of texts (see `ocr_detailed`).
+    :param timeout: time limit in seconds for the single engine pass (or for each of the separate calls, if the images
+                    are OCR-ed one by one).
+    """
+    imgs = list(imgs)
+    results = [None] * len(imgs)
+    keys = [None] * len(imgs)
+    todo = []
+    backend = get_backend()
+    for i, img in enumerate(imgs):
+        if _cache is not None and not detailed:
+            keys[i] = _cache.key(img, mrz_mode, backend_identity(backend))
+            results[i] = _cache.get(keys[i])
+        if results[i] is None:
+            todo.append(i)
+
+    tsv = getattr(backend, 'tsv', None)
+    batch = getattr(backend, 'batch', None)
+    texts = None
+    if todo and batch is not None:
+        texts = batch([imgs[i] for i in todo], mrz_mode, timeout, detailed)
+    elif len(todo) > 1 and tsv is not None:
+        canvas, bands = tile_images([imgs[i] for i in todo])
+        try:
+            parts = OCRResult.from_tsv(call_backend(backend, tsv, canvas, mrz_mode, timeout)).split(bands)
+        except NotImplementedError:
+            pass
+        else:
+            # Translate the boxes to the coordinates of the images (each image is centered in its band)
+            texts = []
+            for i, part, (top, bottom) in zip(todo, parts, bands):
+                h, w = imgs[i].shape[:2]
+                margin = (bottom - top - h) // 2
+                texts.append(part.shifted(-margin, -margin) if detailed else part.text)
+    if texts is None:
+        texts = [ocr_detailed(imgs[i], mrz_mode, timeout) if detailed else call_backend(backend, backend, imgs[i], mrz_mode, timeout)
+                 for i in todo]
+
+    for i, text in zip(todo, texts):
+        results[i] = text
+        if _cache is not None and not detailed:
+            _cache.put(keys[i], text)
+    return results
+
+
+def tile_images(imgs, min_margin=10):
+    """Stacks the given images vertically into a single uint8 canvas for batched OCR.
+
+    Each image (converted via `to_uint8`) is placed into its own horizontal band, padded on all sides
+    by its own background color (estimated as the median of its border pixels), so that the bands are separated
+    by blank space regardless of the polarity of the images. The margin is proportional to the image height.
+
+    :return: a tuple (canvas, bands), where bands is the list of (top, bottom) row ranges of the bands.
+
+    >>> canvas, bands = tile_images([np.zeros((2, 3)), np.ones((4, 2))])
+    >>> canvas.shape, bands
+    ((46, 23), [(0, 22), (22, 46)])
+    """
+    tiles = [to_uint8(img) for img in imgs]
+    margins = [max(min_margin, t.shape[0] // 2) for t in tiles]
+    width = max(t.shape[1] + 2*m for t, m in zip(tiles, margins))
+    height = sum(t.shape[0] + 2*m for t, m in zip(tiles, margins))
+    canvas = np.empty((height, width), dtype=np.uint8)
+    bands = []
+    top = 0
+    for t, m in zip(tiles, margins):
+        bottom = top + t.shape[0] + 2*m
+        border = np.concatenate([t[0, :], t[-1, :], t[:, 0], t[:, -1]])
+        canvas[top:bottom, :] = np.median(border)
+        canvas[top+m:top+m+t.shape[0], m:m+t.shape[1]] = t
+        bands.append((top, bottom))
+        top = bottom
+    return canvas, bands
+
+
+def split_tsv_lines(tsv, bands):
+    """Splits Tesseract's TSV output for a canvas produced by `tile_images` into texts of the separate bands.
+    Words are joined into lines (as in Tesseract's plain text output) and each line is assigned to the band containing
+    its vertical center.
+
+    >>> tsv = 'level\\tpage_num\\tblock_num\\tpar_num\\tline_num\\tword_num\\tleft\\ttop\\twidth\\theight\\tconf\\ttext\\n' \\
+    ...       '5\\t1\\t1\\t1\\t1\\t1\\t5\\t2\\t9\\t6\\t90\\tP<UTO\\n' \\
+    ...       '5\\t1\\t1\\t1\\t1\\t2\\t15\\t2\\t9\\t6\\t90\\tX<<\\n' \\
+    ...       '5\\t1\\t1\\t1\\t2\\t1\\t5\\t10\\t9\\t6\\t90\\tL898\\n' \\
+    ...       '5\\t1\\t1\\t1\\t3\\t1\\t5\\t40\\t9\\t6\\t90\\tIDAUT\\n'
+    >>> split_tsv_lines(tsv, [(0, 20), (20, 50), (50, 60)])
+    ['P<UTO X<<\\nL898', 'IDAUT', '']
+    """
+    return [r.text for r in OCRResult.from_tsv(tsv).split(bands)]
+
+
+OCRChar = namedtuple('OCRChar', ['char', 'box', 'conf'])
+OCRChar.__doc__ = """A recognized character: its box (left, top, right, bottom) in image coordinates and its confidence (0..100).
+The box and confidence are None when unknown (e.g. for the spaces between words)."""
+
+
+class OCRResult(object):
+    """
+    The result of OCR with per-character details: a list of text lines, each being a list of `OCRChar` objects
+    (words are separated by space characters).
+
+    >>> r = OCRResult([[OCRChar('P', (0, 0, 5, 8), 90.0), OCRChar('<', (5, 0, 10, 8), 95.0)],
+    ...                [OCRChar('L', (0, 10, 5, 18), 40.0), OCRChar(' ', None, None), OCRChar('8', (9, 10, 14, 18), 60.0)]])
+    >>> r.text
+    'P<\\nL 8'
+    >>> r.line_confidence(1), r.line_box(1)
+    (40.0, (0, 10, 14, 18))
+    >>> r.low_confidence_lines(50)
+    [1]
+    >>> OCRResult.from_text('P<\\nL8').line_confidence(0) is None
+    True
+    """
 
-def ocr(img, mrz_mode=True):
-    """Runs Tesseract on a given image. Writes an intermediate tempfile and then runs the tesseract command on the image.
+    def __init__(self, lines):
+        self.lines = lines
+
+    @property
+    def text(self):
+        return '\n'.join(''.join(c.char for c in line) for line in self.lines)
+
+    def __repr__(self):
+        return 'OCRResult(%r)' % self.text
+
+    @staticmethod
+    def from_text(text):
+        """Creates a result with no boxes and confidences from a plain text."""
+        return OCRResult([[OCRChar(c, None, None) for c in line] for line in text.split('\n')])
+
+    @staticmethod
+    def from_tsv(tsv):
+        """Parses Tesseract's TSV output. The TSV only reports word boxes and confidences, hence each character
+        gets the confidence of its word, and the word's box is divided evenly between its characters
+        (this is exact for monospaced fonts, such as the OCR-B of the MRZ).
+
+        >>> tsv = 'level\\tpage_num\\tblock_num\\tpar_num\\tline_num\\tword_num\\tleft\\ttop\\twidth\\theight\\tconf\\ttext\\n' \\
+        ...       '5\\t1\\t1\\t1\\t1\\t1\\t5\\t2\\t10\\t6\\t91.5\\tP<\\n' \\
+        ...       '5\\t1\\t1\\t1\\t1\\t2\\t20\\t2\\t5\\t6\\t80\\tX\\n'
+        >>> OCRResult.from_tsv(tsv).lines[0]  # doctest: +NORMALIZE_WHITESPACE
+        [OCRChar(char='P', box=(5, 2, 10, 8), conf=91.5), OCRChar(char='<', box=(10, 2, 15, 8), conf=91.5),
+         OCRChar(char=' ', box=None, conf=None), OCRChar(char='X', box=(20, 2, 25, 8), conf=80.0)]
+        """
+        lines = OrderedDict()
+        for row in tsv.split('\n')[1:]:
+            fields = row.split('\t')
+            if len(fields) < 12 or fields[0] != '5' or not fields[11].strip():
+                continue
+            word = fields[11].strip()
+            left, top, width, height = [int(f) for f in fields[6:10]]
+            conf = float(fields[10])
+            line = lines.setdefault(tuple(fields[1:5]), [])
+            if line:
+                line.append(OCRChar(' ', None, None))
+            for j, c in enumerate(word):
+                box = (left + int(round(j*width/float(len(word)))), top,
+                       left + int(round((j+1)*width/float(len(word)))), top + height)
+                line.append(OCRChar(c, box, conf))
+        return OCRResult(list(lines.values()))
+
+    def line_confidence(self, i):
+        """The confidence of the i-th line (the lowest confidence of its characters) or None if unknown."""
+        confs = [c.conf for c in self.lines[i] if c.conf is not None]
+        return min(confs) if confs else None
+
+    def line_box(self, i):
+        """The bounding box (left, top, right, bottom) of the i-th line or None if unknown."""
+        boxes = np.array([c.box for c in self.lines[i] if c.box is not None]).reshape(-1, 4)
+        if len(boxes) == 0:
+            return None
+        return tuple(boxes[:, :2].min(axis=0).tolist() + boxes[:, 2:].max(axis=0).tolist())
+
+    def low_confidence_lines(self, min_confidence):
+        """Returns the indices of the lines with known confidence below min_confidence, least confident first."""
+        confs = [(self.line_confidence(i), i) for i in range(len(self.lines))]
+        return [i for conf, i in sorted(c for c in confs if c[0] is not None and c[0] < min_confidence)]
+
+    def shifted(self, dx, dy):
+        """Returns a copy of the result with all the boxes translated by (dx, dy)."""
+        def shift(box):
+            return None if box is None else (box[0] + dx, box[1] + dy, box[2] + dx, box[3] + dy)
+        return OCRResult([[OCRChar(c.char, shift(c.box), c.conf) for c in line] for line in self.lines])
+
+    def split(self, bands):
+        """Splits the result into parts, corresponding to the given horizontal bands (a list of (top, bottom) row ranges,
+        sorted top to bottom). Each line goes to the band containing its vertical center, and its boxes are made relative
+        to the top of the band. Lines with unknown boxes go to the first band."""
+        band_tops = [b[0] for b in bands]
+        parts = [[] for b in bands]
+        for i, line in enumerate(self.lines):
+            box = self.line_box(i)
+            j = 0 if box is None else max(bisect.bisect_right(band_tops, (box[1] + box[3]) / 2.0) - 1, 0)
+            parts[j].append(line)
+        return [OCRResult(p).shifted(0, -top) for p, (top, bottom) in zip(parts, bands)]
+
+
+class OCRTimeoutError(Exception):
+    """Raised when an OCR call does not complete within the given time."""
+    pass
+
+
+class OCRWorkerError(Exception):
+    """Raised when an OCR worker process fails to process a request."""
+    pass
+
+
+class OCRBackend(object):
+    """Base class for OCR backends. A backend is a callable, mapping a 2D image array to the recognized text.
+    Backends which can also report the layout of the recognized text implement the `tsv` method.
+
+    All methods accept a timeout (in seconds, None means the backend's default) and raise OCRTimeoutError when it is exceeded.
+    Backends which count their engine calls themselves (see `ocr_call_count`) set `counts_calls`.
+    """
+
+    counts_calls = False
+
+    def __call__(self, img, mrz_mode=True, timeout=None):
+        raise NotImplementedError
+
+    def tsv(self, img, mrz_mode=True, timeout=None):
+        """Returns the recognition result in Tesseract's TSV format (one row per recognized word, line, etc)."""
+        raise NotImplementedError
+
+    def detailed(self, img, mrz_mode=True, timeout=None):
+        """Returns the recognition result as an `OCRResult`. By default it is parsed from the `tsv` output."""
+        return OCRResult.from_tsv(self.tsv(img, mrz_mode, timeout))
+
+    def identity(self):
+        """A string identifying the backend along with the settings affecting the recognized text
+        (a part of the keys of the OCR cache, see `backend_identity`)."""
+        return _qualified_name(self)
+
+
+class TesseractCmdBackend(OCRBackend):
+    """Runs the "tesseract" command-line tool on each call. Writes an intermediate tempfile and then runs the tesseract command on the image.
 
     This is a simplified modification of image_to_string from PyTesseract, which is adapted to SKImage rather than PIL.
 
     In principle we could have reimplemented it just as well - there are some apparent bugs in PyTesseract, but it works so far :)
+    """
 
-    :param mrz_mode: when this is True (default) the tesseract is configured to recognize MRZs rather than arbitrary texts.
+    def __init__(self, timeout=None):
+        """
+        :param timeout: default timeout for a call in seconds (None means no timeout).
+        """
+        self.timeout = timeout
+
+    def identity(self):
+        return '%s(%s)' % (_qualified_name(self), tesseract_version(pytesseract.tesseract_cmd))
+
+    def __call__(self, img, mrz_mode=True, timeout=None):
+        from scipy.misc import imsave
+        timeout = timeout if timeout is not None else self.timeout
+        input_file_name = '%s.bmp' % _tempnam()
+        output_file_name_base = '%s' % _tempnam()
+        output_file_name = "%s.txt" % output_file_name_base
+        try:
+            imsave(input_file_name, img)
+
+            config = MRZ_CONFIG if mrz_mode else None
+
+            try:
+                pytesseract.run_tesseract(input_file_name,
+                                         output_file_name_base,
+                                         'txt',
+                                         lang=None,
+                                         config=config,
+                                         **({'timeout': timeout} if timeout is not None else {}))
+            except RuntimeError as e:
+                if 'timeout' not in str(e):
+                    raise
+                raise OCRTimeoutError("OCR call timed out after %s seconds" % timeout)
+
+            if sys.version_info.major == 3:
+                f = open(output_file_name, encoding='utf-8')
+            else:
+                f = open(output_file_name)
+
+            try:
+                return f.read().strip()
+            finally:
+                f.close()
+        finally:
+            pytesseract.cleanup(input_file_name)
+            pytesseract.cleanup(output_file_name)
+
+
+class TesseractPipeBackend(OCRBackend):
+    """Runs the "tesseract" command-line tool on each call, sending the image as a binary PGM via stdin
+    and reading the recognized text from stdout. No temporary files are involved.
+
+    Requires Python 3 and Tesseract 4 or newer (see `pipe_supported`).
     """
-    input_file_name = '%s.bmp' % _tempnam()
-    output_file_name_base = '%s' % _tempnam()
-    output_file_name = "%s.txt" % output_file_name_base
-    try:
-        imsave(input_file_name, img)
 
+    def __init__(self, tesseract_cmd=None, timeout=None):
+        """
+        :param tesseract_cmd: the tesseract executable (defaults to the one configured in PyTesseract).
+        :param timeout: default timeout for a call in seconds (None means no timeout). The process is killed on timeout.
+        """
+        self.tesseract_cmd = tesseract_cmd
+        self.timeout = timeout
+
+    def identity(self):
+        return '%s(%s)' % (_qualified_name(self), tesseract_version(self.tesseract_cmd or pytesseract.tesseract_cmd))
+
+    def __call__(self, img, mrz_mode=True, timeout=None):
+        return self._run(img, mrz_mode, timeout=timeout).strip()
+
+    def tsv(self, img, mrz_mode=True, timeout=None):
+        return self._run(img, mrz_mode, ['tsv'], timeout)
+
+    def _run(self, img, mrz_mode, configfiles=(), timeout=None):
+        timeout = timeout if timeout is not None else self.timeout
+        cmd = [self.tesseract_cmd or pytesseract.tesseract_cmd, 'stdin', 'stdout']
         if mrz_mode:
-            config = "--psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789>< -c load_system_dawg=F -c load_freq_dawg=F"
-        else:
-            config = None
-
-        pytesseract.run_tesseract(input_file_name,
-                                 output_file_name_base,
-                                 'txt',
-                                 lang=None,
-                                 config=config)
-        
-        if sys.version_info.major == 3:
-            f = open(output_file_name, encoding='utf-8')
-        else:
-            f = open(output_file_name)
-        
+            cmd += shlex.split(MRZ_CONFIG)
+        cmd += list(configfiles)
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            out, err = proc.communicate(encode_pgm(img), timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise OCRTimeoutError("OCR call timed out after %s seconds" % timeout)
+        if proc.returncode != 0:
+            raise pytesseract.TesseractError(proc.returncode, err.decode('utf-8', 'replace').strip())
+        return out.decode('utf-8')
+
+
+class TesserocrBackend(OCRBackend):
+    """Runs Tesseract in-process via the `tesserocr` bindings, passing the image data directly from memory.
+
+    The Tesseract engine is initialized lazily, once per process and thread (the API objects are not thread-safe
+    and can not be shared between forked processes), and then reused for all subsequent calls.
+    Separate engines are kept for the MRZ and the generic mode, as the dictionary settings of the MRZ mode can only be
+    applied at initialization time.
+
+    Raises ImportError on construction if `tesserocr` is not available.
+    """
+
+    def __init__(self, lang='eng', path=None, timeout=None):
+        """
+        :param lang: Tesseract language to load.
+        :param path: location of the tessdata directory (None means Tesseract's default).
+        :param timeout: default timeout for a call in seconds (None means no timeout). The recognition is cancelled on timeout.
+        """
+        import tesserocr
+        self._tesserocr = tesserocr
+        self.lang = lang
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def identity(self):
+        return '%s(%s, %s, %s)' % (_qualified_name(self), self._tesserocr.tesseract_version().strip(), self.lang, self.path)
+
+    def _api(self, mrz_mode):
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.apis = {}
+        apis = self._local.apis
+        if mrz_mode not in apis:
+            tesserocr = self._tesserocr
+            api = tesserocr.PyTessBaseAPI(init=False)
+            if mrz_mode:
+                api.InitFull(path=self.path, lang=self.lang,
+                             variables={'load_system_dawg': 'F', 'load_freq_dawg': 'F'})
+                api.SetPageSegMode(tesserocr.PSM.SINGLE_BLOCK)
+                api.SetVariable('tessedit_char_whitelist', MRZ_WHITELIST)
+            else:
+                api.InitFull(path=self.path, lang=self.lang)
+            apis[mrz_mode] = api
+        return apis[mrz_mode]
+
+    def __call__(self, img, mrz_mode=True, timeout=None):
+        return self._run(img, mrz_mode, lambda api: api.GetUTF8Text().strip(), timeout)
+
+    def tsv(self, img, mrz_mode=True, timeout=None):
+        return self._run(img, mrz_mode, lambda api: api.GetTSVText(0), timeout)
+
+    def detailed(self, img, mrz_mode=True, timeout=None):
+        """Returns an `OCRResult` with the boxes and confidences of the individual symbols, as reported by the engine."""
+        RIL = self._tesserocr.RIL
+        def get_result(api):
+            lines = []
+            for r in self._tesserocr.iterate_level(api.GetIterator(), RIL.SYMBOL):
+                if not lines or r.IsAtBeginningOf(RIL.TEXTLINE):
+                    lines.append([])
+                elif r.IsAtBeginningOf(RIL.WORD):
+                    lines[-1].append(OCRChar(' ', None, None))
+                lines[-1].append(OCRChar(r.GetUTF8Text(RIL.SYMBOL), r.BoundingBox(RIL.SYMBOL), r.Confidence(RIL.SYMBOL)))
+            return OCRResult(lines)
+        return self._run(img, mrz_mode, get_result, timeout)
+
+    def _run(self, img, mrz_mode, get_result, timeout=None):
+        timeout = timeout if timeout is not None else self.timeout
+        data = np.ascontiguousarray(to_uint8(img))
+        api = self._api(mrz_mode)
+        api.SetImageBytes(data.tobytes(), data.shape[1], data.shape[0], 1, data.shape[1])
         try:
-            return f.read().strip()
+            # The engine checks the time limit (in milliseconds, 0 means none) during recognition and cancels it
+            if not api.Recognize(int(timeout*1000) if timeout else 0):
+                if timeout:
+                    raise OCRTimeoutError("OCR call timed out after %s seconds" % timeout)
+                raise RuntimeError("Tesseract failed to recognize the image")
+            return get_result(api)
         finally:
-            f.close()
-    finally:
-        pytesseract.cleanup(input_file_name)
-        pytesseract.cleanup(output_file_name)
+            api.Clear()
+
+
+_backend = None
+
+
+def get_backend():
+    """Returns the currently used OCR backend, choosing the default one on first use."""
+    global _backend
+    if _backend is None:
+        set_backend('auto')
+    return _backend
+
+
+def set_backend(backend):
+    """Selects the OCR backend used by `ocr`.
+
+    :param backend: an `OCRBackend` instance (or any callable with the same signature) or one of the strings
+        `'tesserocr'` (in-process engine), `'pipe'` (command-line tool via stdin/stdout), `'tesseract'` (command-line tool
+        via temporary files) or `'auto'` (in-process engine if available, otherwise `'pipe'` if supported by the Python and
+        the Tesseract versions, see `pipe_supported`, and `'tesseract'` otherwise).
+    """
+    global _backend
+    _backend = make_backend(backend)
+
+
+def backend_identity(backend):
+    """Returns a string identifying a given backend (see `OCRBackend.identity`). Other callables are identified
+    by their qualified names, the backend specification strings by the identity of the backend they stand for.
+
+    >>> backend_identity(len)
+    'builtins.len'
+    """
+    if isinstance(backend, OCRBackend):
+        return backend.identity()
+    elif isinstance(backend, str):
+        return backend_identity(make_backend(backend))
+    return _qualified_name(backend)
+
+
+def _qualified_name(obj):
+    """The qualified name of a function or of the class of an object."""
+    if not hasattr(obj, '__qualname__') and not hasattr(obj, '__name__'):
+        obj = type(obj)
+    return '%s.%s' % (getattr(obj, '__module__', None), getattr(obj, '__qualname__', obj.__name__))
+
+
+_tesseract_versions = {}
+
+
+def tesseract_version(tesseract_cmd):
+    """Returns the version line reported by the given tesseract executable ('tesseract 4.1.1', etc.),
+    or None if it can not be run."""
+    if tesseract_cmd not in _tesseract_versions:
+        try:
+            out = subprocess.check_output([tesseract_cmd, '--version'], stderr=subprocess.STDOUT)
+            lines = out.decode('utf-8', 'replace').strip().split('\n')
+            _tesseract_versions[tesseract_cmd] = lines[0].strip() if lines[0].strip() else None
+        except (OSError, subprocess.CalledProcessError):
+            _tesseract_versions[tesseract_cmd] = None
+    return _tesseract_versions[tesseract_cmd]
+
+
+def pipe_supported(tesseract_cmd=None):
+    """Whether `TesseractPipeBackend` may be used with the given tesseract executable (default: the one configured
+    in PyTesseract): it needs Python 3 and Tesseract 4 or newer. An executable whose version can not be determined
+    is assumed to be recent."""
+    version = tesseract_version(tesseract_cmd or pytesseract.tesseract_cmd)
+    major = _major_version(version) if version is not None else None
+    return sys.version_info.major >= 3 and (major is None or major >= 4)
+
+
+def _major_version(version):
+    """Parses the major version number out of the version line of tesseract (None if it can not be parsed).
+
+    >>> _major_version('tesseract 4.1.1'), _major_version('tesseract v5.0.0-alpha.20201127'), _major_version('?')
+    (4, 5, None)
+    """
+    match = re.search(r'(\d+)\.\d+', version)
+    return int(match.group(1)) if match else None
+
+
+def make_backend(backend):
+    """Creates an OCR backend given its specification (see `set_backend`). Callables are returned as is."""
+    if backend == 'auto':
+        try:
+            return TesserocrBackend()
+        except ImportError:
+            return TesseractPipeBackend() if pipe_supported() else TesseractCmdBackend()
+    elif backend == 'tesserocr':
+        return TesserocrBackend()
+    elif backend == 'pipe':
+        return TesseractPipeBackend()
+    elif backend == 'tesseract':
+        return TesseractCmdBackend()
+    elif not callable(backend):
+        raise ValueError("Unknown OCR backend: %s" % backend)
+    return backend
+
+
+_cache = None
+
+
+def get_cache():
+    """Returns the currently used OCR result cache (or None)."""
+    return _cache
+
+
+def set_cache(cache):
+    """Sets the cache used by `ocr` (an `passporteye.util.ocr_cache.OCRCache` instance), or disables caching if None."""
+    global _cache
+    _cache = cache
+
+
+_call_count = 0
+_call_count_lock = threading.Lock()
+_thread_call_count = threading.local()
+
+
+def ocr_call_count(thread=False):
+    """Returns the number of OCR engine calls made so far by all threads of the process (including the requests sent
+    to `OCRWorkerPool` workers). Results taken from the cache are not counted.
+
+    :param thread: when True, only the calls made by the current thread (including those of the sub-tasks it delegated
+                   to other threads, see `charge_ocr_calls`) are counted.
+    """
+    return _thread_counter()[0] if thread else _call_count
+
+
+def count_ocr_call():
+    """Increments the counter of `ocr_call_count`."""
+    global _call_count
+    counter = _thread_counter()
+    with _call_count_lock:
+        _call_count += 1
+        counter[0] += 1
+
+
+def charge_ocr_calls(fn):
+    """Wraps fn (meant to be run by another thread, e.g. as a sub-task on an executor), so that the OCR calls it makes
+    are counted for the current thread (see `ocr_call_count`).
+
+    >>> from concurrent.futures import ThreadPoolExecutor
+    >>> n = ocr_call_count(thread=True)
+    >>> with ThreadPoolExecutor(1) as ex:
+    ...     ex.submit(count_ocr_call).result(), ex.submit(charge_ocr_calls(count_ocr_call)).result()
+    (None, None)
+    >>> ocr_call_count(thread=True) - n
+    1
+    """
+    counter = _thread_counter()
+
+    def charged(*args, **kwargs):
+        own = _thread_counter()
+        _thread_call_count.counter = counter
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _thread_call_count.counter = own
+    return charged
+
+
+def _thread_counter():
+    """The (mutable, one-element list) counter of the OCR calls of the current thread."""
+    counter = getattr(_thread_call_count, 'counter', None)
+    if counter is None:
+        counter = _thread_call_count.counter = [0]
+    return counter
+
+
+def call_backend(backend, fn, img, mrz_mode, timeout):
+    """Calls fn (the backend itself or one of its methods), passing the timeout to `OCRBackend` instances only."""
+    if not getattr(backend, 'counts_calls', False):
+        count_ocr_call()
+    if timeout is None or not isinstance(backend, OCRBackend):
+        return fn(img, mrz_mode)
+    return fn(img, mrz_mode, timeout=timeout)
+
+
+def to_uint8(img):
+    """Converts an image to uint8, stretching its value range to 0..255 in the same way scipy.misc.imsave does it
+    (uint8 images are returned unchanged). This is what the command-line backend feeds to Tesseract, hence all backends
+    should use it to obtain comparable results.
+
+    >>> to_uint8(np.array([[0.0, 0.5], [0.25, 1.0]]))
+    array([[  0, 128],
+           [ 64, 255]], dtype=uint8)
+    >>> to_uint8(np.array([[0.5, 0.5]]))
+    array([[0, 0]], dtype=uint8)
+    """
+    img = np.asarray(img)
+    if img.dtype == np.uint8:
+        return img
+    cmin, cmax = img.min(), img.max()
+    cscale = (cmax - cmin) or 1
+    bytedata = (img - cmin) * (255.0 / cscale)
+    return (bytedata.clip(0, 255) + 0.5).astype(np.uint8)
+
+
+def encode_pgm(img):
+    """Encodes an image (converted via `to_uint8`) as a binary PGM file. This is the most compact uncompressed format
+    understood by Tesseract, and the encoding is essentially free.
+
+    >>> encode_pgm(np.array([[0.0, 1.0]]))
+    b'P5\\n2 1\\n255\\n\\x00\\xff'
+    """
+    data = np.ascontiguousarray(to_uint8(img))
+    return ('P5\n%d %d\n255\n' % (data.shape[1], data.shape[0])).encode('ascii') + data.tobytes()
 
 
 def _tempnam():
@@ -0,0 +1,159 @@
+'''
+PassportEye::Util: Content-addressed cache for OCR results.
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+from .ocr import MRZ_CONFIG
+
+
+class OCRCache(object):
+    """
+    A cache of OCR results, keyed by the contents of the image (its pixel data, shape and dtype) along with
+    the OCR configuration (mrz_mode and the corresponding Tesseract config string) and the identity of the backend
+    (see `ocr.backend_identity`, so that the results of different backends, Tesseract versions, etc. are told apart).
+
+    Results are kept in an in-memory LRU of bounded size and, optionally, in a persistent `store` (e.g. `SQLiteOCRStore`),
+    which is consulted on in-memory misses.
+    The fields `hits` and `misses` count the lookups, `miss_time` is the total time spent computing the missing results
+    (see `stats`).
+
+    Enable it for the `ocr` function via `passporteye.util.ocr.set_cache`.
+
+    >>> cache = OCRCache(maxsize=2)
+    >>> img = np.zeros((2, 3))
+    >>> cache.lookup(img, True, lambda: 'ABC')
+    'ABC'
+    >>> cache.lookup(img.copy(), True, lambda: 'XYZ')
+    'ABC'
+    >>> cache.lookup(img, False, lambda: 'XYZ')
+    'XYZ'
+    >>> cache.lookup(np.zeros((3, 2)), True, lambda: 'CBA')
+    'CBA'
+    >>> cache.lookup(np.zeros((3, 2)), True, lambda: 'C8A', backend='other')
+    'C8A'
+    >>> (cache.hits, cache.misses, len(cache))
+    (1, 4, 2)
+    """
+
+    def __init__(self, maxsize=1024, store=None):
+        """
+        :param maxsize: maximum number of entries kept in memory.
+        :param store: an optional persistent store with methods get(key) and put(key, text).
+        """
+        self.maxsize = maxsize
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.miss_time = 0.0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(img, mrz_mode=True, backend=''):
+        """Computes the cache key for a given OCR request.
+
+        :param backend: the identity of the backend serving the request (see `ocr.backend_identity`).
+        """
+        img = np.ascontiguousarray(img)
+        h = hashlib.blake2b(digest_size=20)
+        h.update(('%s|%s|%s|%s|' % (img.shape, img.dtype.str, MRZ_CONFIG if mrz_mode else '', backend)).encode('utf-8'))
+        h.update(memoryview(img).cast('B'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """Returns the cached text for a given key or None (counting the hit or miss)."""
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+        if text is None and self.store is not None:
+            text = self.store.get(key)
+            if text is not None:
+                self._put_memory(key, text)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return text
+
+    def put(self, key, text):
+        """Stores the text for a given key."""
+        self._put_memory(key, text)
+        if self.store is not None:
+            self.store.put(key, text)
+
+    def lookup(self, img, mrz_mode, compute, backend=''):
+        """Returns the cached OCR result for the given request, or computes it via compute() and caches it."""
+        key = self.key(img, mrz_mode, backend)
+        text = self.get(key)
+        if text is None:
+            tic = time.time()
+            text = compute()
+            self.miss_time += time.time() - tic
+            self.put(key, text)
+        return text
+
+    @property
+    def stats(self):
+        """A dictionary with the hit/miss counts and the estimated OCR time saved by the cache (in seconds)."""
+        mean_miss_time = self.miss_time / self.misses if self.misses else 0.0
+        return {'hits': self.hits, 'misses': self.misses, 'miss_time': self.miss_time,
+                'time_saved': self.hits * mean_miss_time}
+
+    def clear(self):
+        """Drops all the in-memory entries and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+            self.miss_time = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _put_memory(self, key, text):
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class SQLiteOCRStore(object):
+    """
+    A persistent store for `OCRCache`, keeping the results in an SQLite database file.
+
+    >>> store = SQLiteOCRStore(':memory:')
+    >>> store.put('k', 'P<UTO')
+    >>> store.get('k'), store.get('x')
+    ('P<UTO', None)
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, text TEXT)')
+        self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT text FROM ocr WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, key, text):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO ocr (key, text) VALUES (?, ?)', (key, text))
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,248 @@
+'''
+PassportEye::Util: A pool of long-lived OCR worker processes.
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+
+import multiprocessing
+import threading
+from concurrent.futures import Future
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .ocr import (OCRBackend, get_backend, set_backend, get_cache, set_cache, backend_identity, call_backend, ocr, ocr_detailed,
+                  ocr_batch, to_uint8, count_ocr_call, OCRTimeoutError, OCRWorkerError)
+
+
+def _worker_tsv(img, mrz_mode):
+    backend = get_backend()
+    tsv = getattr(backend, 'tsv', None)
+    if tsv is None:
+        raise NotImplementedError
+    return call_backend(backend, tsv, img, mrz_mode, None)
+
+
+# The kinds of the requests served by the workers (the payload is an image, or a list of images for batches)
+_WORKER_CALLS = {
+    'text': ocr,
+    'detailed': ocr_detailed,
+    'tsv': _worker_tsv,
+    'batch': lambda imgs, mrz_mode: ocr_batch(imgs, mrz_mode),
+    'batch_detailed': lambda imgs, mrz_mode: ocr_batch(imgs, mrz_mode, detailed=True),
+}
+
+
+def _worker_main(conn, backend):
+    """Main loop of a worker process: receives (kind, payload, mrz_mode) requests from the pipe (see `_WORKER_CALLS`)
+    and sends back (ok, result_or_error), where ok is None if the backend does not support the request."""
+    set_backend(backend)
+    # The pool consults the cache of the parent process, whose store (e.g. an SQLite connection, inherited when forked)
+    # must not be used by several processes
+    set_cache(None)
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if request is None:
+            break
+        kind, payload, mrz_mode = request
+        try:
+            conn.send((True, _WORKER_CALLS[kind](payload, mrz_mode)))
+        except NotImplementedError as e:
+            conn.send((None, repr(e)))
+        except Exception as e:
+            conn.send((False, repr(e)))
+
+
+class _Worker(object):
+    """A worker process along with the pipe used to talk to it."""
+
+    def __init__(self, context, backend):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, backend))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+    def shutdown(self):
+        try:
+            self.conn.send(None)
+            self.process.join(1)
+        except (IOError, OSError):
+            pass
+        self.kill()
+
+
+class OCRWorkerPool(OCRBackend):
+    """
+    A pool of long-lived worker processes, each running its own OCR backend.
+
+    When used with the in-process (`tesserocr`) backend, every worker loads the Tesseract engine and its language model
+    once and keeps it warm for all subsequent requests, so the per-call cost is just the recognition itself.
+    (With the command-line backend each request still starts a `tesseract` process, but the requests can be served in parallel).
+
+    Images are converted to uint8 (see `to_uint8`) and sent to the workers over pipes. Each worker is served by its own
+    dispatcher thread, which enforces the per-request timeout (killing and restarting the worker process when it expires)
+    and restarts workers which crashed (retrying the request once).
+
+    The pool is itself a valid OCR backend (i.e. `ocr.set_backend(pool)` works, including `tsv` if the workers' backend
+    supports it), and offers `submit` and `map` for running several requests at once. The latter two consult the OCR cache
+    (see `ocr.set_cache`) before sending the requests (unless detailed results are requested, see `ocr.ocr_detailed`).
+    `ocr.ocr_batch` sends its batch to the workers via `batch`, split into a chunk per worker, each recognized in
+    a single engine pass there. Each request sent to the workers (a single image or a chunk of a batch) counts as
+    an OCR call (see `ocr.ocr_call_count`).
+    """
+
+    counts_calls = True
+
+    def __init__(self, size=None, timeout=None, backend='auto', start_method=None):
+        """
+        :param size: number of worker processes (default: number of CPUs).
+        :param timeout: default timeout in seconds for a single OCR request (None means no timeout).
+        :param backend: OCR backend specification for the workers (see `ocr.set_backend`). Must be picklable.
+        :param start_method: multiprocessing start method for the worker processes (None means platform default).
+        """
+        self.size = size or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.backend = backend
+        self._context = multiprocessing.get_context(start_method)
+        self._requests = queue.Queue()
+        self._closed = False
+        self._identity = None
+        self._threads = []
+        for i in range(self.size):
+            t = threading.Thread(target=self._serve, name='OCRWorkerPool-%d' % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, img, mrz_mode=True, timeout=None, detailed=False):
+        """Schedules OCR of a given image, returns a `concurrent.futures.Future` with the recognized text.
+
+        :param timeout: timeout for this request in seconds (the pool's default is used if None).
+        :param detailed: when True, the result is an `OCRResult` rather than the text (see `ocr.ocr_detailed`).
+        """
+        cache = get_cache()
+        if cache is None or detailed:
+            return self._submit('detailed' if detailed else 'text', to_uint8(img), mrz_mode, timeout)
+        key = cache.key(img, mrz_mode, self.identity())
+        text = cache.get(key)
+        if text is not None:
+            future = Future()
+            future.set_result(text)
+            return future
+        future = self._submit('text', to_uint8(img), mrz_mode, timeout)
+        future.add_done_callback(lambda f: f.exception() is None and cache.put(key, f.result()))
+        return future
+
+    def batch(self, imgs, mrz_mode=True, timeout=None, detailed=False):
+        """Runs OCR on several images, returns the list of recognized texts (or `OCRResult` objects if detailed is True).
+
+        The images are split into a contiguous chunk per worker, and each worker recognizes its chunk via `ocr.ocr_batch`.
+        The OCR cache is not consulted (`ocr.ocr_batch` does it before calling this).
+
+        :param timeout: timeout for each of the chunks in seconds (the pool's default is used if None).
+        """
+        imgs = [to_uint8(img) for img in imgs]
+        n_chunks = min(self.size, len(imgs))
+        bounds = [len(imgs) * i // n_chunks for i in range(n_chunks + 1)]
+        futures = [self._submit('batch_detailed' if detailed else 'batch', imgs[start:end], mrz_mode, timeout)
+                   for start, end in zip(bounds[:-1], bounds[1:])]
+        return [result for f in futures for result in f.result()]
+
+    def _submit(self, kind, payload, mrz_mode, timeout):
+        """Queues a request of a given kind (see `_WORKER_CALLS`) for the workers, returns its future."""
+        if self._closed:
+            raise RuntimeError("The pool is closed")
+        future = Future()
+        count_ocr_call()
+        self._requests.put((future, kind, payload, mrz_mode, timeout if timeout is not None else self.timeout))
+        return future
+
+    def identity(self):
+        """The identity of the backend of the workers (see `ocr.backend_identity`)."""
+        if self._identity is None:
+            self._identity = backend_identity(self.backend)
+        return self._identity
+
+    def map(self, imgs, mrz_mode=True, timeout=None, detailed=False):
+        """Runs OCR on several images in parallel, returns the list of recognized texts (in order)."""
+        futures = [self.submit(img, mrz_mode, timeout, detailed) for img in imgs]
+        return [f.result() for f in futures]
+
+    def __call__(self, img, mrz_mode=True, timeout=None):
+        return self.submit(img, mrz_mode, timeout).result()
+
+    def detailed(self, img, mrz_mode=True, timeout=None):
+        return self.submit(img, mrz_mode, timeout, detailed=True).result()
+
+    def tsv(self, img, mrz_mode=True, timeout=None):
+        return self._submit('tsv', to_uint8(img), mrz_mode, timeout).result()
+
+    def close(self):
+        """Shuts down all the workers."""
+        if not self._closed:
+            self._closed = True
+            for t in self._threads:
+                self._requests.put(None)
+            for t in self._threads:
+                t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _serve(self):
+        """Dispatcher thread, owning one worker process."""
+        worker = None
+        try:
+            while True:
+                request = self._requests.get()
+                if request is None:
+                    break
+                future, kind, payload, mrz_mode, timeout = request
+                if not future.set_running_or_notify_cancel():
+                    continue
+                for attempt in range(2):
+                    if worker is None:
+                        try:
+                            worker = _Worker(self._context, self.backend)
+                        except Exception as e:
+                            future.set_exception(OCRWorkerError("Failed to start an OCR worker process: %r" % e))
+                            break
+                    try:
+                        worker.conn.send((kind, payload, mrz_mode))
+                        if not worker.conn.poll(timeout):
+                            worker.kill()
+                            worker = None
+                            future.set_exception(OCRTimeoutError("OCR request timed out after %s seconds" % timeout))
+                            break
+                        ok, result = worker.conn.recv()
+                    except (EOFError, IOError, OSError):
+                        # The worker died, restart it and retry
+                        worker.kill()
+                        worker = None
+                        if attempt == 1:
+                            future.set_exception(OCRWorkerError("OCR worker process crashed"))
+                        continue
+                    if ok:
+                        future.set_result(result)
+                    elif ok is None:
+                        future.set_exception(NotImplementedError(result))
+                    else:
+                        future.set_exception(OCRWorkerError(result))
+                    break
+        finally:
+            if worker is not None:
+                worker.shutdown()
@@ -5,7 +5,9 @@ Author: Konstantin Tretyakov
 License: MIT
 '''
 
-import sys
+import sys, re, io, mmap, zlib, binascii
+import numpy as np
+from collections import namedtuple
 PY2 = sys.version_info.major == 2
 
 if PY2:
@@ -20,7 +22,7 @@ from pdfminer.converter import PDFPageAggregator
 from pdfminer.layout import LTFigure, LTImage
 
 
-def extract_first_jpeg_in_pdf(fstream):
+def extract_first_jpeg_in_pdf(fstream, max_pages=None, fast=True):
     """
     Reads a given PDF file and scans for the first valid embedded JPEG image.
     Returns either None (if none found) or a string of data for the image.
@@ -33,8 +35,68 @@ def extract_first_jpeg_in_pdf(fstream):
     for PDFMiner.
 
     :param fstream: Readable binary stream of the PDF
+    :param max_pages: only the first max_pages pages are examined (None means all of them).
+    :param fast: when True, the image XObjects of the pages are located by walking the PDF object graph (see `PDFReader`),
+                 which is much faster than PDFMiner's layout analysis. PDFMiner is then only used for the files
+                 `PDFReader` does not support.
     :return: String, containing the whole contents of the JPEG image or None if extraction failed.
     """
+    if fast:
+        data = _read_pdf(fstream)
+        try:
+            return _find_first_jpeg_fast(data, max_pages)
+        except _PDF_ERRORS:
+            fstream.seek(0)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+    return next(_iter_jpegs_pdfminer(fstream, max_pages), None)
+
+
+def iter_pdf_images(fstream, max_pages=None, fast=True):
+    """
+    Iterates lazily over the images embedded in the pages of a PDF, in page order. JPEG images are yielded as
+    their (encoded) data, other images with supported encodings (FlateDecode or no filter, 1 or 8 bits per component,
+    gray, RGB, CMYK or indexed colors) are decoded and yielded as uint8 numpy arrays. The rest is skipped.
+    Only one image is held in memory at a time.
+
+    :param fstream: Readable binary stream of the PDF
+    :param max_pages: only the first max_pages pages are examined (None means all of them).
+    :param fast: when True, the images are located by walking the PDF object graph (see `PDFReader`).
+                 PDFMiner's layout analysis is used for the files `PDFReader` does not support (yielding JPEGs only).
+    """
+    if fast:
+        data = _read_pdf(fstream)
+        try:
+            try:
+                reader = PDFReader(data)
+                images = reader.page_images(max_pages)
+                img = next(images, None)
+            except _PDF_ERRORS:
+                reader = None
+            if reader is not None:
+                while img is not None:
+                    try:
+                        decoded = reader.decode_image(img)
+                    except _PDF_ERRORS:
+                        decoded = None
+                    if decoded is not None:
+                        yield decoded
+                    try:
+                        img = next(images, None)
+                    except _PDF_ERRORS:
+                        img = None
+                return
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+        fstream.seek(0)
+    for img in _iter_jpegs_pdfminer(fstream, max_pages):
+        yield img
+
+
+def _iter_jpegs_pdfminer(fstream, max_pages=None):
+    """Iterates over the JPEG images of a PDF using PDFMiner's layout analysis."""
     parser = PDFParser(fstream)
     if PY2:
         document = PDFDocument(parser)
@@ -47,7 +109,9 @@ def extract_first_jpeg_in_pdf(fstream):
     device = PDFPageAggregator(rsrcmgr)
     interpreter = PDFPageInterpreter(rsrcmgr, device)
     pages = PDFPage.create_pages(document) if PY2 else document.get_pages()
-    for page in pages:
+    for i, page in enumerate(pages):
+        if max_pages is not None and i >= max_pages:
+            break
         interpreter.process_page(page)
         layout = device.result
         for el in layout:
@@ -62,6 +126,537 @@ def extract_first_jpeg_in_pdf(fstream):
                             # Failed to decode (seems to happen nearly always - there's probably a bug in PDFMiner), oh well...
                             imdata = im.stream.get_rawdata()
                         if imdata is not None and imdata.startswith(b'\xff\xd8\xff\xe0'):
-                            return imdata
+                            yield imdata
+
+
+class PDFFormatError(Exception):
+    """Raised by `PDFReader` when a file can not be handled by it (e.g. it is damaged, encrypted or uses unsupported filters)."""
+    pass
+
+
+# The errors, which may be raised by PDFReader on malformed files
+_PDF_ERRORS = (PDFFormatError, ValueError, IndexError, KeyError, TypeError, AttributeError, zlib.error)
+_DCT = ('DCTDecode', 'DCT')
+_FLATE = ('FlateDecode', 'Fl')
+
+
+class PDFRef(namedtuple('PDFRef', 'num gen')):
+    """An indirect object reference."""
+    pass
+
+
+class PDFStream(namedtuple('PDFStream', 'dict start')):
+    """A stream object: its dictionary and the offset of its data in the file."""
+    pass
+
+
+class PDFKeyword(str):
+    """A bare keyword (such as 'stream' or 'endobj') met while parsing."""
+    pass
+
+
+_CONSTANTS = {'true': True, 'false': False, 'null': None}
+
+
+_REGULAR_RE = re.compile(br'[^\x00\t\n\x0c\r ()<>\[\]{}/%]+')
+_WHITESPACE_RE = re.compile(br'(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)*')
+_REF_RE = re.compile(br'[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+R(?![^\x00\t\n\x0c\r ()<>\[\]{}/%])')
+_OBJ_RE = re.compile(br'[\x00\t\n\x0c\r ]*(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj')
+_NUMBER_RE = re.compile(br'[+-]?(\d+\.?\d*|\.\d+)$')
+_NAME_ESCAPE_RE = re.compile(br'#([0-9A-Fa-f]{2})')
+_STRING_RE = re.compile(br'[()\\]')
+_OBJ_SCAN_RE = re.compile(br'(?<![0-9])(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj')
+_XREF_SECTION_RE = re.compile(br'[\x00\t\n\x0c\r ]*(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]*[\r\n]')
+_XREF_ENTRY_RE = re.compile(br'[\x00\t\n\x0c\r ]*(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+([nf])')
+
+
+def _parse_object(data, pos):
+    """Parses a PDF object (without resolving references) at the given position of data. Returns (object, end_position).
+
+    Dictionaries are returned as dicts with str keys, names as str, strings as bytes, and keywords (such as 'stream')
+    as PDFKeyword instances.
+
+    >>> _parse_object(b'<< /Type /Page /Kids [1 0 R 2 0 R] /Size 3.5 /T (a(b)c) /H <4142> >>', 0)[0] == {
+    ...     'Type': 'Page', 'Kids': [PDFRef(1, 0), PDFRef(2, 0)], 'Size': 3.5, 'T': b'a(b)c', 'H': b'AB'}
+    True
+    """
+    pos = _WHITESPACE_RE.match(data, pos).end()
+    c = data[pos:pos + 1]
+    if c == b'<' and data[pos + 1:pos + 2] == b'<':
+        result = {}
+        pos += 2
+        while True:
+            pos = _WHITESPACE_RE.match(data, pos).end()
+            if data[pos:pos + 2] == b'>>':
+                return result, pos + 2
+            key, pos = _parse_object(data, pos)
+            if not isinstance(key, str) or isinstance(key, PDFKeyword):
+                raise PDFFormatError("Invalid dictionary key at %d" % pos)
+            result[key], pos = _parse_object(data, pos)
+    elif c == b'<':
+        end = data.find(b'>', pos)
+        if end < 0:
+            raise PDFFormatError("Unterminated hex string at %d" % pos)
+        digits = re.sub(br'[^0-9A-Fa-f]', b'', data[pos + 1:end])
+        return binascii.unhexlify(digits + b'0' * (len(digits) % 2)), end + 1
+    elif c == b'[':
+        result = []
+        pos += 1
+        while True:
+            pos = _WHITESPACE_RE.match(data, pos).end()
+            if data[pos:pos + 1] == b']':
+                return result, pos + 1
+            item, pos = _parse_object(data, pos)
+            result.append(item)
+    elif c == b'(':
+        depth, i = 1, pos + 1
+        while depth > 0:
+            m = _STRING_RE.search(data, i)
+            if m is None:
+                raise PDFFormatError("Unterminated string at %d" % pos)
+            i = m.end()
+            ch = m.group()
+            if ch == b'\\':
+                i += 1
+            else:
+                depth += 1 if ch == b'(' else -1
+        return data[pos + 1:i - 1], i
+    elif c == b'/':
+        m = _REGULAR_RE.match(data, pos + 1)
+        name = m.group() if m is not None else b''
+        return _to_str(_NAME_ESCAPE_RE.sub(lambda e: binascii.unhexlify(e.group(1)), name)), pos + 1 + len(name)
+    else:
+        m = _REGULAR_RE.match(data, pos)
+        if m is None:
+            raise PDFFormatError("Unexpected character at %d" % pos)
+        token = m.group()
+        if _NUMBER_RE.match(token):
+            if b'.' in token:
+                return float(token), m.end()
+            ref = _REF_RE.match(data, m.end())
+            if ref is not None:
+                return PDFRef(int(token), int(ref.group(1))), ref.end()
+            return int(token), m.end()
+        keyword = _to_str(token)
+        if keyword in _CONSTANTS:
+            return _CONSTANTS[keyword], m.end()
+        return PDFKeyword(keyword), m.end()
+
+
+def _to_str(b):
+    """Converts bytes to the native str type (i.e. decodes them on Python 3 only), so that names and keywords compare
+    equal to string literals and pass isinstance(x, str) checks on both Pythons."""
+    return b if PY2 else b.decode('latin-1')
+
+
+def _as_list(obj):
+    return obj if isinstance(obj, list) else [obj]
+
+
+class PDFReader(object):
+    """
+    A minimal reader of the PDF object graph, which is just enough to locate the images of the pages without
+    the layout analysis of pdfminer. Objects are located via the cross-reference table (or stream) and are only parsed
+    (and their streams only read) when they are needed, so for a file on disk the reader is best used on an mmap.
+    Files with a damaged cross-reference table are handled by scanning for the objects.
+
+    Raises PDFFormatError when the file is not supported (e.g. it is encrypted).
+    """
+
+    def __init__(self, data):
+        """
+        :param data: the contents of the PDF file (bytes, mmap or any other buffer supporting slicing and regexes).
+        """
+        self.data = data
+        self._objects = {}  # num -> offset (int) or (objstm_num, index) (tuple)
+        self._cache = {}
+        self._objstm = {}
+        try:
+            self.trailer = self._read_xref()
+        except (PDFFormatError, ValueError, IndexError, KeyError, TypeError, zlib.error):
+            self._objects, self._cache = {}, {}
+            self.trailer = self._scan_objects()
+        if 'Encrypt' in self.trailer:
+            raise PDFFormatError("Encrypted PDFs are not supported")
+        if 'Root' not in self.trailer:
+            raise PDFFormatError("No document catalog found")
+
+    def _read_xref(self):
+        """Reads the cross-reference sections, starting from the one pointed to by startxref and following /Prev."""
+        tail = self.data.rfind(b'startxref')
+        if tail < 0:
+            raise PDFFormatError("No startxref")
+        offset = int(_REGULAR_RE.search(self.data, tail + len('startxref')).group())
+        trailer, seen = {}, set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            pos = _WHITESPACE_RE.match(self.data, offset).end()
+            if self.data[pos:pos + 4] == b'xref':
+                section_trailer = self._read_xref_table(pos + 4)
+            else:
+                section_trailer = self._read_xref_stream(pos)
+            for k, v in section_trailer.items():
+                trailer.setdefault(k, v)
+            offset = section_trailer.get('Prev')
+            if 'XRefStm' in section_trailer:
+                # Hybrid-reference file
+                self._read_xref_stream(section_trailer['XRefStm'])
+        return trailer
+
+    def _read_xref_table(self, pos):
+        while True:
+            m = _XREF_SECTION_RE.match(self.data, pos)
+            if m is None:
+                break
+            start, count = int(m.group(1)), int(m.group(2))
+            pos = m.end()
+            for num in range(start, start + count):
+                m = _XREF_ENTRY_RE.match(self.data, pos)
+                if m is None:
+                    raise PDFFormatError("Invalid xref table at %d" % pos)
+                pos = m.end()
+                if m.group(3) == b'n':
+                    self._objects.setdefault(num, int(m.group(1)))
+        pos = _WHITESPACE_RE.match(self.data, pos).end()
+        if self.data[pos:pos + 7] != b'trailer':
+            raise PDFFormatError("No trailer at %d" % pos)
+        return _parse_object(self.data, pos + 7)[0]
+
+    def _read_xref_stream(self, pos):
+        m = _OBJ_RE.match(self.data, pos)
+        if m is None:
+            raise PDFFormatError("No xref section at %d" % pos)
+        stream = self._parse_indirect(m.end())
+        if not isinstance(stream, PDFStream) or stream.dict.get('Type') != 'XRef':
+            raise PDFFormatError("No xref stream at %d" % pos)
+        widths = stream.dict['W']
+        index = stream.dict.get('Index', [0, stream.dict['Size']])
+        rows = self.stream_data(stream)
+        row_size = sum(widths)
+        i = 0
+        for start, count in zip(index[::2], index[1::2]):
+            for num in range(start, start + count):
+                fields, j = [], i
+                for w in widths:
+                    fields.append(int(binascii.hexlify(rows[j:j + w]), 16) if w > 0 else None)
+                    j += w
+                i += row_size
+                kind = fields[0] if fields[0] is not None else 1
+                if kind == 1:
+                    self._objects.setdefault(num, fields[1])
+                elif kind == 2:
+                    self._objects.setdefault(num, (fields[1], fields[2] or 0))
+        return stream.dict
+
+    def _scan_objects(self):
+        """Locates the objects by scanning the whole file, for files with a damaged cross-reference table.
+        Returns the trailer."""
+        objects, trailer = self._objects, {}
+        for m in _OBJ_SCAN_RE.finditer(self.data):
+            objects[int(m.group(1))] = m.start()
+        for m in re.finditer(br'trailer', self.data):
+            try:
+                trailer.update(_parse_object(self.data, m.end())[0])
+            except (PDFFormatError, ValueError, IndexError):
+                pass
+        # The trailer may as well be the dictionary of an xref stream, and some of the objects may be in object streams
+        for num in list(objects):
+            try:
+                obj = self.get(PDFRef(num, 0))
+            except (PDFFormatError, ValueError, IndexError, KeyError, TypeError):
+                continue
+            if isinstance(obj, PDFStream) and obj.dict.get('Type') == 'XRef':
+                for k, v in obj.dict.items():
+                    trailer.setdefault(k, v)
+            elif isinstance(obj, PDFStream) and obj.dict.get('Type') == 'ObjStm':
+                try:
+                    data = self.stream_data(obj)
+                except (PDFFormatError, ValueError, zlib.error):
+                    continue
+                header = [int(x) for x in data[:obj.dict['First']].split()]
+                for i, contained in enumerate(header[::2]):
+                    objects.setdefault(contained, (num, i))
+        return trailer
+
+    def _parse_indirect(self, pos):
+        """Parses the body of an indirect object starting at pos (right after 'n g obj')."""
+        obj, pos = _parse_object(self.data, pos)
+        if isinstance(obj, dict):
+            end = _WHITESPACE_RE.match(self.data, pos).end()
+            if self.data[end:end + 6] == b'stream':
+                end += 6
+                if self.data[end:end + 2] == b'\r\n':
+                    end += 2
+                elif self.data[end:end + 1] in (b'\n', b'\r'):
+                    end += 1
+                return PDFStream(obj, end)
+        return obj
+
+    def get(self, ref):
+        """Returns the object with the given reference (None, if there is no such object)."""
+        if ref.num in self._cache:
+            return self._cache[ref.num]
+        location = self._objects.get(ref.num)
+        if location is None:
+            obj = None
+        elif isinstance(location, tuple):
+            obj = self._get_from_objstm(*location)
+        else:
+            m = _OBJ_RE.match(self.data, location)
+            if m is None or int(m.group(1)) != ref.num:
+                raise PDFFormatError("Object %d not found at %d" % (ref.num, location))
+            obj = self._parse_indirect(m.end())
+        self._cache[ref.num] = obj
+        return obj
+
+    def _get_from_objstm(self, objstm_num, index):
+        if objstm_num not in self._objstm:
+            stream = self.resolve(PDFRef(objstm_num, 0))
+            data = self.stream_data(stream)
+            header = [int(x) for x in data[:stream.dict['First']].split()]
+            self._objstm[objstm_num] = (data, stream.dict['First'], header[1::2])
+        data, first, offsets = self._objstm[objstm_num]
+        return _parse_object(data, first + offsets[index])[0]
+
+    def resolve(self, obj):
+        """Follows the references until a direct object is reached."""
+        seen = set()
+        while isinstance(obj, PDFRef):
+            if obj.num in seen:
+                raise PDFFormatError("Reference loop at object %d" % obj.num)
+            seen.add(obj.num)
+            obj = self.get(obj)
+        return obj
+
+    def raw_stream_data(self, stream):
+        """Returns the (encoded) data of a stream."""
+        length = self.resolve(stream.dict.get('Length'))
+        if isinstance(length, int) and self.data[stream.start + length:stream.start + length + 20].strip().startswith(b'endstream'):
+            return self.data[stream.start:stream.start + length]
+        end = self.data.find(b'endstream', stream.start)
+        if end < 0:
+            raise PDFFormatError("Unterminated stream at %d" % stream.start)
+        return self.data[stream.start:end].rstrip(b'\r\n')
+
+    def stream_data(self, stream, keep_filters=()):
+        """Returns the data of a stream, decoded by all of its filters up to the first one in keep_filters.
+        Only FlateDecode (with PNG predictors) is supported."""
+        data = self.raw_stream_data(stream)
+        filters = self.filters(stream)
+        params = [self.resolve(p) or {} for p in _as_list(self.resolve(stream.dict.get('DecodeParms', [])))]
+        params += [{}] * (len(filters) - len(params))
+        for f, p in zip(filters, params):
+            if f in keep_filters:
+                break
+            elif f in _FLATE:
+                data = _png_unpredict(zlib.decompress(data), p)
+            else:
+                raise PDFFormatError("Unsupported filter: %s" % f)
+        return data
+
+    def filters(self, stream):
+        """Returns the list of filter names of a stream."""
+        return [self.resolve(f) for f in _as_list(self.resolve(stream.dict.get('Filter', [])))]
+
+    def pages(self):
+        """Iterates over the pages of the document in order, yielding pairs (page_dict, resources)."""
+        root = self.resolve(self.trailer['Root'])
+        if not isinstance(root, dict) or 'Pages' not in root:
+            raise PDFFormatError("Invalid document catalog")
+        stack = [(self.resolve(root['Pages']), None)]
+        seen = set()
+        while stack:
+            node, resources = stack.pop()
+            if not isinstance(node, dict) or id(node) in seen:
+                continue
+            seen.add(id(node))
+            resources = self.resolve(node.get('Resources', resources))
+            if node.get('Type') == 'Pages' or 'Kids' in node:
+                stack.extend((self.resolve(kid), resources) for kid in reversed(self.resolve(node['Kids'])))
+            else:
+                yield node, resources
+
+    def images(self, resources, _seen=None):
+        """Iterates over the image XObjects (as PDFStream objects) in the given resources, including those of forms."""
+        seen = set() if _seen is None else _seen
+        xobjects = self.resolve(self.resolve(resources or {}).get('XObject')) or {}
+        for ref in xobjects.values():
+            if isinstance(ref, PDFRef):
+                if ref.num in seen:
+                    continue
+                seen.add(ref.num)
+            obj = self.resolve(ref)
+            if not isinstance(obj, PDFStream):
+                continue
+            subtype = obj.dict.get('Subtype')
+            if subtype == 'Image':
+                yield obj
+            elif subtype == 'Form':
+                for img in self.images(obj.dict.get('Resources'), seen):
+                    yield img
+
+    def page_images(self, max_pages=None):
+        """Iterates over the image XObjects of the first max_pages pages (all pages, if None)."""
+        for i, (page, resources) in enumerate(self.pages()):
+            if max_pages is not None and i >= max_pages:
+                break
+            for img in self.images(resources):
+                yield img
+
+    def decode_image(self, stream):
+        """Returns the data of a JPEG image XObject or, for the other images, the decoded image as a uint8 array
+        (height x width for gray images, height x width x 3 otherwise). Returns None if the image is not supported."""
+        filters = self.filters(stream)
+        if any(f in _DCT for f in filters):
+            data = self.stream_data(stream, keep_filters=_DCT)
+            return bytes(data) if data.startswith(b'\xff\xd8') else None
+        if stream.dict.get('ImageMask') or any(f not in _FLATE for f in filters):
+            return None
+        width, height = self.resolve(stream.dict['Width']), self.resolve(stream.dict['Height'])
+        bits = self.resolve(stream.dict.get('BitsPerComponent', 8))
+        colorspace = self._colorspace(stream.dict.get('ColorSpace', 'DeviceGray'))
+        if colorspace is None or bits not in (1, 8):
+            return None
+        n_components, palette = colorspace
+        data = np.frombuffer(self.stream_data(stream), np.uint8)
+        row_size = (width * n_components * bits + 7) // 8
+        if len(data) < row_size * height:
+            return None
+        rows = data[:row_size * height].reshape(height, row_size)
+        if bits == 1:
+            img = np.unpackbits(rows, axis=1)[:, :width * n_components] * np.uint8(255 if palette is None else 1)
+        else:
+            img = rows[:, :width * n_components]
+        img = img.reshape(height, width, n_components)
+        if palette is not None:
+            img = palette[np.minimum(img[:, :, 0], len(palette) - 1)]
+        elif n_components == 4:
+            # Naive CMYK to RGB
+            img = ((255 - img[:, :, :3].astype(np.int32)) * (255 - img[:, :, 3:].astype(np.int32)) // 255).astype(np.uint8)
+        elif self.resolve(stream.dict.get('Decode')) in ([1, 0], [1.0, 0.0]):
+            img = 255 - img
+        return img[:, :, 0] if img.shape[2] == 1 else img
+
+    def _colorspace(self, colorspace):
+        """Returns a pair (number_of_components, palette_or_None) for a supported color space, None otherwise.
+        The palette of an indexed color space is an (n x 3 or n x 1) uint8 array."""
+        colorspace = self.resolve(colorspace)
+        if isinstance(colorspace, list) and len(colorspace) == 1:
+            colorspace = self.resolve(colorspace[0])
+        if colorspace in ('DeviceGray', 'CalGray', 'G'):
+            return 1, None
+        elif colorspace in ('DeviceRGB', 'CalRGB', 'RGB'):
+            return 3, None
+        elif colorspace in ('DeviceCMYK', 'CMYK'):
+            return 4, None
+        elif isinstance(colorspace, list) and colorspace[0] == 'ICCBased':
+            n = self.resolve(self.resolve(colorspace[1]).dict.get('N'))
+            return (n, None) if n in (1, 3, 4) else None
+        elif isinstance(colorspace, list) and colorspace[0] in ('Indexed', 'I') and len(colorspace) == 4:
+            base = self._colorspace(colorspace[1])
+            lookup = self.resolve(colorspace[3])
+            if isinstance(lookup, PDFStream):
+                lookup = self.stream_data(lookup)
+            if base is None or base[1] is not None or base[0] == 4 or not isinstance(lookup, bytes):
+                return None
+            palette = np.frombuffer(lookup, np.uint8)
+            palette = palette[:len(palette) // base[0] * base[0]].reshape(-1, base[0])
+            return 1, palette if base[0] == 3 else palette[:, :1]
+        return None
+
+
+def _png_unpredict(data, params):
+    """Undoes the PNG predictors (Predictor >= 10), as used in xref streams and images.
+
+    >>> rows = [[0, 1, 2, 3], [1, 1, 1, 1], [2, 1, 1, 1], [3, 10, 20, 30], [4, 5, 5, 5]]
+    >>> list(_png_unpredict(bytes(bytearray(sum(rows, []))), {'Predictor': 15, 'Columns': 3}))
+    [1, 2, 3, 1, 2, 3, 2, 3, 4, 11, 27, 45, 16, 32, 50]
+    """
+    predictor = params.get('Predictor', 1)
+    if predictor < 10:
+        if predictor != 1:
+            raise PDFFormatError("Unsupported predictor: %s" % predictor)
+        return data
+    colors, bits = params.get('Colors', 1), params.get('BitsPerComponent', 8)
+    columns = (params.get('Columns', 1) * colors * bits + 7) // 8
+    bpp = max(colors * bits // 8, 1)
+    n_rows = len(data) // (columns + 1)
+    rows = np.frombuffer(data, np.uint8)[:n_rows * (columns + 1)].reshape(n_rows, columns + 1)
+    ftypes = rows[:, 0]
+    if n_rows > 0 and ftypes.max() > 4:
+        raise PDFFormatError("Invalid PNG predictor type: %d" % ftypes.max())
+    if n_rows > 0 and ftypes.max() >= 3:
+        return _png_unpredict_diagonal(rows, bpp).tobytes()
+    result = np.zeros((n_rows, columns), np.uint8)
+    prev = np.zeros(columns, np.uint8)
+    for i in range(n_rows):
+        ftype, row = ftypes[i], rows[i, 1:]
+        if ftype == 0:
+            cur = row.copy()
+        elif ftype == 1:
+            cur = np.zeros(columns + bpp - 1, np.uint8)
+            cur[:columns] = row
+            cur = np.cumsum(cur[:(columns + bpp - 1) // bpp * bpp].reshape(-1, bpp), axis=0, dtype=np.uint8).ravel()[:columns]
+        else:
+            cur = row + prev
+        result[i] = prev = cur
+    return result.tobytes()
+
+
+def _png_unpredict_diagonal(rows, bpp):
+    """Undoes the PNG predictors of the given rows (each prefixed by its filter type), when the Average or Paeth filters
+    are used. These depend on the already decoded left neighbour of a pixel, hence can not be undone a row at a time.
+    Instead, the pixels are decoded along the anti-diagonals of the image: all the pixels of an anti-diagonal only depend
+    on the preceding two, hence this takes rows + columns vectorized steps."""
+    n_rows, columns = rows.shape[0], rows.shape[1] - 1
+    ftypes = rows[:, 0]
+    used = set(np.unique(ftypes).tolist())
+    n_pixels = (columns + bpp - 1) // bpp
+    # The pixels are stored row by row with a leading row and column of zeros (the missing neighbours of the first
+    # row and column). With rows of width w, pixel (i, j) is at (i + 1)*w + j + 1, so that the pixels of an
+    # anti-diagonal and their neighbours are strided slices (views) of the flat array
+    w = n_pixels + 1
+    raw = np.zeros((n_rows + 1, w * bpp), np.uint8)
+    raw[1:, bpp:bpp + columns] = rows[:, 1:]
+    raw = raw.reshape(-1, bpp)
+    out = np.zeros_like(raw)
+    for d in range(n_rows + n_pixels - 1):
+        lo, hi = max(0, d - n_pixels + 1), min(d, n_rows - 1) + 1
+        start = (lo + 1) * w + d - lo + 1
+        pixels = slice(start, start + (hi - lo - 1) * (w - 1) + 1, w - 1)
+        left = out[pixels.start - 1:pixels.stop - 1:pixels.step].astype(np.int16)
+        up = out[pixels.start - w:pixels.stop - w:pixels.step].astype(np.int16)
+        predictions = [0, left, up, 0, 0]
+        if 3 in used:
+            predictions[3] = (left + up) >> 1
+        if 4 in used:
+            up_left = out[pixels.start - w - 1:pixels.stop - w - 1:pixels.step].astype(np.int16)
+            p = left + up - up_left
+            pa, pb, pc = np.abs(p - left), np.abs(p - up), np.abs(p - up_left)
+            predictions[4] = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+        if len(used) == 1:
+            prediction = predictions[ftypes[0]]
+        else:
+            prediction = np.choose(ftypes[lo:hi, None], predictions)
+        out[pixels] = (raw[pixels] + prediction) & 0xff
+    return out.reshape(n_rows + 1, -1)[1:, bpp:bpp + columns]
+
+
+def _find_first_jpeg_fast(data, max_pages=None):
+    """Walks the object graph of the PDF (see `PDFReader`), returns the data of the first DCT-encoded image on
+    the first max_pages pages or None."""
+    reader = PDFReader(data)
+    for img in reader.page_images(max_pages):
+        if any(f in _DCT for f in reader.filters(img)):
+            imdata = reader.decode_image(img)
+            if imdata is not None:
+                return imdata
+    return None
+
 
-    return None
\ No newline at end of file
+def _read_pdf(fstream):
+    """Returns an mmap of the file behind the stream (if it is a real file) or its contents. The caller should close the mmap."""
+    try:
+        return mmap.mmap(fstream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, OSError, io.UnsupportedOperation):
+        return fstream.read()
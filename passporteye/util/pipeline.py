@@ -4,6 +4,13 @@ PassportEye::Util: Pipeline utility
 Author: Konstantin Tretyakov
 License: MIT
 '''
+import hashlib
+import pickle
+import threading
+import time
+import tracemalloc
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 
 class Pipeline(object):
@@ -37,6 +44,20 @@ class Pipeline(object):
     (4, 0)
     >>> a['d']
     0
+
+    By default, all the computed values are kept in `data`. If `keep` is set to a list of keys, the pipeline is "lean":
+    each computation of a requested key frees the values which are no longer needed (see `_release_schedule`),
+    except the requested key itself and the ones in `keep`. Freed values are recomputed if requested again.
+
+    >>> a = Pipeline()
+    >>> a.add_component('1', lambda: 1, ['a'], [])
+    >>> a.add_component('2', lambda x: x+1, ['b'], ['a'])
+    >>> a.add_component('3', lambda x, y: x*y*3, ['c'], ['a', 'b'])
+    >>> a.keep = ['a']
+    >>> a['c'], sorted(k for k in a.data if not k.startswith('__'))
+    (6, ['a', 'c'])
+    >>> a['b'], sorted(k for k in a.data if not k.startswith('__'))
+    (2, ['a', 'b', 'c'])
     """
 
     def __init__(self):
@@ -45,9 +66,95 @@ class Pipeline(object):
         self.provides = dict()    # Component name -> provides list
         self.depends = dict()     # Component name -> depends list
         self.whoprovides = dict() # key -> component name
+        self.consumers = dict()   # key -> names of the components depending on it
+        self.stats = None         # Component name -> statistics (see `instrument`)
+        self.counters = dict()    # Counter name -> function returning the current count (see `instrument`)
+        self.trace_memory = False
+        self.keep = None          # The keys kept by a lean pipeline (None means all)
+        self.memo = None          # Component name -> (input hashes, results) of its last call (see `memoize`)
+        self.hashes = dict()      # key -> hash of the value (see `memoize`)
+        self._memory_stack = []
+        self._depth = 0
         self.data['__data__'] = self.data
         self.data['__pipeline__'] = self
 
+    def instrument(self, trace_memory=False, counters=None):
+        """
+        Enables recording the statistics of the component calls. For each component, `stats` then contains a dictionary
+        with the number of calls, the total wall and CPU time in seconds ('wall_time', 'cpu_time'), the increase of each
+        of the `counters` during the calls and the peak number of bytes allocated during a call on top of what was allocated
+        before it ('peak_memory', None unless trace_memory is set).
+
+        The statistics of a component include those of the components it triggers the computation of (e.g. via __pipeline__).
+        The CPU time and memory are counted for the whole process (memory allocations of other threads during a call
+        are included), the counters are as global as the given functions are (e.g. `ocr.ocr_call_count` may count
+        the calls of the current thread only, which tells apart the components run concurrently by a `PipelineExecutor`).
+        On Python versions without `tracemalloc.reset_peak` (before 3.9), tracing is restarted instead, hence the memory
+        peaks are approximate there (memory freed after the restart, but allocated before it, is not accounted for).
+
+        :param trace_memory: when True, memory allocations are traced (via `tracemalloc`, which is started if necessary,
+                             and slows down the computation considerably).
+        :param counters: a dictionary of named counters (functions returning the number of some events so far,
+                         e.g. `ocr.ocr_call_count`) to be added to the pipeline's `counters`.
+
+        >>> events = []
+        >>> a = Pipeline()
+        >>> a.add_component('1', lambda: events.append(1) or [0]*1000, ['a'], [])
+        >>> a.add_component('2', len, ['b'], ['a'])
+        >>> a.instrument(trace_memory=True, counters={'events': lambda: len(events)})
+        >>> a['b']
+        1000
+        >>> sorted(a.stats['2']), a.stats['2']['calls'], a.stats['1']['peak_memory'] >= 8000
+        (['calls', 'cpu_time', 'events', 'peak_memory', 'wall_time'], 1, True)
+        >>> a.stats['1']['events'], a.stats['2']['events']
+        (1, 0)
+        >>> tracemalloc.stop()
+        """
+        self.stats = {}
+        self.trace_memory = trace_memory
+        self.counters.update(counters or {})
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def memoize(self):
+        """
+        Enables value-level memoization: the results of each component call are remembered along with the hashes of its inputs.
+        When a component is to be recomputed (e.g. after an upstream component was replaced), but its inputs have the same
+        hashes as in the last call, the remembered results are reused instead of calling it. Hence replacing a component
+        reruns only the components whose inputs have actually changed.
+
+        Values are hashed by their contents (arrays by their data, other values via `pickle`). A component which depends
+        on `__pipeline__` or `__data__` is memoized only if it declares the values it reads through them in `__uses__`
+        (see `_release_schedule`): its inputs then also include those of the values, which are present (the special keys,
+        starting with '__', are not hashed). As such a component may recompute values with the other components,
+        its remembered results are dropped whenever a component is added, removed or replaced, if it depends on
+        `__pipeline__`. Components with unhashable inputs are always called. Components must not modify their inputs,
+        nor their results afterwards. Note that the remembered results are kept in memory (even if freed, see `keep`).
+
+        >>> calls = []
+        >>> a = Pipeline()
+        >>> a.add_component('1', lambda: 1, ['a'], [])
+        >>> a.add_component('2', lambda x: calls.append('2') or x % 2, ['b'], ['a'])
+        >>> a.add_component('3', lambda x: calls.append('3') or x * 10, ['c'], ['b'])
+        >>> a.memoize()
+        >>> a['c']
+        10
+        >>> a.replace_component('1', lambda: 3, ['a'], [])
+        >>> a['c'], calls
+        (10, ['2', '3', '2'])
+        >>> def d(c, data):
+        ...     calls.append('4')
+        ...     return c + data['a']
+        >>> d.__uses__ = ['a']
+        >>> a.add_component('4', d, ['d'], ['c', '__data__'])
+        >>> a['d'], calls[3:]
+        (13, ['4'])
+        >>> a.replace_component('1', lambda: 5, ['a'], [])
+        >>> a['d'], calls[3:]  # c is the same, but the value of a, read via __data__, is not
+        (15, ['4', '2', '4'])
+        """
+        self.memo = {}
+
     def add_component(self, name, callable, provides=None, depends=None):
         """
         Add a given callable to a list of components. The provides and depends are lists of strings, specifying what
@@ -64,6 +171,10 @@ class Pipeline(object):
         self.components[name] = callable
         for p in provides:
             self.whoprovides[p] = name
+        for d in depends:
+            # Not appended in place, as the lists may be shared with a `PipelinePlan`
+            self.consumers[d] = self.consumers.get(d, []) + [name]
+        self._forget_pipeline_memos()
 
     def remove_component(self, name):
         """Removes an existing component with a given name, invalidating all the values computed by
@@ -71,11 +182,16 @@ class Pipeline(object):
         if name not in self.components:
             raise Exception("No component named %s" % name)
         del self.components[name]
+        for d in self.depends[name]:
+            self.consumers[d] = [c for c in self.consumers[d] if c != name]
         del self.depends[name]
+        if self.memo is not None:
+            self.memo.pop(name, None)
         for p in self.provides[name]:
             del self.whoprovides[p]
             self.invalidate(p)
         del self.provides[name]
+        self._forget_pipeline_memos()
 
     def replace_component(self, name, callable, provides=None, depends=None):
         """Changes an existing component with a given name, invalidating all the values computed by
@@ -84,34 +200,555 @@ class Pipeline(object):
         self.add_component(name, callable, provides, depends)
 
     def invalidate(self, key):
-        """Remove the given data item along with all items that depend on it in the graph."""
-        if key not in self.data:
-            return
-        del self.data[key]
-
-        # Find all components that used it and invalidate their results
-        for cname in self.components:
-            if key in self.depends[cname]:
+        """Remove the given data item along with all items that depend on it in the graph
+        (the latter are removed even if the item itself was already freed, see `keep`)."""
+        keys, seen = [key], {key}
+        while keys:
+            k = keys.pop()
+            self.data.pop(k, None)
+            self.hashes.pop(k, None)
+            # Invalidate the results of all components that used it
+            for cname in self.consumers.get(k, []):
                 for downstream_key in self.provides[cname]:
-                    self.invalidate(downstream_key)
+                    if downstream_key not in seen:
+                        seen.add(downstream_key)
+                        keys.append(downstream_key)
 
     def __setitem__(self, key, value):
         self.data[key] = value
+        self.hashes.pop(key, None)
 
     def __getitem__(self, key):
-        self._compute(key)
+        if self.keep is None or self._depth > 0:
+            self._compute(key)
+        else:
+            self._compute_lean(key)
         return self.data[key]
 
+    def compile(self, targets, inputs=(), keep=None):
+        """Returns a `PipelinePlan` for computing the given keys repeatedly with the current components.
+
+        :param targets: the keys to be computed by each run of the plan.
+        :param inputs: the keys to be given to each run (rather than computed by their components).
+        :param keep: the keys (other than the targets) which the runs keep, all others are freed after their last use.
+                     By default, the pipeline's `keep` is used.
+        """
+        return PipelinePlan(self, targets, inputs, keep if keep is not None else self.keep)
+
     def _compute(self, key):
         if key not in self.data:
             cname = self.whoprovides[key]
             for d in self.depends[cname]:
                 self._compute(d)
-            inputs = [self.data[d] for d in self.depends[cname]]
-            results = self.components[cname](*inputs)
-            if len(self.provides[cname]) == 1:
-                self.data[self.provides[cname][0]] = results
+            fingerprint = self._fingerprint(cname)
+            memo = self._memoized(cname, fingerprint)
+            if memo is not None:
+                results = memo[1]
+            else:
+                results = self._call(cname, [self.data[d] for d in self.depends[cname]])
+            self._store(cname, results, fingerprint)
+
+    def _store(self, cname, results, fingerprint=None):
+        """Stores the results of a component call (remembering them for the given input hashes, see `memoize`)."""
+        provides = self.provides[cname]
+        for k, v in zip(provides, [results] if len(provides) == 1 else results):
+            self.data[k] = v
+            self.hashes.pop(k, None)
+        if fingerprint is not None:
+            self.memo[cname] = (fingerprint, results)
+
+    def _fingerprint(self, cname):
+        """The hashes of the inputs of a component, None if its results are not memoized (see `memoize`)."""
+        if self.memo is None:
+            return None
+        inputs = self.depends[cname]
+        if _is_exclusive(inputs):
+            uses = getattr(self.components[cname], '__uses__', None)
+            if uses is None:
+                return None
+            inputs = [k for k in list(inputs) + [u for u in uses if u in self.data] if not k.startswith('__')]
+        for d in inputs:
+            if d not in self.hashes:
+                self.hashes[d] = _value_hash(self.data[d])
+        fingerprint = tuple((d, self.hashes[d]) for d in inputs)
+        return None if any(h is None for d, h in fingerprint) else fingerprint
+
+    def _forget_pipeline_memos(self):
+        """Drops the remembered results of the components depending on __pipeline__ (see `memoize`)."""
+        if self.memo:
+            for cname in list(self.memo):
+                if '__pipeline__' in self.depends.get(cname, []):
+                    del self.memo[cname]
+
+    def _memoized(self, cname, fingerprint):
+        """The remembered (fingerprint, results) of a component if they are valid for the given fingerprint, otherwise None."""
+        memo = self.memo.get(cname) if fingerprint is not None else None
+        return memo if memo is not None and memo[0] == fingerprint else None
+
+    def _compute_lean(self, key):
+        """Computes a key of a lean pipeline, freeing the values which are no longer needed after each component."""
+        order = []
+
+        def visit(k):
+            if k not in self.data and self.whoprovides[k] not in order:
+                for d in self.depends[self.whoprovides[k]]:
+                    visit(d)
+                order.append(self.whoprovides[k])
+        visit(key)
+        steps = [(c, self.components[c], self.depends[c], self.provides[c]) for c in order]
+        release = _release_schedule(steps, self.data, [key] + list(self.keep))
+        # Nested requests (e.g. via __pipeline__) are computed the usual way, so as not to free what is still needed here
+        self._depth += 1
+        try:
+            for (cname, component, depends, provides), free in zip(steps, release):
+                if self.components.get(cname) is not component:
+                    break  # The pipeline was modified, the rest is computed the usual way
+                if not all(p in self.data for p in provides):
+                    self._compute(provides[0])
+                for k in free:
+                    self.data.pop(k, None)
+            self._compute(key)
+        finally:
+            self._depth -= 1
+        # The values recomputed by nested requests are no longer needed either
+        for cname in order:
+            for k in self.provides.get(cname, []):
+                if k != key and k not in self.keep:
+                    self.data.pop(k, None)
+
+    def _call(self, cname, inputs):
+        """Calls a given component, recording its statistics if enabled (see `instrument`)."""
+        if self.stats is None:
+            return self.components[cname](*inputs)
+        trace_memory = self.trace_memory and tracemalloc.is_tracing()
+        if trace_memory:
+            # Calls may be nested, hence the peak of each call on the stack is tracked separately
+            current, peak = _traced_memory()
+            if self._memory_stack:
+                self._memory_stack[-1][1] = max(self._memory_stack[-1][1], peak)
+            _reset_peak()
+            self._memory_stack.append([current, current])
+        counts = dict((name, counter()) for name, counter in self.counters.items())
+        cpu_time = time.process_time()
+        wall_time = time.time()
+        try:
+            return self.components[cname](*inputs)
+        finally:
+            st = self.stats.setdefault(cname, {'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'peak_memory': None})
+            st['calls'] += 1
+            st['wall_time'] += time.time() - wall_time
+            st['cpu_time'] += time.process_time() - cpu_time
+            for name, counter in self.counters.items():
+                st[name] = st.get(name, 0) + counter() - counts[name]
+            if trace_memory:
+                start, peak = self._memory_stack.pop()
+                peak = max(peak, _traced_memory()[1])
+                if self._memory_stack:
+                    self._memory_stack[-1][1] = max(self._memory_stack[-1][1], peak)
+                st['peak_memory'] = max(st['peak_memory'] or 0, peak - start)
+
+
+_memory_offset = 0  # The memory traced before tracemalloc was last restarted by `_reset_peak`
+
+
+def _traced_memory():
+    """Returns the current and peak sizes of the traced memory (see `tracemalloc.get_traced_memory`)."""
+    current, peak = tracemalloc.get_traced_memory()
+    return current + _memory_offset, peak + _memory_offset
+
+
+def _reset_peak():
+    """Resets the peak of the traced memory to the current size (via restarting the tracing before Python 3.9)."""
+    global _memory_offset
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        _memory_offset += tracemalloc.get_traced_memory()[0]
+        n_frames = tracemalloc.get_traceback_limit()
+        tracemalloc.stop()
+        tracemalloc.start(n_frames)
+
+
+class PipelinePlan(object):
+    """
+    A pipeline, "compiled" for computing the same keys (targets) many times over different inputs.
+
+    The components needed for computing the targets are determined once and arranged in the order of execution
+    (so that each one is preceded by the components it depends on), along with their input and output keys.
+    A run then simply calls these components in order, storing the results in a fresh data dictionary, which is
+    initialized with the given inputs. The components themselves are shared by all the runs (hence any state they keep,
+    such as a `Deadline`, must be reset between the runs by the user of the plan), and so a plan is meant to be run
+    by one thread at a time, unless its components are thread-safe. If the pipeline was instrumented (see `Pipeline.instrument`)
+    at compilation, so is each run.
+
+    Each run is represented by a `PipelineRun` - a `Pipeline` containing the data of the run. Keys which are not among
+    the targets can be requested from it as usual. Components which modify the pipeline during the run (via __pipeline__)
+    modify the run only, the plan stays intact.
+
+    If the plan is given a list of keys to keep, each run frees every other value (except the targets) right after
+    its last use (see `_release_schedule`), so that only the targets and the kept values remain in the finished run.
+
+    >>> a = Pipeline()
+    >>> a.add_component('1', lambda: 1, ['a'], [])
+    >>> a.add_component('2', lambda x: x*2, ['b'], ['a'])
+    >>> a.add_component('s,d', lambda x,y: (x+y, x-y), ['c', 'd'], ['a', 'b'])
+    >>> plan = a.compile(['c'], inputs=['a'])
+    >>> plan.order
+    ['2', 's,d']
+    >>> plan.run(a=10)['c'], plan.run(a=20)['c'], plan.run(a=20)['d']
+    (30, 60, -20)
+    >>> r = plan.run(a=10)
+    >>> r.replace_component('2', lambda x: x*3, ['b'], ['a'])
+    >>> r['c'], plan.run(a=10)['c']
+    (40, 30)
+    >>> plan = a.compile(['c'], inputs=['a'], keep=['d'])
+    >>> plan.release
+    [[], ['a', 'b']]
+    >>> sorted(k for k in plan.run(a=10).data if not k.startswith('__'))
+    ['c', 'd']
+    """
+
+    def __init__(self, pipeline, targets, inputs=(), keep=None):
+        """
+        :param pipeline: the `Pipeline`, whose components are used. Later modifications of the pipeline do not affect the plan.
+        :param targets: the keys computed by each run.
+        :param inputs: the keys which must be given to each run. Their components (if any) are not called.
+        :param keep: the keys (other than the targets) to be kept in the runs. If given, all other values are freed
+                     after their last use, otherwise all of them are kept.
+        """
+        self.components = dict(pipeline.components)
+        self.provides = dict(pipeline.provides)
+        self.depends = dict(pipeline.depends)
+        self.whoprovides = dict(pipeline.whoprovides)
+        self.consumers = dict(pipeline.consumers)
+        self.targets = list(targets)
+        self.inputs = list(inputs)
+        self.instrumented = pipeline.stats is not None
+        self.trace_memory = pipeline.trace_memory
+        self.counters = dict(pipeline.counters)
+        self.order = []
+        available = set(self.inputs) | {'__data__', '__pipeline__'}
+        visiting = set()
+
+        def visit(key):
+            if key in available:
+                return
+            if key not in self.whoprovides:
+                raise Exception("No component provides %s" % key)
+            cname = self.whoprovides[key]
+            if cname in visiting:
+                raise Exception("Circular dependency of component %s" % cname)
+            visiting.add(cname)
+            for d in self.depends[cname]:
+                visit(d)
+            visiting.remove(cname)
+            self.order.append(cname)
+            available.update(self.provides[cname])
+        for t in self.targets:
+            visit(t)
+        self.steps = [(c, self.components[c], self.depends[c], self.provides[c]) for c in self.order]
+        self.keep = list(keep) if keep is not None else None
+        self.release = None  # For each step, the keys freed after it (if keep is given)
+        if self.keep is not None:
+            self.release = _release_schedule(self.steps, self.inputs, self.targets + self.keep)
+
+    def run(self, **inputs):
+        """Computes the targets for the given inputs (the keyword arguments), returns the `PipelineRun`."""
+        missing = [k for k in self.inputs if k not in inputs]
+        if missing:
+            raise Exception("Missing plan inputs: %s" % ', '.join(missing))
+        run = PipelineRun(self)
+        if self.instrumented:
+            run.instrument(self.trace_memory, self.counters)
+        data = run.data
+        data.update(inputs)
+        for i, (cname, component, depends, provides) in enumerate(self.steps):
+            if run.modified:
+                break
+            results = component(*[data[d] for d in depends]) if run.stats is None else run._call(cname, [data[d] for d in depends])
+            if len(provides) == 1:
+                data[provides[0]] = results
             else:
-                for k, v in zip(self.provides[cname], results):
-                    self.data[k] = v
+                for k, v in zip(provides, results):
+                    data[k] = v
+            if self.release is not None:
+                for k in self.release[i]:
+                    data.pop(k, None)
+        if run.modified:
+            # A component has changed the pipeline, the rest of it is computed the usual way
+            for t in self.targets:
+                run._compute(t)
+            if self.release is not None:
+                for k in list(data):
+                    if k not in self.targets and k not in self.keep and not k.startswith('__'):
+                        del data[k]
+        return run
+
+
+class PipelineRun(Pipeline):
+    """A run of a `PipelinePlan`: a pipeline, which shares the components of the plan until it is modified."""
+
+    def __init__(self, plan):
+        self.data = {}
+        self.components = plan.components
+        self.provides = plan.provides
+        self.depends = plan.depends
+        self.whoprovides = plan.whoprovides
+        self.consumers = plan.consumers
+        self.modified = False
+        self.stats = None
+        self.counters = {}
+        self.trace_memory = False
+        self.keep = None
+        self.memo = None
+        self.hashes = {}
+        self._memory_stack = []
+        self._depth = 0
+        self.data['__data__'] = self.data
+        self.data['__pipeline__'] = self
+
+    def _copy_on_write(self):
+        if not self.modified:
+            self.components, self.provides = dict(self.components), dict(self.provides)
+            self.depends, self.whoprovides = dict(self.depends), dict(self.whoprovides)
+            self.consumers = dict(self.consumers)
+            self.modified = True
+
+    def add_component(self, name, callable, provides=None, depends=None):
+        self._copy_on_write()
+        super(PipelineRun, self).add_component(name, callable, provides, depends)
+
+    def remove_component(self, name):
+        self._copy_on_write()
+        super(PipelineRun, self).remove_component(name)
+
+
+class PipelineExecutor(object):
+    """
+    Computes the values of a pipeline, running the components which do not depend on each other concurrently
+    on a `concurrent.futures` executor (a thread pool by default).
+
+    A component is started as soon as all its inputs are available. The components which depend on `__pipeline__`
+    or `__data__` (and hence may modify the pipeline or access arbitrary values) are run by the thread driving
+    the computation, when no other component is running. All the others are run on the executor
+    (when it is a process pool, their inputs and outputs must be picklable).
+
+    Components may also fan out sub-tasks via `map`: the executor is available to them as `__data__['__executor__']`
+    during the computation.
+
+    For a lean pipeline (see `Pipeline.keep`), the values other than the requested and the kept ones are freed
+    once the computation is complete.
+
+    >>> a = Pipeline()
+    >>> a.add_component('1', lambda: 1, ['a'], [])
+    >>> a.add_component('2', lambda: 2, ['b'], [])
+    >>> a.add_component('s,d', lambda x,y: (x+y, x-y), ['c', 'd'], ['a', 'b'])
+    >>> a.add_component('m', lambda x, data: list(data['__executor__'].map(lambda i: i*x, range(3))), ['m'], ['c', '__data__'])
+    >>> with PipelineExecutor(max_workers=2) as ex:
+    ...     futures = ex.submit(a, ['d', 'm'])
+    ...     futures['d'].result(), futures['m'].result(), sorted(futures)
+    (-1, [0, 3, 6], ['a', 'b', 'c', 'd', 'm'])
+    """
+
+    def __init__(self, executor=None, max_workers=None):
+        """
+        :param executor: a `concurrent.futures.Executor` to run the components on. If not given, a thread pool
+                         is created (and shut down by `shutdown`).
+        :param max_workers: the number of threads of the thread pool created when no executor is given.
+        """
+        self.owns_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(max_workers=max_workers)
+
+    def compute(self, pipeline, keys):
+        """Computes the given keys of the pipeline (storing all the computed values in it), returns the list of their values."""
+        futures = dict((k, Future()) for k in self._needed_keys(pipeline, keys))
+        self._run(pipeline, keys, futures)
+        return [futures[k].result() if k in futures else pipeline.data[k] for k in keys]
+
+    def submit(self, pipeline, keys):
+        """Starts computing the given keys of the pipeline in a background thread, returns a dictionary of `Future`s
+        for the values of all the keys to be computed (the given ones and those they depend on, unless already computed)."""
+        futures = dict((k, Future()) for k in self._needed_keys(pipeline, keys))
+        for k in keys:
+            if k not in futures:
+                futures[k] = Future()
+                futures[k].set_result(pipeline.data[k])
+        t = threading.Thread(target=self._run, args=(pipeline, keys, futures))
+        t.daemon = True
+        t.start()
+        return futures
+
+    def map(self, fn, items):
+        """Applies fn to the items concurrently (on the executor, if it is a thread pool), returns an iterator over the results
+        in order. Meant for the sub-tasks of a component: a sub-task which has not been started by the time its result
+        is needed is run by the calling thread (hence a component waiting for its sub-tasks never blocks the pool).
+        The sub-tasks which are not started yet are cancelled if the iteration is not completed."""
+        if not isinstance(self.executor, ThreadPoolExecutor):
+            return (fn(item) for item in items)
+        return _subtask_results(fn, [(self.executor.submit(fn, item), item) for item in items])
+
+    def shutdown(self):
+        if self.owns_executor:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def _needed_keys(self, pipeline, keys):
+        """The keys to be computed for the given ones (in the order of computation)."""
+        needed = []
+
+        def visit(key):
+            if key in pipeline.data or key in needed:
+                return
+            for d in pipeline.depends[pipeline.whoprovides[key]]:
+                visit(d)
+            needed.extend(p for p in pipeline.provides[pipeline.whoprovides[key]] if p not in needed)
+        for k in keys:
+            visit(k)
+        return needed
+
+    def _run(self, pipeline, keys, futures):
+        """Computes the keys, resolving the futures (all of them fail if a component fails)."""
+        data = pipeline.data
+        pending = []
+        for k in futures:
+            cname = pipeline.whoprovides.get(k)
+            if cname is not None and cname not in pending and not futures[k].done():
+                pending.append(cname)
+        running = {}
+        fingerprints = {}  # Component name -> hashes of the inputs it was started with (see `Pipeline.memoize`)
+        data['__executor__'] = self
+        pipeline._depth += 1
+        try:
+            while pending or running:
+                ready = [c for c in pending if all(d in data for d in pipeline.depends[c])]
+                for c in ready:
+                    if not _is_exclusive(pipeline.depends[c]):
+                        pending.remove(c)
+                        fingerprint = pipeline._fingerprint(c)
+                        memo = pipeline._memoized(c, fingerprint)
+                        if memo is not None:
+                            self._store(pipeline, c, memo[1], futures)
+                            continue
+                        fingerprints[c] = fingerprint
+                        inputs = [data[d] for d in pipeline.depends[c]]
+                        if pipeline.stats is None:
+                            running[self.executor.submit(pipeline.components[c], *inputs)] = c
+                        else:
+                            running[self.executor.submit(pipeline._call, c, inputs)] = c
+                if not running:
+                    if any(c not in pending for c in ready):
+                        continue  # Memoized results were stored, more components may be ready
+                    exclusive = [c for c in ready if c in pending]
+                    if not exclusive:
+                        raise Exception("Can not compute %s: missing inputs of %s" % (', '.join(keys), ', '.join(pending)))
+                    c = exclusive[0]
+                    pending.remove(c)
+                    fingerprint = pipeline._fingerprint(c)
+                    memo = pipeline._memoized(c, fingerprint)
+                    if memo is not None:
+                        self._store(pipeline, c, memo[1], futures)
+                    else:
+                        self._store(pipeline, c, pipeline._call(c, [data[d] for d in pipeline.depends[c]]), futures, fingerprint)
+                    continue
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for f in done:
+                    c = running.pop(f)
+                    self._store(pipeline, c, f.result(), futures, fingerprints.pop(c))
+        except BaseException as e:
+            for f in running:
+                f.cancel()
+            for f in futures.values():
+                if not f.done():
+                    f.set_exception(e)
+            if isinstance(e, Exception):
+                return
+            raise
+        finally:
+            pipeline._depth -= 1
+            data.pop('__executor__', None)
+        if pipeline.keep is not None and pipeline._depth == 0:
+            for k in futures:
+                if k not in keys and k not in pipeline.keep:
+                    data.pop(k, None)
+
+    def _store(self, pipeline, cname, results, futures, fingerprint=None):
+        pipeline._store(cname, results, fingerprint)
+        for k in pipeline.provides[cname]:
+            if k in futures and not futures[k].done():
+                futures[k].set_result(pipeline.data[k])
+
 
+def _subtask_results(fn, futures):
+    """See `PipelineExecutor.map`."""
+    try:
+        for future, item in futures:
+            yield fn(item) if future.cancel() else future.result()
+    finally:
+        for future, item in futures:
+            future.cancel()
+
+
+def _is_exclusive(depends):
+    return '__pipeline__' in depends or '__data__' in depends
+
+
+def _value_hash(value):
+    """A digest of the contents of a value for memoization (see `Pipeline.memoize`), None if the value can not be hashed.
+
+    >>> _value_hash(np.zeros(3)) == _value_hash(np.zeros(3)) != _value_hash(np.zeros(3, np.float32))
+    True
+    >>> _value_hash([1, 'a']) == _value_hash([1, 'a']), _value_hash(lambda: 1)
+    (True, None)
+    """
+    h = hashlib.blake2b(digest_size=20)
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        value = np.ascontiguousarray(value)
+        h.update(('%s|%s|' % (value.shape, value.dtype.str)).encode('ascii'))
+        h.update(value.reshape(-1).view(np.uint8))
+    else:
+        try:
+            h.update(pickle.dumps(value, protocol=2))
+        except Exception:
+            return None
+    return h.hexdigest()
+
+
+def _release_schedule(steps, available, keep):
+    """
+    Liveness analysis of the values computed by the given steps (tuples (name, component, depends, provides),
+    in the order of execution, with the keys in `available` present beforehand): for each step, returns the list
+    of keys which no later step uses, and can hence be freed right after it (except those in `keep` and the special
+    keys starting with '__').
+
+    Besides its inputs, a component uses the keys listed in its `__uses__` attribute: those it reads via `__pipeline__`
+    or `__data__` (including the ones needed for recomputing the values it requests, if it modifies the pipeline).
+    A component which depends on `__pipeline__` or `__data__` and has no `__uses__` is assumed to use all the values
+    computed before it.
+
+    >>> steps = [('1', None, [], ['a']), ('2', None, ['a'], ['b']), ('3', None, ['b'], ['c']), ('4', None, ['__data__'], ['d'])]
+    >>> _release_schedule(steps, [], ['d'])
+    [[], [], [], ['a', 'b', 'c']]
+    >>> _release_schedule(steps[:3], [], ['c'])
+    [[], ['a'], ['b']]
+    """
+    available = set(available)
+    last_use = {}
+    for i, (cname, component, depends, provides) in enumerate(steps):
+        uses = getattr(component, '__uses__', None)
+        if uses is None and _is_exclusive(depends):
+            uses = available
+        for k in list(depends) + list(uses or []):
+            last_use[k] = i
+        for k in provides:
+            last_use.setdefault(k, i)
+        available.update(provides)
+    release = [[] for _ in steps]
+    for k in sorted(last_use, key=lambda k: (last_use[k], k)):
+        if k not in keep and not k.startswith('__'):
+            release[last_use[k]].append(k)
+    return release
@@ -0,0 +1,25 @@
+'''
+Test module for use with py.test.
+Write each test as a function named test_<something>.
+Read more here: http://pytest.org/
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import numpy as np
+from passporteye.util.geometry import RotatedBox
+
+
+def test_extract_at_image_edge():
+    img = np.full((40, 60), 0.5)
+    img[30:, :] = 1.0
+
+    # A box sticking out of the bottom and the right edge (with the default 5px margins): the output is cut at the image border
+    roi = RotatedBox([35, 50], 30, 6, np.pi/2).extract_from_image(img)
+    assert roi.shape == (13, 30)
+    assert np.allclose(roi[:3], 0.5) and np.allclose(roi[3:], 1.0)
+
+    # The corners of a tilted box, which fall outside of the image, are not blackened
+    roi = RotatedBox([35, 30], 40, 6, np.pi/2 + 0.05).extract_from_image(img)
+    assert roi.shape[0] < 16
+    assert roi.min() > 0.49
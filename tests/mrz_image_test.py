@@ -0,0 +1,344 @@
+'''
+Test module for use with py.test.
+Write each test as a function named test_<something>.
+Read more here: http://pytest.org/
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import glob
+import os
+import threading
+import numpy as np
+import pytest
+from passporteye.util import ocr as ocr_module
+from passporteye.util.ocr import OCRBackend, OCRResult, OCRChar, OCRTimeoutError, count_ocr_call
+from passporteye.util.deadline import Deadline
+from passporteye.util.pipeline import PipelineExecutor
+from passporteye.mrz.image import BoxToMRZ, MRZBoxLocator, MRZPipeline, MRZPlan, Scaler, read_mrz
+from passporteye.mrz.ocrb import OCRBBackend, OCRBRecognizer
+
+TESTDATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'passporteye', 'mrz', 'testdata')
+
+MRZ_LINES = ['P<POLKOWALSKA<KWIATKOWSKA<<JOANNA<<<<<<<<<<<', 'AA00000000POL6002084F1412314<<<<<<<<<<<<<<<4']
+
+
+class FakeBackend(OCRBackend):
+    """Misreads a character of the second line of the full ROI (with low confidence), but reads its region correctly."""
+
+    def __init__(self):
+        self.shapes = []
+
+    def __call__(self, img, mrz_mode=True, timeout=None):
+        self.shapes.append(img.shape)
+        return MRZ_LINES[1] if img.shape[1] > 10*img.shape[0] else '\n'.join(MRZ_LINES).replace('F1412', 'F1415')
+
+    def detailed(self, img, mrz_mode=True, timeout=None):
+        lines = self(img, mrz_mode).split('\n')
+        return OCRResult([[OCRChar(c, (10*j, 20*i + 10, 10*j + 10, 20*i + 25), 95.0 if i == 0 else 40.0)
+                           for j, c in enumerate(ln)] for i, ln in enumerate(lines)])
+
+
+def test_line_retries():
+    old_backend = ocr_module.get_backend()
+    try:
+        backend = FakeBackend()
+        ocr_module.set_backend(backend)
+        roi, text, mrz = BoxToMRZ(line_retries=True).recognize(np.random.RandomState(0).rand(60, 460))
+        assert mrz.valid and text == '\n'.join(MRZ_LINES)
+        assert mrz.aux['method'] == 'line_retry(1:rescaled(3))'
+        # Only the region of the doubtful line was OCR-ed again
+        assert len(backend.shapes) == 2 and backend.shapes[1][1] > 10*backend.shapes[1][0]
+
+        backend.shapes = []
+        roi, text, mrz = BoxToMRZ().recognize(np.random.RandomState(0).rand(60, 460))
+        assert backend.shapes[1] == (60*2, 460*2)
+    finally:
+        ocr_module.set_backend(old_backend)
+
+
+class FakeClock(object):
+    """A clock, which only advances when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SlowBackend(OCRBackend):
+    """Takes 0.2 seconds (of the given clock) per call, respecting the timeout, and never gives a valid MRZ."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.timeouts = []
+
+    def __call__(self, img, mrz_mode=True, timeout=None):
+        self.timeouts.append(timeout)
+        if timeout is not None and timeout < 0.2:
+            self.clock.now += timeout
+            raise OCRTimeoutError()
+        self.clock.now += 0.2
+        return '\n'.join(MRZ_LINES).replace('F1412', 'F1415')
+
+
+def test_time_budget():
+    old_backend = ocr_module.get_backend()
+    try:
+        clock = FakeClock()
+        backend = SlowBackend(clock)
+        ocr_module.set_backend(backend)
+        roi, text, mrz = BoxToMRZ(line_retries=False, deadline=Deadline(0.3, clock=clock)).recognize(np.zeros((60, 800)))
+        # The first applicable fallback variant is cut off at the deadline, the remaining ones are skipped
+        assert np.allclose(backend.timeouts, [0.3, 0.1]) and np.isclose(clock.now, 0.3)
+        assert not mrz.valid and mrz.aux['budget_exhausted']
+        assert mrz.aux['method'] == 'direct'
+    finally:
+        ocr_module.set_backend(old_backend)
+
+
+class VariantBackend(OCRBackend):
+    """Reads the black top-hat variant of the ROI correctly, the enlarged variants incorrectly and only once released."""
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.enlarged = []  # The enlarged variants OCR-ed (completely)
+
+    def __call__(self, img, mrz_mode=True, timeout=None):
+        if img.shape[1] > 460:
+            self.released.wait(10)
+            self.enlarged.append(img.shape)
+        elif img.min() == 0:
+            return '\n'.join(MRZ_LINES)
+        return '\n'.join(MRZ_LINES).replace('F1412', 'F1415')
+
+
+def test_speculative():
+    old_backend = ocr_module.get_backend()
+    backend = VariantBackend()
+    try:
+        ocr_module.set_backend(backend)
+        roi = np.random.RandomState(0).rand(60, 460) + 0.1
+        roi, text, mrz = BoxToMRZ(line_retries=False, speculative=True).recognize(roi)
+        assert mrz.valid and mrz.aux['method'] == 'black_tophat'
+        # The result did not wait for the (preceding) enlarged variants
+        assert backend.enlarged == []
+    finally:
+        backend.released.set()
+        ocr_module.set_backend(old_backend)
+
+
+def test_scheduler():
+    from passporteye.mrz.scheduler import StrategyScheduler
+    old_backend = ocr_module.get_backend()
+    backend = VariantBackend()
+    backend.released.set()
+    try:
+        ocr_module.set_backend(backend)
+        scheduler = StrategyScheduler()
+        scheduler.merge({'black_tophat': {'attempts': 10, 'successes': 9, 'cost': 1.0}})
+        roi = np.random.RandomState(0).rand(60, 460) + 0.1
+        roi, text, mrz = BoxToMRZ(line_retries=False, scheduler=scheduler).recognize(roi)
+        assert mrz.valid and mrz.aux['method'] == 'black_tophat'
+        # The variant with the best record was tried first, the enlarged ones were not tried at all
+        assert backend.enlarged == []
+        assert scheduler.recorded['black_tophat']['successes'] == 1 and list(scheduler.recorded) == ['black_tophat']
+    finally:
+        ocr_module.set_backend(old_backend)
+
+
+def test_lazy_decode(tmpdir):
+    from PIL import Image
+    from passporteye.mrz.image import Loader, Scaler
+    fn = str(tmpdir.join('img.jpg'))
+    Image.fromarray((np.random.RandomState(0).rand(300, 1200)*255).astype(np.uint8)).save(fn)
+    img = Loader(fn, lazy=True)()
+    assert img.shape == (300, 1200) and not img.loaded
+    img_small, scale_factor = Scaler()(img)
+    assert img_small.shape == (62, 250) and scale_factor == 250/1200.0
+    assert not img.loaded
+    assert np.allclose(np.asarray(img), Loader(fn)()) and img.loaded
+
+    # A color image is converted to grayscale in the same way from the reduced-resolution decode
+    y, x = np.mgrid[:300, :1200]
+    Image.fromarray(np.dstack([x*255//1200, y*255//300, 255 - x*255//1200]).astype(np.uint8)).save(fn)
+    img_small, _ = Scaler()(Loader(fn, lazy=True)())
+    img_small_full, _ = Scaler()(Loader(fn)())
+    assert img_small.shape == img_small_full.shape == (62, 250)
+    assert np.allclose(img_small[1:-1, 1:-1], img_small_full[1:-1, 1:-1], atol=0.01)
+
+
+def test_loader_inputs():
+    import os
+    from io import BytesIO
+    from passporteye.mrz.image import Loader
+    for fn in ['pacman.jpg', 'pdf-with-jpg.pdf']:
+        fn = os.path.join(os.path.dirname(__file__), 'data', fn)
+        img = Loader(fn)()
+        with open(fn, 'rb') as f:
+            data = f.read()
+        for src in [data, bytearray(data), memoryview(data), BytesIO(data)]:
+            assert np.array_equal(Loader(src)(), img)
+    assert Loader(np.zeros((4, 6, 3)))().shape == (4, 6)
+
+
+def test_iter_images(tmpdir):
+    import os
+    from PIL import Image
+    from passporteye.mrz.image import iter_images
+    fn = str(tmpdir.join('img.tif'))
+    frames = [Image.fromarray(np.full((10, 20 + i), i, np.uint8)) for i in range(3)]
+    frames[0].save(fn, save_all=True, append_images=frames[1:])
+    assert [img.shape for img in iter_images(fn)] == [(10, 20), (10, 21), (10, 22)]
+    assert len(list(iter_images(fn, max_pages=2))) == 2
+    imgs = list(iter_images(os.path.join(os.path.dirname(__file__), 'data', 'pdf-with-pngjpg.pdf')))
+    assert imgs[0].shape == (133, 200, 3) and imgs[1].startswith(b'\xff\xd8')
+
+
+def test_pyramid_scaler():
+    from passporteye.mrz.image import ImagePyramid, PyramidScaler, Scaler
+    img = np.random.RandomState(0).rand(700, 2100)
+    pyramid = ImagePyramid(img)
+    for max_width in [250, 1000]:
+        img_small, scale_factor = PyramidScaler(max_width)(pyramid)
+        ref_small, ref_scale_factor = Scaler(max_width)(img)
+        assert img_small.shape == ref_small.shape and img_small.dtype == ref_small.dtype
+        assert abs(scale_factor - ref_scale_factor) < 1e-3
+    assert sorted(pyramid._levels) == [1, 2]
+    assert PyramidScaler(3000)(pyramid)[1] == 1.0
+
+
+def test_component_box_locator():
+    from passporteye.mrz.image import ComponentBoxLocator
+    img = np.zeros((120, 300), bool)
+    img[40:52, 20:280] = True                                   # A horizontal MRZ-like line
+    rr, cc = np.mgrid[0:120, 0:300]
+    img |= (np.abs((rr - 90) - 0.1*(cc - 150)) < 4) & (np.abs(cc - 150) < 100)  # A slightly tilted one
+    img |= np.random.RandomState(0).rand(120, 300) < 0.01     # Speckles, filtered out by area
+    boxes = ComponentBoxLocator()(img)
+    assert len(boxes) == 2
+    # The speckles touching the lines may enlarge their boxes a bit (and the angles of pi/2 and -pi/2 are equivalent)
+    assert np.allclose(boxes[0].center, [45.5, 149.5], atol=1) and abs(boxes[0].width - 260) <= 2
+    assert 12 <= boxes[0].height <= 15 and abs(np.cos(boxes[0].angle)) < 0.01
+    assert np.allclose(boxes[1].center, [90, 149.5], atol=1) and abs(np.cos(boxes[1].angle - np.pi/2 + np.arctan(0.1))) > 0.9995
+
+
+def test_merge_boxes():
+    from passporteye.mrz.image import MRZBoxLocator
+    from passporteye.util.geometry import RotatedBox
+
+    def box(cx, cy, width, height, angle=np.pi/2):
+        b = RotatedBox([cx, cy], width, height, angle)
+        b.points = b.as_poly()
+        return b
+    locator = MRZBoxLocator()
+    lines = [box(100, 150, 250, 10), box(120, 151, 240, 10), box(140, 150, 255, 10)]
+    other = box(300, 150, 100, 10, 0.3)
+    merged = locator._merge_boxes(lines + [other])
+    assert len(merged) == 2 and merged[0] is other
+    assert merged[1].approx_equal([120, 150], 255, 50, np.pi/2, tol=1e-3)
+    # When the whole cluster does not fit in an elongated box, the boxes are merged pairwise (here - not at all)
+    short = [box(100, 150, 60, 10), box(120, 150, 60, 10), box(140, 150, 60, 10)]
+    assert len(locator._merge_boxes(list(short))) == 3
+
+
+@pytest.fixture
+def template_ocr():
+    """Selects the OCR-B template recognizer (accepting all its results, even the ambiguous ones, without a fallback)
+    as the OCR backend for the duration of a test, so that the recognition is fast and deterministic."""
+    old_backend = ocr_module.get_backend()
+    backend = OCRBBackend(OCRBRecognizer(min_margin=-np.inf), fallback=lambda img, mrz_mode: '', min_score=-1)
+    ocr_module.set_backend(backend)
+    yield backend
+    ocr_module.set_backend(old_backend)
+
+
+def test_mrz_plan(template_ocr):
+    plan = MRZPlan()
+    for fn in sorted(glob.glob(os.path.join(TESTDATA_DIR, '*.jpg')))[:4]:
+        mrz, ref = plan(fn, save_roi=True), read_mrz(fn, save_roi=True)
+        assert (mrz is None) == (ref is None)
+        if mrz is not None:
+            assert mrz.to_dict() == ref.to_dict() and np.array_equal(mrz.aux['roi'], ref.aux['roi'])
+    assert plan.plan.steps[0][:2] == ('scaler', plan.pipeline.components['scaler'])
+
+
+def test_instrumentation(template_ocr):
+    fn = os.path.join(TESTDATA_DIR, '100_pass-chn.jpg')
+    for mrz in [read_mrz(fn, instrument=True), MRZPlan(instrument=True)(fn)]:
+        stats = mrz.aux['stats']
+        assert {'scaler', 'boone', 'box_locator', 'mrz', 'other_max_width'} <= set(stats)
+        assert stats['mrz']['ocr_calls'] >= 1 and stats['boone']['ocr_calls'] == 0
+        assert all(st['calls'] == 1 and st['wall_time'] >= 0 and st['peak_memory'] is None for st in stats.values())
+    assert 'stats' not in read_mrz(fn).aux
+    # The OCR calls of other threads are not charged to the components, also when these run concurrently
+    ref = read_mrz(fn, instrument=True).aux['stats']
+    stop = threading.Event()
+    noise = threading.Thread(target=lambda: [count_ocr_call() for _ in iter(stop.is_set, True)])
+    noise.start()
+    try:
+        with PipelineExecutor(max_workers=4) as executor:
+            stats = read_mrz(fn, instrument=True, executor=executor).aux['stats']
+    finally:
+        stop.set()
+        noise.join()
+    assert dict((c, st['ocr_calls']) for c, st in stats.items()) == dict((c, st['ocr_calls']) for c, st in ref.items())
+
+
+def test_fast_boone():
+    from passporteye.mrz.image import BooneTransform, FastBooneTransform
+    assert type(MRZPipeline(None).components['boone']) is BooneTransform
+    fn = os.path.join(TESTDATA_DIR, '100_id-mac.jpg')
+    p, fast = MRZPipeline(fn), MRZPipeline(fn, fast_boone=True)
+    assert type(fast.components['boone']) is FastBooneTransform
+    for n in [1, 3, 5, 7]:
+        assert np.array_equal(FastBooneTransform(n)(p['img_small']), BooneTransform(n)(p['img_small']))
+    assert np.array_equal(fast['img_binary'], p['img_binary'])
+
+
+def test_pipeline_executor(template_ocr):
+    with PipelineExecutor(max_workers=4) as executor:
+        plan = MRZPlan(executor=executor)
+        for fn in sorted(glob.glob(os.path.join(TESTDATA_DIR, '*.jpg')))[:6]:
+            ref = read_mrz(fn)
+            for mrz in [read_mrz(fn, executor=executor), plan(fn)]:
+                assert (mrz is None) == (ref is None)
+                if mrz is not None:
+                    assert mrz.to_dict() == ref.to_dict() and mrz.aux.get('method') == ref.aux.get('method')
+
+
+def test_lean_pipeline(template_ocr):
+    plan = MRZPlan(lean=True)
+    with PipelineExecutor(max_workers=2) as executor:
+        for fn in sorted(glob.glob(os.path.join(TESTDATA_DIR, '*.jpg')))[:6] + [np.ones((400, 600))]:
+            ref = read_mrz(fn, save_roi=True)
+            for mrz in [read_mrz(fn, save_roi=True, lean=True), read_mrz(fn, save_roi=True, lean=True, executor=executor),
+                        plan(fn, save_roi=True)]:
+                assert (mrz is None) == (ref is None)
+                if mrz is not None:
+                    assert mrz.to_dict() == ref.to_dict() and np.all(mrz.aux['roi'] == ref.aux['roi'])
+            # Only the result (and the kept values) remain, the debug information is not stored
+            p = MRZPipeline(fn, lean=True, keep=['boxes'])
+            p.result
+            assert sorted(k for k in p.data if k not in ('__data__', '__pipeline__')) == ['boxes', 'mrz_final']
+
+
+def test_memoized_pipeline(template_ocr):
+    fn = os.path.join(TESTDATA_DIR, '100_id-mac.jpg')
+    with PipelineExecutor(max_workers=2) as executor:
+        for ex in [None, executor]:
+            p = MRZPipeline(fn, instrument=True, executor=ex)
+            p.memoize()
+            ref = p.result
+            # An equivalent scaler gives the same img_small, hence the transform, the box locator and the OCR are not rerun
+            p.replace_component('scaler', Scaler())
+            mrz = p.result
+            assert mrz.to_dict() == ref.to_dict()
+            calls = dict((k, st['calls']) for k, st in p.stats.items())
+            assert calls['scaler'] == 2 and calls['boone'] == 1 and calls['box_locator'] == 1 and calls['mrz'] == 1
+            assert p.stats['mrz']['ocr_calls'] > 0
+            # A box locator with other parameters is rerun, along with what depends on the boxes
+            p.replace_component('box_locator', MRZBoxLocator(max_boxes=1))
+            p.result
+            assert p.stats['box_locator']['calls'] == 2 and p.stats['boone']['calls'] == 1
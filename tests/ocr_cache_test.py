@@ -0,0 +1,52 @@
+'''
+Test module for use with py.test.
+Write each test as a function named test_<something>.
+Read more here: http://pytest.org/
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import numpy as np
+from passporteye.util import ocr as ocr_module
+from passporteye.util.ocr_cache import OCRCache, SQLiteOCRStore
+
+
+def test_ocr_cache(tmpdir):
+    calls = []
+    old_backend, old_cache = ocr_module.get_backend(), ocr_module.get_cache()
+    try:
+        ocr_module.set_backend(lambda img, mrz_mode: calls.append(img.shape) or '%dx%d' % img.shape)
+        store = SQLiteOCRStore(str(tmpdir.join('ocr.sqlite')))
+        ocr_module.set_cache(OCRCache(maxsize=1, store=store))
+        a, b = np.zeros((2, 3)), np.ones((4, 5))
+        assert [ocr_module.ocr(x) for x in [a, a, b, a]] == ['2x3', '2x3', '4x5', '2x3']
+        assert calls == [(2, 3), (4, 5)]
+        assert ocr_module.get_cache().stats['hits'] == 2 and ocr_module.get_cache().stats['misses'] == 2
+
+        # A fresh cache with the same store does not need to recompute anything
+        ocr_module.set_cache(OCRCache(store=store))
+        assert ocr_module.ocr(b) == '4x5' and len(calls) == 2
+    finally:
+        ocr_module.set_backend(old_backend)
+        ocr_module.set_cache(old_cache)
+
+
+def _other_backend(img, mrz_mode=True):
+    return 'other'
+
+
+def test_ocr_cache_backend_identity():
+    old_backend, old_cache = ocr_module.get_backend(), ocr_module.get_cache()
+    try:
+        ocr_module.set_cache(OCRCache())
+        img = np.zeros((2, 3))
+        ocr_module.set_backend(lambda img, mrz_mode: '%dx%d' % img.shape)
+        assert ocr_module.ocr(img) == '2x3'
+        # The results of a different backend are not mixed with the cached ones
+        ocr_module.set_backend(_other_backend)
+        assert ocr_module.ocr(img) == 'other'
+        assert ocr_module.ocr_batch([img, np.ones((2, 3))]) == ['other', 'other']
+        assert ocr_module.get_cache().stats['hits'] == 1
+    finally:
+        ocr_module.set_backend(old_backend)
+        ocr_module.set_cache(old_cache)
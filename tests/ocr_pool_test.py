@@ -0,0 +1,93 @@
+'''
+Test module for use with py.test.
+Write each test as a function named test_<something>.
+Read more here: http://pytest.org/
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import os
+import time
+import numpy as np
+import pytest
+from passporteye.util import ocr as ocr_module
+from passporteye.util.ocr import OCRTimeoutError, OCRWorkerError
+from passporteye.util.ocr_cache import OCRCache, SQLiteOCRStore
+from passporteye.util.ocr_pool import OCRWorkerPool
+
+
+def _fake_backend(img, mrz_mode=True):
+    """Pretends to recognize the image, sleeping or crashing the worker depending on the value of its first pixel"""
+    if img[0, 0] == 1:
+        time.sleep(10)
+    elif img[0, 0] == 2:
+        os._exit(1)
+    return '%dx%d %d' % (img.shape[0], img.shape[1], os.getpid())
+
+
+def _cache_reporting_backend(img, mrz_mode=True):
+    """Reports whether the worker has an OCR cache"""
+    return 'cache' if ocr_module.get_cache() is not None else 'no cache'
+
+
+def test_ocr_pool():
+    imgs = [np.zeros((i + 1, 3), dtype=np.uint8) for i in range(6)]
+    with OCRWorkerPool(size=2, timeout=2, backend=_fake_backend) as pool:
+        results = pool.map(imgs)
+        assert [r.split()[0] for r in results] == ['%dx3' % (i + 1) for i in range(6)]
+        # The workers are long-lived
+        assert len(set(r.split()[1] for r in results)) <= 2
+
+        with pytest.raises(OCRTimeoutError):
+            pool(np.ones((1, 1), dtype=np.uint8))
+        assert pool(np.zeros((2, 2), dtype=np.uint8)).startswith('2x2')
+
+        # Crashed workers are restarted
+        with pytest.raises(OCRWorkerError):
+            pool(2*np.ones((1, 1), dtype=np.uint8))
+        assert pool(np.zeros((3, 3), dtype=np.uint8)).startswith('3x3')
+
+
+def test_ocr_pool_worker_start_failure():
+    # Lambdas can not be pickled, hence the workers fail to start with the 'spawn' method
+    with OCRWorkerPool(size=1, backend=lambda img, mrz_mode=True: '', start_method='spawn') as pool:
+        for i in range(2):
+            with pytest.raises(OCRWorkerError):
+                pool.submit(np.zeros((1, 1), dtype=np.uint8)).result(timeout=10)
+
+
+def test_ocr_pool_cache(tmpdir):
+    old_cache = ocr_module.get_cache()
+    try:
+        ocr_module.set_cache(OCRCache(store=SQLiteOCRStore(str(tmpdir.join('ocr.sqlite')))))
+        with OCRWorkerPool(size=1, timeout=10, backend=_cache_reporting_backend, start_method='fork') as pool:
+            # The forked workers do not use the cache (nor the SQLite connection) inherited from the parent,
+            # it is consulted by the pool in the parent process
+            assert pool(np.zeros((1, 1), dtype=np.uint8)) == 'no cache'
+            assert pool(np.zeros((1, 1), dtype=np.uint8)) == 'no cache'
+            assert ocr_module.get_cache().stats['hits'] == 1
+    finally:
+        ocr_module.set_cache(old_cache)
+
+
+def test_ocr_pool_batch():
+    imgs = [np.zeros((i + 1, 3), dtype=np.uint8) for i in range(5)]
+    old_backend, old_cache = ocr_module.get_backend(), ocr_module.get_cache()
+    try:
+        with OCRWorkerPool(size=2, timeout=10, backend=_fake_backend) as pool:
+            ocr_module.set_backend(pool)
+            ocr_module.set_cache(OCRCache())
+            assert ocr_module.ocr(imgs[0]).startswith('1x3')
+            calls = ocr_module.ocr_call_count()
+            results = ocr_module.ocr_batch(imgs)
+            assert [r.split()[0] for r in results] == ['%dx3' % (i + 1) for i in range(5)]
+            # The cached image is not sent, the rest is split into a chunk per worker
+            assert results[0] == ocr_module.ocr(imgs[0])
+            assert ocr_module.ocr_call_count() - calls == 2
+            assert [r.text.split()[0] for r in ocr_module.ocr_batch(imgs[:2], detailed=True)] == ['1x3', '2x3']
+            # The workers' backend can not report text positions
+            with pytest.raises(NotImplementedError):
+                pool.tsv(imgs[0])
+    finally:
+        ocr_module.set_backend(old_backend)
+        ocr_module.set_cache(old_cache)
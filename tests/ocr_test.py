@@ -24,4 +24,98 @@ def test_ocr():
     assert s.endswith('The quick\nbrown dog jumped over the lazy fox.')
 
     s = ocr_file('tesseract-test1.jpg', True)
-    assert s.startswith('T116 10111610 1111011111 110111') or s.startswith('T116 111111610 1111011111 110111')
\ No newline at end of file
+    assert s.startswith('T116 10111610 1111011111 110111') or s.startswith('T116 111111610 1111011111 110111')
+
+def test_ocr_backend():
+    from passporteye.util import ocr as ocr_module
+    old_backend = ocr_module.get_backend()
+    calls = []
+    try:
+        ocr_module.set_backend(lambda img, mrz_mode: calls.append((img.shape, mrz_mode)) or 'TEXT')
+        assert ocr(imread(resource_filename('tests', 'data/tesseract-test2.png'))) == 'TEXT'
+        assert len(calls) == 1 and calls[0][1]
+    finally:
+        ocr_module.set_backend(old_backend)
+
+
+def test_pipe_backend(tmpdir):
+    import sys, numpy as np
+    from passporteye.util.ocr import TesseractPipeBackend
+    # A fake "tesseract" which reports the PGM header it received via stdin and its command line
+    fake_tesseract = tmpdir.join('tesseract')
+    fake_tesseract.write('#!%s\nimport sys\nhdr = sys.stdin.buffer.read().split(b"\\n")[:3]\n'
+                         'print(b" ".join(hdr).decode(), " ".join(sys.argv[1:4]))\n' % sys.executable)
+    fake_tesseract.chmod(0o755)
+    backend = TesseractPipeBackend(str(fake_tesseract))
+    assert backend(np.zeros((3, 5))) == 'P5 5 3 255 stdin stdout --psm'
+    assert backend(np.zeros((3, 5)), mrz_mode=False) == 'P5 5 3 255 stdin stdout'
+
+
+def test_ocr_batch():
+    import numpy as np
+    from passporteye.util import ocr as ocr_module
+    old_backend = ocr_module.get_backend()
+    try:
+        # Backends which do not report text positions recognize the images one by one
+        ocr_module.set_backend(lambda img, mrz_mode: '%dx%d' % img.shape)
+        assert ocr_module.ocr_batch([np.zeros((2, 3)), np.zeros((4, 5))]) == ['2x3', '4x5']
+    finally:
+        ocr_module.set_backend(old_backend)
+
+
+def test_ocr_batch_detailed():
+    import numpy as np
+    from passporteye.util import ocr as ocr_module
+    header = 'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n'
+
+    class FakeBackend(ocr_module.OCRBackend):
+        # Reports one word per band of the canvas, at the position where tile_images puts the image
+        def tsv(self, img, mrz_mode=True):
+            return header + '5\t1\t1\t1\t1\t1\t10\t10\t4\t2\t90\tAB\n' + '5\t1\t1\t1\t2\t1\t10\t32\t4\t4\t50\tCD\n'
+
+    old_backend = ocr_module.get_backend()
+    try:
+        ocr_module.set_backend(FakeBackend())
+        r1, r2 = ocr_module.ocr_batch([np.zeros((2, 3)), np.zeros((4, 5))], detailed=True)
+        assert r1.text == 'AB' and r2.text == 'CD'
+        assert r1.line_box(0) == (0, 0, 4, 2) and r1.line_confidence(0) == 90
+        assert r2.line_box(0) == (0, 0, 4, 4) and r2.line_confidence(0) == 50
+    finally:
+        ocr_module.set_backend(old_backend)
+
+
+def test_pipe_backend_timeout(tmpdir):
+    import sys, time, numpy as np, pytest
+    from passporteye.util.ocr import TesseractPipeBackend, OCRTimeoutError
+    fake_tesseract = tmpdir.join('tesseract')
+    fake_tesseract.write('#!%s\nimport time\ntime.sleep(10)\n' % sys.executable)
+    fake_tesseract.chmod(0o755)
+    tic = time.time()
+    with pytest.raises(OCRTimeoutError):
+        TesseractPipeBackend(str(fake_tesseract), timeout=0.5)(np.zeros((3, 5)))
+    with pytest.raises(OCRTimeoutError):
+        TesseractPipeBackend(str(fake_tesseract))(np.zeros((3, 5)), timeout=0.5)
+    assert time.time() - tic < 5
+
+
+def test_auto_backend_version(tmpdir):
+    import sys, pytest
+    from pytesseract import pytesseract
+    from passporteye.util import ocr as ocr_module
+    try:
+        import tesserocr
+        pytest.skip("tesserocr is installed, hence 'auto' does not run the tesseract tool")
+    except ImportError:
+        pass
+    old_cmd = pytesseract.tesseract_cmd
+    try:
+        for version, backend_class in [('3.05.02', ocr_module.TesseractCmdBackend), ('4.1.1', ocr_module.TesseractPipeBackend)]:
+            # A fake "tesseract" which only reports its version (on stderr, as Tesseract 3 does)
+            fake_tesseract = tmpdir.join('tesseract-%s' % version)
+            fake_tesseract.write('#!%s\nimport sys\nsys.stderr.write("tesseract %s\\n leptonica-1.74.1\\n")\n'
+                                 % (sys.executable, version))
+            fake_tesseract.chmod(0o755)
+            pytesseract.tesseract_cmd = str(fake_tesseract)
+            assert type(ocr_module.make_backend('auto')) is backend_class
+    finally:
+        pytesseract.tesseract_cmd = old_cmd
@@ -0,0 +1,82 @@
+'''
+Test module for use with py.test.
+Write each test as a function named test_<something>.
+Read more here: http://pytest.org/
+
+Author: Konstantin Tretyakov
+License: MIT
+'''
+import os
+import matplotlib
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from passporteye.util.ocr import ocr_call_count
+from passporteye.mrz.ocrb import OCRBRecognizer, OCRBBackend
+
+
+def _toy_roi(text):
+    """A toy "font" with glyphs for '1' and '<' only."""
+    glyphs = {'1': np.array([[0, 0, 1, 0, 0]]*7),
+              '<': np.array([[0, 0, 0, 0, 1], [0, 0, 0, 1, 0], [0, 0, 1, 0, 0], [0, 1, 0, 0, 0],
+                             [0, 0, 1, 0, 0], [0, 0, 0, 1, 0], [0, 0, 0, 0, 1]])}
+    line = np.hstack([np.pad(glyphs[c], 1, 'constant') for c in text])
+    return 1.0 - np.pad(line, 3, 'constant')
+
+
+def test_ocrb_recognizer():
+    r = OCRBRecognizer(templates=None)
+    r.fit([_toy_roi('<1'), _toy_roi('1<')], ['<1', '1<'])
+    text, scores = r(_toy_roi('11<'))
+    assert text == '11<'
+    assert [s.round(2).tolist() for s in scores] == [[1.0, 1.0, 1.0]]
+
+
+def test_ocrb_backend():
+    r = OCRBRecognizer(templates=None, line_lengths=[])
+    r.fit([_toy_roi('<1'), _toy_roi('1<')], ['<1', '1<'])
+    calls = []
+    backend = OCRBBackend(r, fallback=lambda img, mrz_mode: calls.append(mrz_mode) or 'FALLBACK')
+    n_calls = ocr_call_count()
+    assert backend(_toy_roi('1<<1')) == '1<<1'
+    assert backend(_toy_roi('1<<1'), mrz_mode=False) == 'FALLBACK'
+    assert backend(np.ones((20, 20))) == 'FALLBACK'
+    assert calls == [False, True]
+    # Each request counts as one OCR call, whether or not the fallback is used
+    assert ocr_call_count() - n_calls == 3
+
+
+def test_ocrb_bundled_templates():
+    r = OCRBRecognizer()
+    assert set(r.labels) >= set('0123456789<OQ')
+    assert r.templates.shape == (len(r.labels), np.prod(OCRBRecognizer.GLYPH_SHAPE))
+
+
+def test_ocrb_ambiguous():
+    r = OCRBRecognizer(templates=None, line_lengths=[], min_margin=2.0)
+    r.fit([_toy_roi('<1'), _toy_roi('1<')], ['<1', '1<'])
+    assert r.recognize(_toy_roi('1<<1'), ambiguous=True)[1] == []
+    # Pretend that '1' and '<' are confusable, the margin of 2 can never be reached
+    r.CONFUSABLE = ['1<']
+    result, lines = r.recognize(_toy_roi('1<<1'), ambiguous=True)
+    assert result.text == '1<<1' and lines == [0]
+    backend = OCRBBackend(r, fallback=lambda img, mrz_mode: 'FALLBACK', min_score=-1)
+    assert backend(_toy_roi('1<<1')) == 'FALLBACK'
+    assert backend.detailed(_toy_roi('1<<1')).text == 'FALLBACK'
+
+
+def test_ocrb_fit_font():
+    font_file = os.path.join(os.path.dirname(matplotlib.__file__), 'mpl-data', 'fonts', 'ttf', 'DejaVuSansMono.ttf')
+    r = OCRBRecognizer(templates=None)
+    r.fit_font(font_file, font_sizes=[32])
+    assert ''.join(sorted(r.labels)) == '0123456789<>ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    # A line rendered at another size is recognized
+    text = 'P<UTOERIKSSON<<ANNA<MARIA<<<<<<<<<<<<<<<<<<<'
+    font = ImageFont.truetype(font_file, 28)
+    img = Image.new('L', (font.getbbox(text)[2] + 28, 56), 255)
+    ImageDraw.Draw(img).text((14, 14), text, font=font, fill=0)
+    assert r(np.asarray(img) / 255.0)[0] == text
+
+
+def test_ocrb_backend_opt_in():
+    from passporteye.util.ocr import make_backend
+    assert not isinstance(make_backend('auto'), OCRBBackend)
@@ -7,8 +7,9 @@ Author: Konstantin Tretyakov
 License: MIT
 '''
 from pkg_resources import resource_filename
-from passporteye.util.pdf import extract_first_jpeg_in_pdf
-import sys
+from passporteye.util.pdf import extract_first_jpeg_in_pdf, iter_pdf_images, PDFReader, _find_first_jpeg_fast
+from io import BytesIO
+import sys, struct, zlib
 
 # Smoke test for "extract_first_jpeg_in_pdf"
 def test_extract_jpeg():
@@ -18,4 +19,90 @@ def test_extract_jpeg():
                           ('pdf-with-none.pdf',False)]:
         with open(resource_filename('tests', 'data/%s' % fn), 'rb') as f:
             img = extract_first_jpeg_in_pdf(f)
-            assert (len(img) == 5805 or len(img) == 5804) if has_image else (img is None)
\ No newline at end of file
+            assert (len(img) == 5805 or len(img) == 5804) if has_image else (img is None)
+
+def test_extract_jpeg_fast_path():
+    for fn in ['pdf-with-jpg.pdf', 'pdf-with-png.pdf', 'pdf-with-pngjpg.pdf', 'pdf-with-none.pdf']:
+        with open(resource_filename('tests', 'data/%s' % fn), 'rb') as f:
+            data = f.read()
+        assert _find_first_jpeg_fast(data) == extract_first_jpeg_in_pdf(BytesIO(data), fast=False)
+
+
+def make_pdf(jpeg, n_pages=3, image_page=2, xref_stream=False):
+    """Makes a PDF with the JPEG on the given page. With xref_stream, the page tree is stored in an object stream,
+    indexed by a cross-reference stream (with the PNG Up predictor)."""
+    objs = {1: b'<< /Type /Catalog /Pages 2 0 R >>',
+            2: b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % (3 + i) for i in range(n_pages)), n_pages)}
+    img_num = 3 + n_pages
+    for i in range(n_pages):
+        objs[3 + i] = b'<< /Type /Page /Parent 2 0 R /Resources << %s >> >>' % (b'/XObject << /Im0 %d 0 R >>' % img_num if i == image_page else b'')
+    out, offsets = bytearray(b'%PDF-1.5\n'), {}
+
+    def add(num, body, data=None):
+        offsets[num] = len(out)
+        if data is not None:
+            body = body[:-2] + b'/Length %d >>\nstream\n%s\nendstream' % (len(data), data)
+        out.extend(b'%d 0 obj\n%s\nendobj\n' % (num, body))
+
+    add(img_num, b'<< /Type /XObject /Subtype /Image /Filter /DCTDecode >>', jpeg)
+    if not xref_stream:
+        for num in sorted(objs):
+            add(num, objs[num])
+        xref = len(out)
+        out.extend(b'xref\n0 %d\n0000000000 65535 f \n' % (img_num + 1))
+        out.extend(b''.join(b'%010d 00000 n \n' % offsets[num] for num in range(1, img_num + 1)))
+        out.extend(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (img_num + 1, xref))
+        return bytes(out)
+    header = b' '.join(b'%d %d' % (num, sum(len(objs[n]) + 1 for n in range(1, num))) for num in sorted(objs)) + b'\n'
+    add(img_num + 1, b'<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode >>' % (len(objs), len(header)),
+        zlib.compress(header + b''.join(objs[num] + b'\n' for num in sorted(objs))))
+    entries = [(0, 0, 65535)] + [(2, img_num + 1, i) for i in range(len(objs))] + \
+              [(1, offsets[img_num], 0), (1, offsets[img_num + 1], 0), (1, len(out), 0)]
+    rows = [struct.pack('>BIH', *e) for e in entries]
+    data = b''.join(b'\x02' + bytes((a - b) & 0xff for a, b in zip(row, prev))
+                    for row, prev in zip(rows, [bytes(7)] + rows[:-1]))
+    xref = len(out)
+    add(img_num + 2, b'<< /Type /XRef /Size %d /W [1 4 2] /Root 1 0 R /Filter /FlateDecode '
+                     b'/DecodeParms << /Predictor 12 /Columns 7 >> >>' % (img_num + 3), zlib.compress(data))
+    out.extend(b'startxref\n%d\n%%%%EOF\n' % xref)
+    return bytes(out)
+
+
+def test_pdf_reader():
+    with open(resource_filename('tests', 'data/pacman.jpg'), 'rb') as f:
+        jpeg = f.read()
+    for xref_stream in [False, True]:
+        pdf = make_pdf(jpeg, xref_stream=xref_stream)
+        assert _find_first_jpeg_fast(pdf) == jpeg
+        assert _find_first_jpeg_fast(pdf, max_pages=2) is None
+        assert len(list(PDFReader(pdf).pages())) == 3
+        # Damaged xref
+        assert _find_first_jpeg_fast(pdf.replace(b'startxref\n', b'startxref\n1')) == jpeg
+
+
+def test_iter_pdf_images():
+    from skimage import io
+    with open(resource_filename('tests', 'data/pdf-with-png.pdf'), 'rb') as f:
+        img, = list(iter_pdf_images(f))
+    assert (img == io.imread(resource_filename('tests', 'data/pacman.png'))[:, :, :3]).all()
+    with open(resource_filename('tests', 'data/pacman.jpg'), 'rb') as f:
+        jpeg = f.read()
+    assert list(iter_pdf_images(BytesIO(make_pdf(jpeg, xref_stream=True)))) == [jpeg]
+
+
+def test_png_unpredict_memory():
+    import tracemalloc
+    import numpy as np
+    from passporteye.util.pdf import _png_unpredict
+    # A tall Paeth-filtered RGB image: the decoding must not need more than a few copies of the decoded pixels
+    n_rows, columns = 3000, 20
+    rows = np.random.RandomState(0).randint(0, 256, (n_rows, 3*columns + 1)).astype(np.uint8)
+    rows[:, 0] = 4
+    tracemalloc.start()
+    try:
+        result = _png_unpredict(rows.tobytes(), {'Predictor': 15, 'Colors': 3, 'Columns': columns})
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert len(result) == n_rows * 3 * columns
+    assert peak < 10 * n_rows * 3 * columns